@@ -0,0 +1,242 @@
+import re
+import tkinter as tk
+from tkinter import font as tkfont
+
+# 默认参数，可在 config.ini 的 [Display] 段覆盖
+# 超过此长度 (字符) 的答案一次插入后只标记可见区域附近的行，滚动时再补标
+DEFAULT_LAZY_THRESHOLD = 20000
+LAZY_MARGIN = 80  # 可见区域上下额外标记的行数
+
+FENCE = re.compile(r'^ {0,3}(```|~~~)\s*([\w+#.-]*)')
+HEADING = re.compile(r'^ {0,3}(#{1,6})\s')
+QUOTE = re.compile(r'^ {0,3}>')
+INLINE = re.compile(r'(?P<md_inline_code>`[^`\n]+`)|(?P<md_bold>\*\*[^*\n]+\*\*|__[^_\n]+__)')
+
+# 代码高亮只按行匹配 (跨行的字符串和块注释不处理)，不同语言共用一套简单规则
+KEYWORDS = {
+    'python': 'and as assert async await break class continue def del elif else except finally for from global if '
+              'import in is lambda nonlocal not or pass raise return try while with yield None True False self',
+    'javascript': 'async await break case catch class const continue default delete do else export extends false '
+                  'finally for from function if import in instanceof interface let new null return switch this '
+                  'throw true try type typeof undefined var void while yield',
+    'c': 'auto bool break case char class const continue default defer do double else enum extern false final float '
+         'fn for func go if impl import int interface let long loop match mod mut namespace new nil null package '
+         'private protected pub public return self short static struct switch template this throw trait true try '
+         'type union unsigned use using var void while',
+    'shell': 'case do done echo elif else esac exit export fi for function if in local return then while',
+    'sql': 'and as by create delete desc drop from group having index insert into join left limit not null on or '
+           'order primary select set table update values where',
+}
+LANGUAGES = {
+    'py': 'python', 'python': 'python', 'python3': 'python',
+    'js': 'javascript', 'javascript': 'javascript', 'ts': 'javascript', 'typescript': 'javascript', 'jsx': 'javascript',
+    'tsx': 'javascript', 'json': 'javascript',
+    'c': 'c', 'h': 'c', 'cpp': 'c', 'c++': 'c', 'cc': 'c', 'java': 'c', 'cs': 'c', 'csharp': 'c', 'go': 'c',
+    'rust': 'c', 'rs': 'c', 'kotlin': 'c', 'swift': 'c',
+    'sh': 'shell', 'bash': 'shell', 'shell': 'shell', 'zsh': 'shell', 'powershell': 'shell', 'ps1': 'shell',
+    'sql': 'sql',
+}
+HASH_COMMENT = {'python', 'shell'}
+
+
+def code_pattern(language):
+    words = KEYWORDS.get(language) or ' '.join(KEYWORDS[name] for name in ('python', 'javascript', 'c'))
+    if language in HASH_COMMENT:
+        comment = r'#.*$'
+    elif language == 'sql':
+        comment = r'--.*$'
+    elif language is None:
+        comment = r'#(?![a-z]).*$|//.*$'  # 语言未知: 不把 #include 之类当成注释
+    else:
+        comment = r'//.*$'
+    return re.compile(
+        rf'(?P<code_comment>{comment})'
+        r'|(?P<code_string>"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\')'
+        r'|(?P<code_number>\b\d+(?:\.\d+)?\b)'
+        rf'|(?P<code_keyword>\b(?:{"|".join(sorted(set(words.split())))})\b)',
+        re.IGNORECASE if language == 'sql' else 0)
+
+
+CODE_PATTERNS = {language: code_pattern(language) for language in list(KEYWORDS) + [None]}
+
+TAGS = ('md_h1', 'md_h2', 'md_h3', 'md_quote', 'md_fence', 'md_code', 'md_inline_code', 'md_bold',
+        'code_keyword', 'code_string', 'code_number', 'code_comment')
+
+
+def classify(line, code):
+    """(kind, info, code_after) for one line; code is the open code block's language key, or None."""
+    fence = FENCE.match(line)
+    if code is None:
+        if fence:
+            return 'fence', None, LANGUAGES.get(fence.group(2).lower(), '')
+        heading = HEADING.match(line)
+        if heading:
+            return 'heading', len(heading.group(1)), None
+        if QUOTE.match(line):
+            return 'quote', None, None
+        return 'text', None, None
+    if fence and not fence.group(2):
+        return 'fence', None, None  # 代码块结束
+    return 'code', code, code
+
+
+class MarkdownRenderer:
+    """Markdown formatting for the answer box, applied as Tk tags over the raw text.
+
+    The text itself is left unchanged, so copying and editing still see the
+    model's Markdown. Lines are classified in Python (headings, quotes,
+    fenced code blocks) and only new or changed lines are tagged: append()
+    tags the streamed lines, set_text() tags everything for short answers
+    and, above lazy_threshold characters, only the lines around the visible
+    region, tagging more as the box is scrolled. Tag ranges are collected
+    first and added with one tag_add call per tag.
+    """
+
+    def __init__(self, widget, enabled=True, lazy_threshold=DEFAULT_LAZY_THRESHOLD):
+        self.widget = widget
+        self.enabled = enabled
+        self.lazy_threshold = lazy_threshold
+        self.lines = ['']
+        self.states = []  # 每行的 (kind, info, code_after)
+        self.tagged = bytearray()
+        self.lazy = False
+        self._visible_after = None
+        if enabled:
+            self._configure_tags()
+            vbar = getattr(widget, 'vbar', None)  # ScrolledText 的滚动条
+            if vbar is not None:
+                widget.configure(yscrollcommand=lambda first, last: (vbar.set(first, last), self._schedule_visible()))
+
+    @classmethod
+    def from_config(cls, config, widget):
+        if not config.has_section('Display'):
+            return cls(widget)
+        section = config['Display']
+        return cls(widget, enabled=section.getboolean('Markdown', True),
+                   lazy_threshold=int(section.get('LazyThresholdChars', DEFAULT_LAZY_THRESHOLD)))
+
+    def _configure_tags(self):
+        base = tkfont.Font(root=self.widget, font=self.widget.cget('font'))
+        size = abs(base.actual('size')) or 10
+        family = base.actual('family')
+        w = self.widget
+        w.tag_configure('md_h1', font=(family, size + 6, 'bold'))
+        w.tag_configure('md_h2', font=(family, size + 4, 'bold'))
+        w.tag_configure('md_h3', font=(family, size + 2, 'bold'))
+        w.tag_configure('md_quote', foreground='#555555', lmargin1=12, lmargin2=12)
+        w.tag_configure('md_fence', foreground='grey')
+        w.tag_configure('md_code', background='#f5f5f5', font='TkFixedFont')
+        w.tag_configure('md_inline_code', background='#eeeeee', font='TkFixedFont')
+        w.tag_configure('md_bold', font=(family, size, 'bold'))
+        # 后配置的标签优先级更高
+        w.tag_configure('code_keyword', foreground='#0000cc')
+        w.tag_configure('code_string', foreground='#a31515')
+        w.tag_configure('code_number', foreground='#098658')
+        w.tag_configure('code_comment', foreground='#008000')
+
+    def set_text(self, text):
+        """Replace the whole answer."""
+        w = self.widget
+        w.delete('1.0', tk.END)
+        w.insert(tk.END, text)
+        if not self.enabled:
+            return
+        self.lines = text.split('\n')
+        self.states = []
+        self._parse_from(0)
+        self.tagged = bytearray(len(self.lines))
+        self.lazy = len(text) > self.lazy_threshold
+        if self.lazy:
+            self._schedule_visible()
+        else:
+            self._tag_lines(range(1, len(self.lines) + 1))
+
+    def append(self, text):
+        """Append streamed text; only the lines it touches are (re)tagged."""
+        if not text:
+            return
+        self.widget.insert(tk.END, text)
+        if not self.enabled:
+            return
+        first = len(self.lines)  # 当前最后一行 (可能只输出了一半)，需要重新标记
+        parts = text.split('\n')
+        self.lines[-1] += parts[0]
+        self.lines.extend(parts[1:])
+        self._parse_from(first - 1)
+        self.tagged.extend(bytes(len(self.lines) - len(self.tagged)))
+        self._tag_lines(range(first, len(self.lines) + 1), retag=first)
+
+    def _parse_from(self, index):
+        # 从第 index 行 (0 起) 重新分类；代码块状态取自上一行
+        del self.states[index:]
+        code = self.states[-1][2] if self.states else None
+        for line in self.lines[index:]:
+            state = classify(line, code)
+            self.states.append(state)
+            code = state[2]
+
+    def _line_ranges(self, number, ranges):
+        line = self.lines[number - 1]
+        kind, info, _ = self.states[number - 1]
+
+        def add(tag, start, end):
+            ranges.setdefault(tag, []).extend((f"{number}.{start}", f"{number}.{end}"))
+
+        if kind == 'code':
+            # 包括换行符，背景色延伸到行尾
+            ranges.setdefault('md_code', []).extend((f"{number}.0", f"{number}.end+1c"))
+            for match in CODE_PATTERNS.get(info or None, CODE_PATTERNS[None]).finditer(line):
+                add(match.lastgroup, match.start(), match.end())
+            return
+        if kind == 'fence':
+            add('md_fence', 0, len(line))
+            return
+        if kind == 'heading':
+            add(f"md_h{min(info, 3)}", 0, len(line))
+        elif kind == 'quote':
+            add('md_quote', 0, len(line))
+        for match in INLINE.finditer(line):
+            add(match.lastgroup, match.start(), match.end())
+
+    def _tag_lines(self, numbers, retag=None):
+        w = self.widget
+        if retag is not None:
+            for tag in TAGS:
+                w.tag_remove(tag, f"{retag}.0", f"{retag}.end+1c")
+        ranges = {}
+        for number in numbers:
+            self._line_ranges(number, ranges)
+            self.tagged[number - 1] = 1
+        for tag, indices in ranges.items():
+            w.tag_add(tag, *indices)
+
+    def _schedule_visible(self):
+        if self.lazy and self._visible_after is None:
+            self._visible_after = self.widget.after_idle(self._tag_visible)
+
+    def _tag_visible(self):
+        self._visible_after = None
+        if not self.lazy:
+            return
+        w = self.widget
+        first = int(w.index('@0,0').split('.')[0])
+        last = int(w.index(f"@0,{w.winfo_height()}").split('.')[0])
+        start = max(1, first - LAZY_MARGIN)
+        end = min(len(self.lines), last + LAZY_MARGIN)
+        pending = [n for n in range(start, end + 1) if not self.tagged[n - 1]]
+        if not pending:
+            return
+        # 答案框可以编辑；内容与缓冲不一致时重新同步后再标记
+        if w.get(f"{start}.0", f"{end}.end") != '\n'.join(self.lines[start - 1:end]):
+            self._resync()
+            pending = list(range(start, min(len(self.lines), end) + 1))
+        self._tag_lines(pending)
+
+    def _resync(self):
+        w = self.widget
+        for tag in TAGS:
+            w.tag_remove(tag, '1.0', tk.END)
+        self.lines = w.get('1.0', 'end-1c').split('\n')
+        self.states = []
+        self._parse_from(0)
+        self.tagged = bytearray(len(self.lines))
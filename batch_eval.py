@@ -0,0 +1,224 @@
+"""Headless batch evaluation: run a file of prompts against one or more models.
+
+    python batch_eval.py prompts.jsonl --models llama3.2,qwen2.5 --concurrency 2
+    python batch_eval.py prompts.csv --models llama3.2 --servers 10.0.0.2:11434,10.0.0.3:11434
+
+Each input row needs a "question" (or "prompt") field and may carry "id"
+and "topic". Answers are saved to the questions table of ollama_QA.db,
+so they show up in the GUI history. Rows already completed for the same
+--run name are skipped, so an interrupted run can simply be restarted.
+"""
+import argparse
+import configparser
+import csv
+import hashlib
+import json
+import logging
+import os
+import queue
+import sys
+
+import chat_jobs
+import qa_db
+from host_pool import HostPool, host_url
+from metrics import percentile, request_record
+from model_options import ModelOptions
+from ollama_client import OllamaClient
+
+
+def read_prompts(path):
+    # 支持 JSONL 和 CSV，字段: question/prompt (必填)、id、topic
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith('.csv'):
+            rows = list(enumerate(csv.DictReader(f), 1))
+        else:
+            rows = [(number, parse_line(line, number)) for number, line in enumerate(f, 1) if line.strip()]
+    prompts = []
+    for number, row in rows:
+        question = (row.get('question') or row.get('prompt') or '').strip()
+        if not question:
+            logging.warning(f"Skipping row {number}: no question/prompt field")
+            continue
+        key = str(row.get('id') or hashlib.sha1(question.encode('utf-8')).hexdigest())
+        prompts.append({'key': key, 'topic': row.get('topic') or '', 'question': question})
+    return prompts
+
+
+def parse_line(line, number):
+    try:
+        row = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"Line {number}: invalid JSON ({e})") from None
+    if not isinstance(row, dict):
+        raise ValueError(f"Line {number}: expected a JSON object with a question field, not {type(row).__name__}")
+    return row
+
+
+def host_pool(args, config):
+    # --servers 覆盖 config.ini 中的 [Server] Address/Port 和 Hosts
+    if not args.servers:
+        return HostPool.from_config(config)
+    urls = [host_url(host) for host in args.servers.split(',') if host.strip()]
+    return HostPool([OllamaClient.from_config(config, url) for url in urls])
+
+
+class BatchRunner:
+    def __init__(self, db, pool, run, concurrency, options=None, model_options=None):
+        self.db = db
+        self.pool = pool
+        self.run = run
+        self.concurrency = concurrency
+        self.options = options
+        self.model_options = model_options  # 没有 --options 时使用 GUI 中为每个模型保存的参数
+        self.events = queue.Queue()
+        # 主机的选择 (模型所在、未完成请求最少) 和故障转移由 HostPool 负责
+        self.scheduler = chat_jobs.RequestScheduler(
+            pool, self.on_job_event, workers=concurrency * len(pool.hosts), max_per_server=concurrency)
+        self.waiting = {}  # job id -> 等待该结果的任务 (重复的问题合并为一个请求)
+        self.completed = 0
+        self.failed = 0
+
+    def on_job_event(self, job, event, data):
+        if event in (chat_jobs.DONE, chat_jobs.FAILED, chat_jobs.CANCELLED):
+            self.events.put((job, event, data))
+
+    def submit(self, task):
+        payload = {"model": task['model'], "messages": [{"role": "user", "content": task['question']}]}
+        if self.options:
+            payload["options"] = self.options
+        if self.model_options:
+            self.model_options.apply(payload)
+        job, _ = self.scheduler.submit(task['model'], task['topic'], task['question'], payload)
+        self.waiting.setdefault(job.id, []).append(task)
+
+    def execute(self, tasks):
+        total = len(tasks)
+        pending = list(reversed(tasks))
+        finished = 0
+        # 每台服务器平均最多预先排队 2 倍并发数的请求，其余留在本地，
+        # 这样主机是在开始执行时才选定的，能跟上各主机的实际速度
+        limit = self.concurrency * 2 * len(self.pool.hosts)
+        while pending or self.waiting:
+            while pending and len(self.waiting) < limit:
+                self.submit(pending.pop())
+            # 带超时等待，Windows 上 Ctrl+C 才能中断阻塞的 get()
+            try:
+                job, event, error = self.events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            job_tasks = self.waiting.pop(job.id)
+            for task in job_tasks:
+                finished += 1
+                if event == chat_jobs.DONE:
+                    self.record(task, job)
+                    self.completed += 1
+                    m = job.metrics()
+                    rate = f"{m['tokens_per_sec']:.1f} tok/s" if m['tokens_per_sec'] else "-"
+                    print(f"[{finished}/{total}] {job.model} ok {m['latency']:.2f}s {rate}  {task['key']}")
+                else:
+                    self.failed += 1
+                    print(f"[{finished}/{total}] {job.model} {event}: {error}  {task['key']}")
+
+    def record(self, task, job):
+        m = job.metrics()
+        topic = task['topic'] or f"batch:{self.run}"
+        # 写线程会把同时完成的结果合并成一个事务提交
+        self.db.submit_write(qa_db.insert_batch_result, self.run, task['key'], job.model, job.server,
+                             topic, task['question'], job.answer,
+                             m['latency'], m['ttft'], m['tokens'], m['tokens_per_sec'], request_record(job),
+                             job.payload.get('options'),
+                             on_error=lambda e: logging.error(f"Database Error: {e}"))
+
+    def cancel_all(self):
+        self.scheduler.shutdown()
+
+    def close(self):
+        self.scheduler.shutdown()
+        self.pool.close()
+
+
+def print_report(rows):
+    by_model = {}
+    for model, latency, ttft, tokens, tokens_per_sec in rows:
+        by_model.setdefault(model, []).append((latency, ttft, tokens, tokens_per_sec))
+    header = f"{'model':<28}{'n':>6}{'p50 s':>9}{'p90 s':>9}{'p99 s':>9}{'ttft p50':>10}{'tok/s p50':>11}{'tok/s mean':>12}"
+    print(header)
+    print('-' * len(header))
+
+    def fmt(value, width, digits=2):
+        return f"{value:>{width}.{digits}f}" if value is not None else f"{'-':>{width}}"
+
+    for model, results in sorted(by_model.items()):
+        latencies = [r[0] for r in results]
+        ttfts = [r[1] for r in results]
+        rates = [r[3] for r in results if r[3] is not None]
+        mean_rate = sum(rates) / len(rates) if rates else None
+        print(f"{model:<28}{len(results):>6}"
+              f"{fmt(percentile(latencies, 50), 9)}{fmt(percentile(latencies, 90), 9)}{fmt(percentile(latencies, 99), 9)}"
+              f"{fmt(percentile(ttfts, 50), 10)}{fmt(percentile(rates, 50), 11, 1)}{fmt(mean_rate, 12, 1)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a JSONL/CSV file of prompts against Ollama models and save the answers.")
+    parser.add_argument('prompts', help="JSONL or CSV file with a question/prompt column")
+    parser.add_argument('--models', required=True, help="comma separated model names")
+    parser.add_argument('--servers', help="comma separated host:port list (default: [Server] Address/Port and Hosts in config.ini)")
+    parser.add_argument('--concurrency', type=int, default=2, help="parallel generations per server (default 2)")
+    parser.add_argument('--run', help="run name used for resuming and reporting (default: prompts file name)")
+    parser.add_argument('--options', help='generation options as JSON, e.g. \'{"temperature": 0}\' (default: the options saved for each model)')
+    parser.add_argument('--db', default=qa_db.DEFAULT_DATABASE, help="database file (default ollama_QA.db)")
+    parser.add_argument('--config', default='config.ini', help="config file (default config.ini)")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s:%(levelname)s:%(message)s')
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    run = args.run or os.path.splitext(os.path.basename(args.prompts))[0]
+    models = [model.strip() for model in args.models.split(',') if model.strip()]
+    options = json.loads(args.options) if args.options else None
+    try:
+        prompts = read_prompts(args.prompts)
+    except ValueError as e:
+        parser.error(f"{args.prompts}: {e}")
+
+    db = qa_db.QADatabase.from_config(config, args.db)
+    done = db.read(qa_db.fetch_batch_done, run)
+    profiles = ModelOptions.from_config(config, db)
+    profiles.profiles = db.read(qa_db.fetch_model_options)
+    tasks = [dict(prompt, model=model) for prompt in prompts for model in models
+             if (prompt['key'], model) not in done]
+    skipped = len(prompts) * len(models) - len(tasks)
+    pool = host_pool(args, config)
+    pool.check_all()
+    for host in pool.hosts:
+        if not host.healthy:
+            print(f"Warning: {host.url} is not reachable ({host.last_error})")
+    pool.start_monitor()
+    print(f"Run '{run}': {len(tasks)} generations on {len(pool.hosts)} server(s), {skipped} already completed")
+
+    runner = BatchRunner(db, pool, run, args.concurrency, options, profiles)
+    interrupted = False
+    try:
+        runner.execute(tasks)
+    except KeyboardInterrupt:
+        # 已完成的结果都已入队写入，重新执行同一命令即可续跑
+        interrupted = True
+        print("\nInterrupted, cancelling outstanding requests...")
+        runner.cancel_all()
+    finally:
+        runner.close()
+        db.flush()
+    try:
+        rows = db.read(qa_db.fetch_batch_results, run)
+    finally:
+        db.close()
+    print(f"\n{runner.completed} completed, {runner.failed} failed this session; {len(rows)} results in run '{run}'\n")
+    print_report(rows)
+    return 130 if interrupted else (1 if runner.failed else 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,316 @@
+"""Offline benchmarks for the client side: streaming, database and history list.
+
+    python benchmark.py
+    python benchmark.py --quick --output benchmarks/before.json
+    python benchmark.py --scenarios parse,insert --compare benchmarks/before.json
+
+Everything runs against mock_ollama.py and temporary databases, so no
+Ollama server is needed and ollama_QA.db is not touched. Results (with
+Python/SQLite versions and the git commit) are written to a JSON file in
+benchmarks/ (ignored by git); --compare prints the change against an earlier results file.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import queue
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+import chat_jobs
+import qa_db
+import qa_export
+from host_pool import HostPool
+from metrics import percentile
+from mock_ollama import MockOllama
+from ollama_client import OllamaClient, iter_chat
+
+SCENARIOS = ('ttft', 'stream', 'parse', 'insert', 'history', 'export')
+DEFAULT_ROWS = (10000, 100000)
+QUICK_ROWS = (2000, 10000)
+DEFAULT_OUTPUT = os.path.join('benchmarks', 'results.json')  # benchmarks/ 在 .gitignore 中
+HISTORY_PAGE_SIZE = 100  # 与 ollama-ui-win.py 中的 HISTORY_PAGE_SIZE 相同
+MOCK_LATENCY = 0.05  # ttft 场景中服务器在第一个 token 前的等待，从测得的 TTFT 中减去
+REPEAT = 20  # 每个查询计时的次数，报告中位数
+COUNTS = ('requests', 'tokens', 'chunks', 'rows')  # 只是场景规模，比较结果时跳过
+ANSWER = ("A typical answer has a few paragraphs of text, some `inline code` and a list:\n\n"
+          "- first point with a bit of explanation\n- second point\n\n") * 12
+
+
+def ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def rate(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else None
+
+
+def median_time(fn, repeat=REPEAT):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return percentile(times, 50)
+
+
+def run_jobs(server, count, tokens, questions):
+    # 通过与界面相同的 HostPool + RequestScheduler 发送 count 个请求，一次一个
+    server.tokens = tokens
+    events = queue.Queue()
+    pool = HostPool([OllamaClient(server.url)])
+    scheduler = chat_jobs.RequestScheduler(pool, lambda job, event, data: events.put((job, event, data)), workers=1)
+    jobs = []
+    try:
+        for number in range(count):
+            job, _ = scheduler.submit('mock-llama', 'benchmark', f"{questions} {number}",
+                                      {"model": 'mock-llama', "messages": [{"role": "user", "content": f"{questions} {number}"}]})
+            while True:
+                finished, event, data = events.get()
+                if finished is job and event in (chat_jobs.DONE, chat_jobs.FAILED, chat_jobs.CANCELLED):
+                    break
+            if event != chat_jobs.DONE:
+                raise RuntimeError(f"Benchmark request failed: {data}")
+            jobs.append(job)
+    finally:
+        scheduler.shutdown()
+        pool.close()
+    return jobs
+
+
+def bench_ttft(server, quick):
+    """Client overhead before the first token: measured TTFT minus the mock's fixed latency."""
+    server.latency = MOCK_LATENCY
+    try:
+        jobs = run_jobs(server, 20 if quick else 100, 20, "ttft")
+    finally:
+        server.latency = 0
+    overhead = [job.metrics()['ttft'] - MOCK_LATENCY for job in jobs[1:]]  # 第一个请求包括建立连接
+    connect = [job.connect_time - MOCK_LATENCY for job in jobs[1:]]
+    return {'requests': len(jobs), 'ttft_overhead_ms_p50': ms(percentile(overhead, 50)),
+            'ttft_overhead_ms_p90': ms(percentile(overhead, 90)), 'connect_overhead_ms_p50': ms(percentile(connect, 50)),
+            'first_request_ttft_ms': ms(jobs[0].metrics()['ttft'] - MOCK_LATENCY)}
+
+
+def bench_stream(server, quick):
+    """End-to-end streaming throughput from the mock server through the scheduler, unthrottled."""
+    tokens = 2000 if quick else 10000
+    start = time.perf_counter()
+    jobs = run_jobs(server, 3, tokens, "stream")
+    elapsed = time.perf_counter() - start
+    return {'tokens': tokens * len(jobs), 'tokens_per_sec': rate(tokens * len(jobs), elapsed)}
+
+
+def replay_response(body):
+    # 与 requests 读取网络流时相同的 iter_lines 路径，只是数据来自内存
+    response = requests.models.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(body)
+    return response
+
+
+def bench_parse(server, quick):
+    """The iter_lines / json.loads loop of a streamed answer, without the network."""
+    count = 20000 if quick else 100000
+    lines = [json.dumps({'model': 'mock-llama', 'created_at': '2024-01-01T00:00:00Z',
+                         'message': {'role': 'assistant', 'content': f" token{index}"}, 'done': False})
+             for index in range(count)]
+    lines.append(json.dumps({'model': 'mock-llama', 'message': {'role': 'assistant', 'content': ''}, 'done': True}))
+    body = ('\n'.join(lines) + '\n').encode('utf-8')
+    start = time.perf_counter()
+    parts = []
+    for data in iter_chat(replay_response(body)):
+        content = data.get('message', {}).get('content', '')
+        if content:
+            parts.append(content)
+    elapsed = time.perf_counter() - start
+    return {'chunks': len(parts), 'chunks_per_sec': rate(len(parts), elapsed),
+            'mb_per_sec': rate(len(body) / 1048576, elapsed)}
+
+
+def bench_insert(directory, quick):
+    """Saving answers through QADatabase: queued (batched by the writer) and one blocking write at a time."""
+    count = 2000 if quick else 10000
+    db = qa_db.QADatabase(os.path.join(directory, 'insert.db'))
+    try:
+        start = time.perf_counter()
+        for number in range(count):
+            db.submit_write(qa_db.insert_answer, 'mock-llama', 'benchmark', f"question {number}", ANSWER)
+        db.flush()
+        batched = time.perf_counter() - start
+        single = median_time(lambda: db.write(qa_db.insert_answer, 'mock-llama', 'benchmark', 'single', ANSWER), 200)
+    finally:
+        db.close()
+    return {'rows': count, 'queued_rows_per_sec': rate(count, batched), 'single_write_ms_p50': ms(single)}
+
+
+def fill_history(conn, start, stop):
+    conn.execute("BEGIN")
+    qa_db.import_records(conn, ((f"model-{number % 5}", f"topic {number % 50}",
+                                 f"question {number} about sqlite paging and tokens", f"answer {number} " + ANSWER,
+                                 '2024-01-01 00:00:00') for number in range(start, stop)),
+                         skip_duplicates=False)
+    conn.execute("COMMIT")
+
+
+def treeview():
+    # 没有图形界面 (如 CI) 时返回 None，跳过 Treeview 计时
+    try:
+        import tkinter as tk
+        from tkinter import ttk
+        root = tk.Tk()
+    except Exception:
+        return None
+    root.withdraw()
+    tree = ttk.Treeview(root, columns=("ID", "Model", "Topic", "Question", "Answer", "Timestamp"), show='headings')
+    return tree
+
+
+def bench_history(directory, sizes):
+    """load_data at several archive sizes: first page, a deep page, a keyword search and the Treeview fill."""
+    conn = qa_db.connect(os.path.join(directory, 'history.db'))
+    qa_db.initialize(conn)
+    tree = treeview()
+    results = {}
+    filled = 0
+    try:
+        for size in sizes:
+            start = time.perf_counter()
+            fill_history(conn, filled, size)
+            populate = time.perf_counter() - start
+            added, filled = size - filled, size
+            page = qa_db.fetch_page(conn, None, HISTORY_PAGE_SIZE)
+            result = {
+                'populate_rows_per_sec': rate(added, populate),
+                'first_page_ms': ms(median_time(lambda: qa_db.fetch_page(conn, None, HISTORY_PAGE_SIZE))),
+                'deep_page_ms': ms(median_time(lambda: qa_db.fetch_page(conn, size // 2, HISTORY_PAGE_SIZE))),
+                'search_ms': ms(median_time(lambda: qa_db.search(conn, 'paging tokens'), 5)),
+            }
+            if tree is not None:
+                def fill_tree():
+                    tree.delete(*tree.get_children())
+                    for row in page:
+                        tree.insert('', 'end', iid=str(row[0]), values=row)
+                    tree.update_idletasks()
+                result['treeview_fill_ms'] = ms(median_time(fill_tree))
+            results[str(size)] = result
+    finally:
+        if tree is not None:
+            tree.winfo_toplevel().destroy()
+        conn.close()
+    return results
+
+
+def bench_export(directory, size):
+    """Streaming export of an archive of size records to each text format."""
+    path = os.path.join(directory, 'export.db')
+    conn = qa_db.connect(path)
+    qa_db.initialize(conn)
+    results = {'rows': size}
+    try:
+        fill_history(conn, 0, size)
+        for fmt in ('JSONL', 'CSV', 'Markdown'):
+            target = os.path.join(directory, 'export' + qa_export.FORMATS[fmt])
+            start = time.perf_counter()
+            count = qa_export.export_records(conn, target, fmt)
+            elapsed = time.perf_counter() - start
+            results[f"{fmt.lower()}_rows_per_sec"] = rate(count, elapsed)
+            results[f"{fmt.lower()}_mb_per_sec"] = rate(os.path.getsize(target) / 1048576, elapsed)
+    finally:
+        conn.close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[prefix + key] = value
+    return values
+
+
+def print_comparison(old, new):
+    # *_per_sec 越大越好，其余 (毫秒) 越小越好
+    before, after = flatten(old['scenarios']), flatten(new['scenarios'])
+    print(f"\nCompared with {old['meta'].get('commit') or '?'} ({old['meta'].get('created', '?')}):")
+    for key in sorted(after):
+        if key not in before or not before[key] or key.rsplit('.', 1)[-1] in COUNTS:
+            continue
+        change = (after[key] - before[key]) / before[key] * 100
+        better = change > 0 if key.endswith('_per_sec') else change < 0
+        mark = '' if abs(change) < 5 else (' better' if better else ' WORSE')
+        print(f"  {key:<45}{before[key]:>12}{after[key]:>12}{change:>+9.1f}%{mark}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark streaming, database and history performance offline.")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument('--rows', help=f"history sizes (default {','.join(map(str, DEFAULT_ROWS))})")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes for a fast check")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help=f"results file (default {DEFAULT_OUTPUT})")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    # 历史记录逐步填充到每个大小，必须从小到大
+    sizes = sorted({int(size) for size in args.rows.split(',')} if args.rows else set(QUICK_ROWS if args.quick else DEFAULT_ROWS))
+
+    results = {
+        'meta': {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': git_commit(), 'quick': args.quick,
+                 'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                 'platform': platform.platform()},
+        'scenarios': {},
+    }
+    server = MockOllama().start()
+    try:
+        with tempfile.TemporaryDirectory(prefix='ollama-bench-') as directory:
+            for name in scenarios:
+                print(f"Running {name}...", flush=True)
+                if name == 'ttft':
+                    result = bench_ttft(server, args.quick)
+                elif name == 'stream':
+                    result = bench_stream(server, args.quick)
+                elif name == 'parse':
+                    result = bench_parse(server, args.quick)
+                elif name == 'insert':
+                    result = bench_insert(directory, args.quick)
+                elif name == 'history':
+                    result = bench_history(directory, sizes)
+                else:
+                    result = bench_export(directory, sizes[0])
+                results['scenarios'][name] = result
+                print(f"  {json.dumps(result)}")
+    finally:
+        server.close()
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(json.load(f), results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+import hashlib
+import itertools
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ollama_client import is_missing_model, is_unreachable, iter_chat
+
+# 默认并发参数，可在 config.ini 的 [Scheduler] 段覆盖
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PER_SERVER = 2
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Job status values
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+FAILED = 'error'
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+def payload_key(payload):
+    # 相同模型 + 相同消息 (含图片) 视为同一个请求
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ChatJob:
+    _ids = itertools.count(1)
+
+    def __init__(self, model, topic, question, payload, conversation_id=None):
+        self.id = next(self._ids)
+        self.model = model
+        self.topic = topic
+        self.question = question
+        self.payload = payload
+        self.conversation_id = conversation_id
+        self.key = payload_key(payload)
+        self.shared = True  # False: 不与相同的请求合并 (比较模式的每个结果单独计时、单独保存)
+        self.status = QUEUED
+        self.error = None
+        self.parts = []
+        self.answer = ''
+        self.server = None
+        self.start_time = None
+        self.end_time = None
+        self.first_token_time = None
+        self.connect_time = None  # 发出请求到收到响应头的秒数 (含模型加载)
+        self.request_bytes = None
+        self.token_count = 0
+        self.final_data = {}
+        self.future = None
+        self.response = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def active(self):
+        return self.status in ACTIVE_STATUSES
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def text(self):
+        return ''.join(self.parts)
+
+    def metrics(self):
+        """Timing figures in seconds: latency, ttft, tokens, tokens_per_sec (None until known)."""
+        if self.start_time is None:
+            return {'latency': None, 'ttft': None, 'tokens': 0, 'tokens_per_sec': None}
+        now = self.end_time or time.perf_counter()
+        ttft = self.first_token_time - self.start_time if self.first_token_time else None
+        tokens = self.token_count
+        rate = None
+        eval_count = self.final_data.get('eval_count')
+        eval_duration = self.final_data.get('eval_duration')
+        if eval_count and eval_duration:
+            # Ollama 在 done 消息里报告的精确值 (eval_duration 单位为纳秒)
+            tokens = eval_count
+            rate = eval_count / (eval_duration / 1e9)
+        elif self.first_token_time:
+            elapsed = now - self.first_token_time
+            rate = tokens / elapsed if elapsed > 0 else 0.0
+        return {'latency': now - self.start_time, 'ttft': ttft, 'tokens': tokens, 'tokens_per_sec': rate}
+
+    def stats(self):
+        if self.status == QUEUED:
+            return "Queued"
+        if self.first_token_time is None:
+            return "Waiting for first token..."
+        m = self.metrics()
+        return f"TTFT {m['ttft']:.2f}s | {m['tokens_per_sec']:.1f} tokens/s | {m['tokens']} tokens | {m['latency']:.1f}s total"
+
+
+class RequestScheduler:
+    """Runs chat jobs on a bounded worker pool.
+
+    Each job is routed to a host of the ``HostPool``; at most
+    ``max_per_server`` jobs stream from one server at a time, a job whose
+    server is unreachable before the first token moves to another host,
+    identical in-flight requests are merged, and every state change is
+    reported through ``listener(job, event, data)`` from the worker
+    thread; the GUI forwards those into its Tk poll loop.
+    """
+
+    def __init__(self, pool, listener, workers=DEFAULT_WORKERS, max_per_server=DEFAULT_MAX_PER_SERVER):
+        self.pool = pool
+        self.listener = listener
+        self.max_per_server = max_per_server
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._server_slots = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chat-job')
+
+    @classmethod
+    def from_config(cls, config, pool, listener):
+        section = config['Scheduler'] if config.has_section('Scheduler') else {}
+        return cls(
+            pool, listener,
+            workers=int(section.get('Workers', DEFAULT_WORKERS)),
+            max_per_server=int(section.get('MaxPerServer', DEFAULT_MAX_PER_SERVER)),
+        )
+
+    def submit(self, model, topic, question, payload, conversation_id=None, shared=True):
+        """Queue a job; returns (job, is_new). A duplicate returns the in-flight job unless shared is False."""
+        job = ChatJob(model, topic, question, payload, conversation_id)
+        job.shared = shared
+        with self._lock:
+            for existing in self.jobs.values():
+                if shared and existing.shared and existing.active and existing.key == job.key:
+                    return existing, False
+            self.jobs[job.id] = job
+        self.listener(job, QUEUED, None)
+        job.future = self._executor.submit(self._run, job)
+        return job, True
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or not job.active:
+            return
+        job.cancel_event.set()
+        if job.future and job.future.cancel():
+            # 还没开始执行，直接标记取消
+            self._finish(job, CANCELLED)
+            return
+        response = job.response
+        if response is not None:
+            response.close()  # 中断正在读取的流；尚未连上的请求会在收到响应后检查取消标记
+
+    def active_jobs(self):
+        return [job for job in self.jobs.values() if job.active]
+
+    def forget(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is not None and not job.active:
+                del self.jobs[job_id]
+
+    def shutdown(self):
+        for job in self.active_jobs():
+            self.cancel(job.id)
+        self._executor.shutdown(wait=False)
+
+    def _slot(self, server):
+        with self._lock:
+            if server not in self._server_slots:
+                self._server_slots[server] = threading.BoundedSemaphore(self.max_per_server)
+            return self._server_slots[server]
+
+    def _finish(self, job, status, error=None):
+        job.end_time = time.perf_counter()
+        job.status = status
+        job.error = error
+        self.listener(job, status, error)
+
+    def _run(self, job):
+        # 在可用的主机间故障转移: 只在收到第一个 token 之前换主机，避免重复输出
+        tried = set()
+        error = None
+        while not job.cancelled:
+            host = self.pool.pick(job.model, exclude=tried)
+            if host is None:
+                break
+            job.server = host.url
+            try:
+                error = self._attempt(job, host)
+            finally:
+                self.pool.release(host)
+            if error is None:
+                return
+            tried.add(host.url)
+            if job.cancelled or job.first_token_time is not None:
+                break
+            if is_unreachable(error):
+                self.pool.mark_failed(host, error)
+            elif not is_missing_model(error):
+                break
+            logging.warning(f"Job {job.id} failed on {host.url} ({error}), trying another host")
+        if job.cancelled:
+            self._finish(job, CANCELLED)
+            return
+        error = error or ValueError(f"No Ollama server available for {job.model}")
+        logging.error(f"RequestException: {error}")
+        self._finish(job, FAILED, error)
+
+    def _attempt(self, job, host):
+        """Stream job from host; returns the exception on failure, otherwise finishes the job."""
+        slot = self._slot(host.url)
+        # 等待该服务器的空闲名额，期间仍可取消
+        while not slot.acquire(timeout=0.2):
+            if job.cancelled:
+                self._finish(job, CANCELLED)
+                return None
+        try:
+            if job.cancelled:
+                self._finish(job, CANCELLED)
+                return None
+            return self._stream(job, host.client)
+        finally:
+            slot.release()
+
+    def _stream(self, job, client):
+        # 日志中只记录问题开头，完整内容在数据库里
+        logging.info(f"Sending question to model {job.model} on {client.base_url}: {job.question[:80]!r}")
+        job.status = RUNNING
+        attempt_start = time.perf_counter()
+        if job.start_time is None:
+            job.start_time = attempt_start
+        self.listener(job, RUNNING, None)
+        try:
+            # 自己序列化一次，顺便得到请求大小
+            body = json.dumps(job.payload).encode('utf-8')
+            job.request_bytes = len(body)
+            job.response = client.post("/api/chat", data=body, headers=JSON_HEADERS, stream=True)
+            job.connect_time = time.perf_counter() - attempt_start
+            job.response.raise_for_status()
+            for data in iter_chat(job.response):
+                # cancel() 关闭连接前就已到达的数据也不再处理
+                if job.cancelled:
+                    break
+                content = data.get('message', {}).get('content', '')
+                if content:
+                    if job.first_token_time is None:
+                        job.first_token_time = time.perf_counter()
+                    job.token_count += 1
+                    job.parts.append(content)
+                    self.listener(job, 'chunk', content)
+                if data.get('done', False):
+                    job.final_data = data
+        except Exception as e:
+            if not job.cancelled:
+                return e
+        finally:
+            if job.response is not None:
+                job.response.close()
+
+        if job.cancelled:
+            logging.info(f"Job {job.id} for {job.model} cancelled")
+            self._finish(job, CANCELLED)
+            return None
+        job.answer = job.text().strip()
+        logging.info(f"Answer from {job.model} finished: {job.stats()}")
+        self._finish(job, DONE)
+        return None
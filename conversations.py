@@ -0,0 +1,114 @@
+import logging
+import re
+
+# 默认对话参数，可在 config.ini 的 [Conversation] 段覆盖
+DEFAULT_TOKEN_BUDGET = 4096
+DEFAULT_KEEP_ALIVE = '30m'
+
+# 摘要占用的预算比例上限，超出部分的早期对话会被压缩进摘要
+SUMMARY_SHARE = 0.25
+
+SUMMARY_PROMPT = ("Summarise the conversation below in a few sentences. Keep names, numbers, decisions "
+                  "and open questions; write in the same language as the conversation.")
+
+_CJK = re.compile(r'[　-〿぀-ヿ㐀-䶿一-鿿가-힯＀-￯]')
+
+
+def estimate_tokens(text):
+    # 没有模型分词器时的粗略估计: 中日韩字符约 1 token/字，其它约 4 字符/token
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class ConversationSettings:
+    def __init__(self, token_budget=DEFAULT_TOKEN_BUDGET, keep_alive=DEFAULT_KEEP_ALIVE):
+        self.token_budget = token_budget
+        self.keep_alive = keep_alive
+
+    @classmethod
+    def from_config(cls, config):
+        section = config['Conversation'] if config.has_section('Conversation') else {}
+        return cls(
+            token_budget=int(section.get('TokenBudget', DEFAULT_TOKEN_BUDGET)),
+            keep_alive=section.get('KeepAlive', DEFAULT_KEEP_ALIVE),
+        )
+
+
+def select_history(history, budget):
+    """Split history into (dropped, kept) so the newest turns fit in budget tokens.
+
+    history is a list of (id, role, content, tokens) rows, oldest first.
+    """
+    used = 0
+    start = len(history)
+    for index in range(len(history) - 1, -1, -1):
+        tokens = history[index][3]
+        if used + tokens > budget:
+            break
+        used += tokens
+        start = index
+    # 不从助手回复开始，保证保留的上下文以用户提问开头
+    while start < len(history) and history[start][1] != 'user':
+        start += 1
+    return history[:start], history[start:]
+
+
+def build_messages(summary, history, question, budget, images=None):
+    """Return (messages, prompt_tokens, kept_turns) for /api/chat.
+
+    Older turns that do not fit in the budget are left out; the stored
+    summary stands in for everything before them.
+    """
+    summary_tokens = estimate_tokens(summary)
+    question_tokens = estimate_tokens(question)
+    _, kept = select_history(history, max(0, budget - summary_tokens - question_tokens))
+
+    messages = []
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    for _, role, content, _ in kept:
+        messages.append({"role": role, "content": content})
+    current = {"role": "user", "content": question}
+    if images:
+        current["images"] = images
+    messages.append(current)
+    prompt_tokens = summary_tokens + question_tokens + sum(row[3] for row in kept)
+    return messages, prompt_tokens, len(kept) // 2
+
+
+def overflow(history, budget):
+    """Messages to fold into the summary once history outgrows its share of the budget.
+
+    Trims down to half of that share so a summary is not needed after every turn.
+    """
+    limit = int(budget * (1 - SUMMARY_SHARE))
+    if sum(row[3] for row in history) <= limit:
+        return []
+    dropped, _ = select_history(history, limit // 2)
+    return dropped
+
+
+def summarize(client, model, summary, dropped, keep_alive):
+    # 把旧摘要和被裁掉的对话合并成新的摘要 (在后台线程中调用)
+    transcript = '\n\n'.join(f"{role}: {content}" for _, role, content, _ in dropped)
+    if summary:
+        transcript = f"Earlier summary: {summary}\n\n{transcript}"
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript},
+        ],
+        "stream": False,
+        "keep_alive": keep_alive,
+    }
+    response = client.post("/api/chat", json=payload)
+    response.raise_for_status()
+    data = response.json()
+    if "error" in data:
+        raise ValueError(data["error"])
+    new_summary = data.get('message', {}).get('content', '').strip()
+    logging.info(f"Summarised {len(dropped)} messages into {estimate_tokens(new_summary)} tokens")
+    return new_summary
@@ -0,0 +1,65 @@
+"""Maintenance for ollama_QA.db: migrate, (de)compress answers, optimise, ANALYZE and VACUUM.
+
+    python db_maintenance.py
+    python db_maintenance.py --compress --min-bytes 1024
+    python db_maintenance.py --decompress
+
+Close the GUI and any batch runs first; VACUUM needs the database to
+itself for a moment. The file size before and after is printed.
+"""
+import argparse
+import configparser
+import logging
+import sys
+
+import qa_db
+
+
+def megabytes(size):
+    return f"{size / 1048576:.1f} MB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compact and optimise the Q&A database.")
+    parser.add_argument('--db', default=qa_db.DEFAULT_DATABASE, help="database file (default ollama_QA.db)")
+    parser.add_argument('--config', default='config.ini', help="config file (default config.ini)")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--compress', action='store_true', help="zlib-compress existing long answers")
+    group.add_argument('--decompress', action='store_true', help="store every answer as plain text again")
+    parser.add_argument('--min-bytes', type=int, help="answers at least this long are compressed (default [Database] CompressMinBytes)")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s:%(levelname)s:%(message)s')
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    compress_min = None
+    if args.compress:
+        default = config['Database'].get('CompressMinBytes') if config.has_section('Database') else None
+        compress_min = args.min_bytes or int(default or qa_db.DEFAULT_COMPRESS_MIN_BYTES)
+    conn = qa_db.connect(args.db, compress_min)
+    try:
+        # 打开时先执行尚未执行的结构迁移
+        version = qa_db.schema_version(conn)
+        qa_db.initialize(conn)
+        if version != qa_db.schema_version(conn):
+            print(f"Migrated schema from version {version} to {qa_db.schema_version(conn)}")
+        if args.compress or args.decompress:
+            conn.execute("BEGIN")
+            changed = qa_db.repack_answers(conn, compress_min)
+            conn.execute("COMMIT")
+            print(f"{'Compressed' if args.compress else 'Decompressed'} {changed} answers")
+        records = conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+        compressed = conn.execute(qa_db.SELECT_COMPRESSED).fetchone()[0]
+        before, after = qa_db.maintain(conn, args.db)
+    finally:
+        conn.close()
+    print(f"{records} records, {compressed} compressed answers")
+    print(f"Size: {megabytes(before)} -> {megabytes(after)} ({megabytes(before - after)} reclaimed)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
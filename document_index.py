@@ -0,0 +1,430 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import conversations
+import qa_db
+import semantic_index
+from semantic_index import VectorStore
+
+# PDF 文件需要 pip install pypdf，没有时只索引文本文件；第一次扫描时才导入 (见 load_pypdf)
+pypdf = None
+
+# 默认参数，可在 config.ini 的 [Documents] 段覆盖
+DEFAULT_INDEX_FILE = 'documents.db'
+DEFAULT_CHUNK_CHARS = 1500
+DEFAULT_CHUNK_OVERLAP = 200
+DEFAULT_TOP_K = 4
+DEFAULT_TOKEN_BUDGET = 1500  # 随问题发送的文档摘录上限 (估算 token 数)
+DEFAULT_MIN_SCORE = 0.3
+DEFAULT_MAX_FILE_MB = 20
+DEFAULT_RESCAN_MINUTES = 0  # 0: 只在启动和手动 Reindex 时扫描
+TEXT_EXTENSIONS = ('.txt', '.md', '.markdown', '.rst', '.log')
+HASH_BLOCK = 1 << 20
+RETRY_SECONDS = 60
+
+CONTEXT_PROMPT = ("Use the following excerpts from the user's documents when they are relevant to the question. "
+                  "Mention the file name when you rely on an excerpt.")
+
+# 索引单独保存在 documents.db，可以随时删除后重建
+CREATE_TABLES = [
+    "CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY)",
+    '''
+    CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE,
+        mtime REAL NOT NULL,
+        size INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        model TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS chunks (
+        id INTEGER PRIMARY KEY,
+        file_id INTEGER NOT NULL REFERENCES files(id),
+        position INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        vector BLOB NOT NULL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS chunks_file ON chunks (file_id)",
+]
+INSERT_FOLDER = "INSERT OR IGNORE INTO folders (path) VALUES (?)"
+DELETE_FOLDER = "DELETE FROM folders WHERE path=?"
+SELECT_FOLDERS = "SELECT path FROM folders ORDER BY path"
+SELECT_FILES = "SELECT path, id, mtime, size, sha256, model FROM files"
+UPDATE_FILE_STAT = "UPDATE files SET mtime=?, size=? WHERE id=?"
+UPSERT_FILE = '''
+    INSERT INTO files (path, mtime, size, sha256, model) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(path) DO UPDATE SET mtime=excluded.mtime, size=excluded.size, sha256=excluded.sha256, model=excluded.model
+'''
+SELECT_FILE_ID = "SELECT id FROM files WHERE path=?"
+SELECT_FILE_CHUNKS = "SELECT id FROM chunks WHERE file_id=?"
+DELETE_FILE_CHUNKS = "DELETE FROM chunks WHERE file_id=?"
+DELETE_FILE = "DELETE FROM files WHERE id=?"
+INSERT_CHUNK = "INSERT INTO chunks (file_id, position, text, vector) VALUES (?, ?, ?, ?)"
+SELECT_VECTORS = '''
+    SELECT c.id, c.vector FROM chunks c JOIN files f ON f.id = c.file_id
+    WHERE f.model = ? AND c.id > ? ORDER BY c.id LIMIT ?
+'''
+SELECT_CHUNK_TEXT = '''
+    SELECT c.id, f.path, c.text FROM chunks c JOIN files f ON f.id = c.file_id
+    WHERE c.id IN (SELECT value FROM json_each(?))
+'''
+COUNT_INDEXED = "SELECT COUNT(*), (SELECT COUNT(*) FROM chunks) FROM files"
+
+
+def iter_chunks(lines, size=DEFAULT_CHUNK_CHARS, overlap=DEFAULT_CHUNK_OVERLAP):
+    """Yield chunks of about size characters from an iterable of lines.
+
+    A chunk ends at a paragraph break, or failing that a line break, in
+    its second half; the last overlap characters start the next chunk.
+    """
+    text = ''
+    for line in lines:
+        text += line
+        while len(text) >= size:
+            cut = text.rfind('\n\n', size // 2, size)
+            if cut < 0:
+                cut = text.rfind('\n', size // 2, size)
+            if cut < 0:
+                cut = size
+            chunk = text[:cut].strip()
+            if chunk:
+                yield chunk
+            text = text[cut - overlap:]
+    if text.strip():
+        yield text.strip()
+
+
+def load_pypdf():
+    global pypdf
+    if pypdf is None:
+        try:
+            import pypdf
+        except ImportError:
+            return False
+    return True
+
+
+def read_lines(path):
+    # 逐行读取，不把整个文件读进内存；PDF 逐页提取文字
+    if path.lower().endswith('.pdf'):
+        for page in pypdf.PdfReader(path).pages:
+            for line in (page.extract_text() or '').splitlines():
+                yield line + '\n'
+            yield '\n'
+        return
+    with open(path, encoding='utf-8', errors='replace') as f:
+        yield from f
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def context_prompt(excerpts):
+    """System message content for the retrieved (path, text, score) excerpts."""
+    parts = [CONTEXT_PROMPT]
+    for number, (path, text, _) in enumerate(excerpts, 1):
+        parts.append(f"[{number}] {os.path.basename(path)}\n{text}")
+    return '\n\n'.join(parts)
+
+
+class DocumentIndex:
+    """Local retrieval over document folders for retrieval-augmented answers.
+
+    A background thread walks the folders, splits text, Markdown and PDF
+    files into overlapping chunks, embeds them through /api/embed and keeps
+    chunks and vectors in documents.db. Files whose size and mtime (or
+    failing that, sha256) are unchanged are skipped, so a rescan only
+    embeds new and modified files. retrieve() returns the chunks closest
+    to a question within a token budget.
+    """
+
+    def __init__(self, pool, model=semantic_index.DEFAULT_MODEL, enabled=False, path=DEFAULT_INDEX_FILE, folders=(),
+                 chunk_chars=DEFAULT_CHUNK_CHARS, chunk_overlap=DEFAULT_CHUNK_OVERLAP, top_k=DEFAULT_TOP_K,
+                 token_budget=DEFAULT_TOKEN_BUDGET, min_score=DEFAULT_MIN_SCORE, max_file_mb=DEFAULT_MAX_FILE_MB,
+                 batch_size=semantic_index.DEFAULT_BATCH_SIZE, rescan_minutes=DEFAULT_RESCAN_MINUTES,
+                 dispatch=None, listener=None):
+        self.pool = pool
+        self.model = model
+        self.enabled = enabled
+        self.available = enabled and semantic_index.load_numpy()
+        self.path = path
+        self.initial_folders = [folder for folder in folders if folder]
+        self.chunk_chars = chunk_chars
+        self.chunk_overlap = min(chunk_overlap, chunk_chars // 4)
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.min_score = min_score
+        self.max_file_bytes = int(max_file_mb * 1024 * 1024)
+        self.batch_size = batch_size
+        self.rescan_seconds = rescan_minutes * 60 or None
+        self.dispatch = dispatch or (lambda fn, *args: fn(*args))
+        self.listener = listener
+        self.store = VectorStore() if self.available else None
+        self.files = self.chunks = 0
+        self.current = None  # 正在索引的文件
+        self.loaded = False
+        self.last_error = None
+        self._read_conn = None
+        self._read_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._queries = ThreadPoolExecutor(max_workers=1, thread_name_prefix='document-query')
+        if enabled and not self.available:
+            logging.warning("Document retrieval needs numpy (pip install numpy); it is disabled")
+
+    @classmethod
+    def from_config(cls, config, pool, dispatch=None, listener=None):
+        if not config.has_section('Documents'):
+            return cls(pool, dispatch=dispatch, listener=listener)
+        section = config['Documents']
+        return cls(
+            pool,
+            model=section.get('Model', semantic_index.DEFAULT_MODEL),
+            enabled=section.getboolean('Enabled', False),
+            path=section.get('IndexFile', DEFAULT_INDEX_FILE),
+            folders=[folder.strip() for folder in section.get('Folders', '').split(';')],
+            chunk_chars=int(section.get('ChunkChars', DEFAULT_CHUNK_CHARS)),
+            chunk_overlap=int(section.get('ChunkOverlap', DEFAULT_CHUNK_OVERLAP)),
+            top_k=int(section.get('TopK', DEFAULT_TOP_K)),
+            token_budget=int(section.get('TokenBudget', DEFAULT_TOKEN_BUDGET)),
+            min_score=float(section.get('MinScore', DEFAULT_MIN_SCORE)),
+            max_file_mb=float(section.get('MaxFileMB', DEFAULT_MAX_FILE_MB)),
+            batch_size=int(section.get('BatchSize', semantic_index.DEFAULT_BATCH_SIZE)),
+            rescan_minutes=float(section.get('RescanMinutes', DEFAULT_RESCAN_MINUTES)),
+            dispatch=dispatch,
+            listener=listener,
+        )
+
+    def start(self):
+        if self.available and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='document-index', daemon=True)
+            self._thread.start()
+
+    def reindex(self):
+        self._wake.set()
+
+    def folders(self):
+        return [row[0] for row in self._execute(SELECT_FOLDERS)]
+
+    def add_folder(self, folder):
+        self._execute(INSERT_FOLDER, (os.path.abspath(folder),))
+        self.reindex()
+
+    def remove_folder(self, folder):
+        # 文件和片段在下一次扫描时删除
+        self._execute(DELETE_FOLDER, (folder,))
+        self.reindex()
+
+    def status_text(self):
+        if not self.available:
+            return ""
+        if not self.loaded:
+            return "Documents: loading..."
+        text = f"Documents: {self.files} files, {self.chunks} chunks"
+        if self.current:
+            text += f" | indexing {os.path.basename(self.current)}"
+        elif self.last_error is not None:
+            text += " (embedding unavailable)"
+        return text
+
+    def retrieve(self, question, top_k=None, token_budget=None):
+        """(path, text, score) excerpts most similar to question that fit in token_budget."""
+        top_k = top_k or self.top_k
+        budget = self.token_budget if token_budget is None else token_budget
+        query = semantic_index.embed(self.pool, self.model, [question])[0]
+        matches = self.store.search(query, top_k, self.min_score)
+        if not matches:
+            return []
+        chunks = {row[0]: row[1:] for row in self._execute(SELECT_CHUNK_TEXT, (json.dumps([m[0] for m in matches]),))}
+        excerpts, used = [], 0
+        for chunk_id, score in matches:
+            if chunk_id not in chunks:
+                continue  # 刚被重新索引
+            path, text = chunks[chunk_id]
+            tokens = conversations.estimate_tokens(text)
+            if used + tokens > budget:
+                continue  # 放不下时尝试更短的片段
+            excerpts.append((path, text, score))
+            used += tokens
+        return excerpts
+
+    def submit(self, fn, *args, callback=None, on_error=None):
+        """Run fn(*args) off the Tk thread; callback/on_error run through dispatch."""
+        def run():
+            try:
+                result = fn(*args)
+            except Exception as e:
+                if on_error:
+                    self.dispatch(on_error, e)
+                else:
+                    logging.error(f"Document retrieval error: {e}")
+                return
+            if callback:
+                self.dispatch(callback, result)
+
+        self._queries.submit(run)
+
+    def _execute(self, sql, params=()):
+        # 界面线程与查询线程共用的连接 (写文件夹列表也走这里，语句很短)
+        with self._read_lock:
+            if self._read_conn is None:
+                self._read_conn = self._connect()
+            return self._read_conn.execute(sql, params).fetchall()
+
+    def _connect(self):
+        conn = qa_db.connect(self.path)
+        for statement in CREATE_TABLES:
+            conn.execute(statement)
+        return conn
+
+    def _notify(self):
+        if self.listener:
+            self.listener()
+
+    def _run(self):
+        try:
+            self._conn = self._connect()
+            for folder in self.initial_folders:
+                self._conn.execute(INSERT_FOLDER, (os.path.abspath(folder),))
+            self._load()
+        except Exception as e:
+            logging.error(f"Failed to open document index {self.path}: {e}")
+            return
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self._scan()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+                logging.warning(f"Document indexing with {self.model} failed: {e}")
+            self.current = None
+            self._count()
+            self._notify()
+            wait = RETRY_SECONDS if self.last_error is not None else self.rescan_seconds
+            self._wake.wait(wait)
+        self._conn.close()
+
+    def _load(self):
+        after_id = 0
+        while not self._stop.is_set():
+            rows = self._conn.execute(SELECT_VECTORS, (self.model, after_id, semantic_index.LOAD_CHUNK)).fetchall()
+            if not rows:
+                break
+            self.store.add([row[0] for row in rows], semantic_index.numpy.stack([semantic_index.unpack_vector(row[1]) for row in rows]))
+            after_id = rows[-1][0]
+        self.loaded = True
+        self._count()
+        self._notify()
+
+    def _count(self):
+        self.files, self.chunks = self._conn.execute(COUNT_INDEXED).fetchone()
+
+    def _scan(self):
+        known = {row[0]: row[1:] for row in self._conn.execute(SELECT_FILES)}
+        seen = set()
+        pdf = load_pypdf()
+        for folder in [row[0] for row in self._conn.execute(SELECT_FOLDERS)]:
+            for root, _, names in os.walk(folder):
+                for name in sorted(names):
+                    path = os.path.join(root, name)
+                    extension = os.path.splitext(name)[1].lower()
+                    if extension not in TEXT_EXTENSIONS and not (extension == '.pdf' and pdf):
+                        continue
+                    if self._stop.is_set():
+                        return
+                    try:
+                        stat = os.stat(path)
+                    except OSError as e:
+                        logging.warning(f"Skipped {path}: {e}")
+                        continue
+                    if stat.st_size > self.max_file_bytes:
+                        continue
+                    seen.add(path)
+                    self._index_file(path, stat, known.get(path))
+        # 已删除的文件或已移除的文件夹
+        for path, (file_id, *_) in known.items():
+            if path not in seen:
+                self._remove_file(file_id)
+                logging.info(f"Removed {path} from the document index")
+
+    def _index_file(self, path, stat, known):
+        # 大小和修改时间都没变则跳过；变了但内容哈希相同只更新记录
+        if known is not None:
+            file_id, mtime, size, digest, model = known
+            if model == self.model and mtime == stat.st_mtime and size == stat.st_size:
+                return
+        self.current = path
+        self._notify()
+        try:
+            new_digest = file_hash(path)
+            if known is not None and model == self.model and digest == new_digest:
+                self._conn.execute(UPDATE_FILE_STAT, (stat.st_mtime, stat.st_size, file_id))
+                return
+            texts = list(iter_chunks(read_lines(path), self.chunk_chars, self.chunk_overlap))
+        except Exception as e:  # 无法读取或解析的文件 (权限、损坏的 PDF 等)
+            logging.warning(f"Skipped {path}: {e}")
+            return
+        # 分批计算向量，全部完成后才替换旧片段；服务器错误会中止这次扫描
+        title = os.path.basename(path)
+        vectors = [semantic_index.embed(self.pool, self.model, [f"{title}\n{text}" for text in texts[i:i + self.batch_size]])
+                   for i in range(0, len(texts), self.batch_size)]
+        self._replace_file(path, stat, new_digest, texts, semantic_index.numpy.concatenate(vectors) if vectors else [])
+        logging.info(f"Indexed {path}: {len(texts)} chunks")
+
+    def _replace_file(self, path, stat, digest, texts, vectors):
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            conn.execute(UPSERT_FILE, (path, stat.st_mtime, stat.st_size, digest, self.model))
+            file_id = conn.execute(SELECT_FILE_ID, (path,)).fetchone()[0]
+            old_ids = [row[0] for row in conn.execute(SELECT_FILE_CHUNKS, (file_id,))]
+            conn.execute(DELETE_FILE_CHUNKS, (file_id,))
+            new_ids = [conn.execute(INSERT_CHUNK, (file_id, position, text, semantic_index.pack_vector(vector))).lastrowid
+                       for position, (text, vector) in enumerate(zip(texts, vectors))]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        for chunk_id in old_ids:
+            self.store.remove(chunk_id)
+        if new_ids:
+            self.store.add(new_ids, vectors)
+
+    def _remove_file(self, file_id):
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            old_ids = [row[0] for row in conn.execute(SELECT_FILE_CHUNKS, (file_id,))]
+            conn.execute(DELETE_FILE_CHUNKS, (file_id,))
+            conn.execute(DELETE_FILE, (file_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        for chunk_id in old_ids:
+            self.store.remove(chunk_id)
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._queries.shutdown(wait=False, cancel_futures=True)
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        with self._read_lock:
+            if self._read_conn is not None:
+                self._read_conn.close()
+                self._read_conn = None
@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+
+from ollama_client import OllamaClient
+
+# 健康检查间隔 (秒) 与检查请求的读取超时，可在 config.ini 的 [Server] 段覆盖
+DEFAULT_HEALTH_INTERVAL = 30
+HEALTH_READ_TIMEOUT = 5
+
+
+def host_url(host):
+    host = host.strip()
+    return host if host.startswith('http') else f"http://{host}"
+
+
+class OllamaHost:
+    def __init__(self, client):
+        self.client = client
+        self.url = client.base_url
+        self.healthy = True  # 第一次检查前先假定可用
+        self.models = set()  # /api/tags: 已下载的模型
+        self.loaded = set()  # /api/ps: 已加载到内存的模型
+        self.outstanding = 0
+        self.latency = None
+        self.last_error = None
+        self.checked = None
+
+    def status_text(self):
+        if not self.healthy:
+            return f"{self.url} down"
+        text = f"{self.url} | {self.outstanding} running"
+        if self.loaded:
+            text += f" | loaded: {', '.join(sorted(self.loaded))}"
+        return text
+
+
+class HostPool:
+    """Several Ollama servers behind one routing point.
+
+    Requests go to healthy hosts that have the model, preferring hosts
+    where it is already loaded, then the fewest outstanding requests.
+    A background monitor refreshes /api/tags and /api/ps for every host.
+    """
+
+    def __init__(self, clients, health_interval=DEFAULT_HEALTH_INTERVAL, listener=None):
+        self.hosts = [OllamaHost(client) for client in clients]
+        self.health_interval = health_interval
+        self.listener = listener
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._monitor = None
+
+    @classmethod
+    def from_config(cls, config, listener=None):
+        # [Server] Address/Port 为第一台主机，Hosts 可再列出其它主机 (逗号分隔 host:port)
+        server = config['Server']
+        urls = [f"http://{server['Address']}:{server['Port']}"]
+        for host in server.get('Hosts', '').split(','):
+            if host.strip() and host_url(host) not in urls:
+                urls.append(host_url(host))
+        clients = [OllamaClient.from_config(config, url) for url in urls]
+        return cls(clients, int(server.get('HealthInterval', DEFAULT_HEALTH_INTERVAL)), listener)
+
+    @property
+    def primary(self):
+        return self.hosts[0].client
+
+    def clients(self):
+        return [host.client for host in self.hosts]
+
+    def models(self):
+        # 所有健康主机上的模型
+        with self._lock:
+            return set().union(*(host.models for host in self.hosts if host.healthy))
+
+    def pick(self, model, exclude=()):
+        """Reserve the best host for model; the caller must release() it."""
+        with self._lock:
+            candidates = [host for host in self.hosts if host.url not in exclude]
+            healthy = [host for host in candidates if host.healthy] or candidates
+            # 只发给有这个模型的主机；都不知道时 (尚未检查) 任选
+            with_model = [host for host in healthy if model in host.models] or healthy
+            if not with_model:
+                return None
+            host = min(with_model, key=lambda h: (model not in h.loaded, h.outstanding))
+            host.outstanding += 1
+            return host
+
+    def release(self, host):
+        with self._lock:
+            host.outstanding -= 1
+        self._notify()
+
+    def mark_failed(self, host, error):
+        with self._lock:
+            host.healthy = False
+            host.last_error = error
+        logging.warning(f"Host {host.url} marked down: {error}")
+        self._notify()
+
+    def check(self, host):
+        timeout = (host.client.timeout[0], HEALTH_READ_TIMEOUT)
+        start = time.perf_counter()
+        try:
+            response = host.client.get("/api/tags", timeout=timeout)
+            response.raise_for_status()
+            models = {model['name'] for model in response.json().get('models', [])}
+            response = host.client.get("/api/ps", timeout=timeout)
+            response.raise_for_status()
+            loaded = {model['name'] for model in response.json().get('models', [])}
+        except Exception as e:
+            with self._lock:
+                host.healthy = False
+                host.last_error = e
+                host.checked = time.time()
+            return
+        with self._lock:
+            # /api/tags 的名称带 tag (如 llama3.2:latest)，同时记录不带 :latest 的写法
+            host.models = models | {name[:-len(':latest')] for name in models if name.endswith(':latest')}
+            host.loaded = loaded | {name[:-len(':latest')] for name in loaded if name.endswith(':latest')}
+            host.healthy = True
+            host.last_error = None
+            host.latency = time.perf_counter() - start
+            host.checked = time.time()
+
+    def check_all(self):
+        threads = [threading.Thread(target=self.check, args=(host,), daemon=True) for host in self.hosts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._notify()
+
+    def start_monitor(self):
+        if self._monitor is None:
+            self._monitor = threading.Thread(target=self._monitor_loop, name='host-monitor', daemon=True)
+            self._monitor.start()
+
+    def _monitor_loop(self):
+        while not self._stop.is_set():
+            self.check_all()
+            self._stop.wait(self.health_interval)
+
+    def _notify(self):
+        if self.listener:
+            self.listener(self)
+
+    def close(self):
+        self._stop.set()
+        for host in self.hosts:
+            host.client.close()
@@ -0,0 +1,126 @@
+import base64
+import hashlib
+import io
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# 默认图片参数，可在 config.ini 的 [Images] 段覆盖
+DEFAULT_MAX_EDGE = 1024  # 视觉模型一般只用到约 1 百万像素
+DEFAULT_FORMAT = 'JPEG'
+DEFAULT_QUALITY = 85
+DEFAULT_CACHE_SIZE = 32
+
+THUMBNAIL_SIZE = (360, 280)
+EXIF_ORIENTATION = 0x0112  # 1 = 无需旋转
+
+
+class PreparedImage:
+    def __init__(self, path, digest, b64, thumbnail, original_size, encoded_size, dimensions):
+        self.path = path
+        self.digest = digest
+        self.b64 = b64
+        self.thumbnail = thumbnail
+        self.original_size = original_size
+        self.encoded_size = encoded_size
+        self.dimensions = dimensions
+
+    def describe(self):
+        width, height = self.dimensions
+        return f"{width}x{height}, {self.original_size // 1024} KB -> {self.encoded_size // 1024} KB"
+
+
+class ImagePipeline:
+    """Decode, downscale and re-encode uploaded images off the UI thread.
+
+    Encoded base64 payloads are cached by content hash, so the same photo
+    is only processed once per session however often it is asked about.
+    """
+
+    def __init__(self, max_edge=DEFAULT_MAX_EDGE, image_format=DEFAULT_FORMAT, quality=DEFAULT_QUALITY, cache_size=DEFAULT_CACHE_SIZE):
+        self.max_edge = max_edge
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image')
+
+    @classmethod
+    def from_config(cls, config):
+        section = config['Images'] if config.has_section('Images') else {}
+        return cls(
+            max_edge=int(section.get('MaxEdge', DEFAULT_MAX_EDGE)),
+            image_format=section.get('Format', DEFAULT_FORMAT),
+            quality=int(section.get('Quality', DEFAULT_QUALITY)),
+            cache_size=int(section.get('CacheSize', DEFAULT_CACHE_SIZE)),
+        )
+
+    def submit(self, path, callback, on_error):
+        """Prepare path in the background; callback(PreparedImage) / on_error(exc) run in the worker thread."""
+        def job():
+            try:
+                callback(self.prepare(path))
+            except Exception as e:
+                logging.error(f"Image Error: {path}: {e}")
+                on_error(e)
+        self._executor.submit(job)
+
+    def prepare(self, path):
+        with open(path, 'rb') as img_file:
+            data = img_file.read()
+        # 缓存键包含编码参数，修改设置后不会用到旧结果
+        digest = hashlib.sha256(data).hexdigest()
+        key = (digest, self.max_edge, self.image_format, self.quality)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                cached = self._cache[key]
+                return PreparedImage(path, digest, cached.b64, cached.thumbnail, len(data), cached.encoded_size, cached.dimensions)
+
+        prepared = self._encode(path, digest, data)
+        with self._lock:
+            self._cache[key] = prepared
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        logging.info(f"Prepared image {path}: {prepared.describe()}")
+        return prepared
+
+    def _encode(self, path, digest, data):
+        # Pillow 在第一次处理图片时才导入 (在工作线程中)，不拖慢启动
+        from PIL import Image, ImageOps
+
+        # 只解码一次，缩略图和上传数据都来自同一个 Image 对象
+        img = Image.open(io.BytesIO(data))
+        source_format = img.format
+        upright = img.getexif().get(EXIF_ORIENTATION, 1) == 1
+        img = ImageOps.exif_transpose(img)
+        original_edge = max(img.size)
+        thumbnail = img.copy()
+        thumbnail.thumbnail(THUMBNAIL_SIZE)
+
+        if original_edge <= self.max_edge and source_format == self.image_format and upright:
+            # 已经足够小、格式相同且无需旋转，直接上传原文件，避免重复压缩
+            encoded = data
+        else:
+            if original_edge > self.max_edge:
+                img.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+            if self.image_format == 'JPEG' and img.mode != 'RGB':
+                # JPEG 不支持透明通道，铺白色背景
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                if img.mode in ('RGBA', 'LA', 'P'):
+                    img = img.convert('RGBA')
+                    background.paste(img, mask=img.getchannel('A'))
+                else:
+                    background.paste(img.convert('RGB'))
+                img = background
+            buffer = io.BytesIO()
+            img.save(buffer, format=self.image_format, quality=self.quality, optimize=True)
+            encoded = buffer.getvalue()
+
+        b64 = base64.b64encode(encoded).decode('utf-8')
+        return PreparedImage(path, digest, b64, thumbnail, len(data), len(encoded), img.size)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,211 @@
+import csv
+import logging
+import time
+
+import chat_jobs
+import qa_db
+
+# 面板与 Prometheus 导出中的分位数
+QUANTILES = (0.5, 0.95)
+PROMETHEUS_PREFIX = 'ollama_ui'
+
+# 汇总的耗时: (名称, request_metrics 中的列, 说明)
+TIMINGS = (
+    ('connect', 'connect_us', "Time from sending a chat request to its response headers (includes model load)."),
+    ('ttft', 'ttft_us', "Time to first token."),
+    ('total', 'total_us', "Total request duration."),
+    ('load', 'load_us', "Model load time reported by Ollama."),
+    ('prompt_eval', 'prompt_eval_us', "Prompt evaluation time reported by Ollama."),
+    ('db_write', 'db_write_us', "Time to save the answer in the local database."),
+)
+
+# 启动阶段: 导入模块、显示窗口、建立界面、第一帧、数据库就绪、模型列表刷新；全部完成后写一行日志
+STARTUP_PHASES = ('imports', 'window', 'widgets', 'first_frame', 'database', 'models')
+
+# 指标面板的列
+SUMMARY_COLUMNS = ("Model", "Requests", "Errors", "Connect p50", "TTFT p50", "TTFT p95",
+                   "Total p50", "Total p95", "Tokens/s p50", "Prompt eval p50", "DB write p50")
+
+
+def percentile(values, pct):
+    # 最近秩 (nearest-rank) 百分位数
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[int(rank) - 1]
+
+
+def micros(seconds):
+    return round(seconds * 1e6) if seconds is not None else None
+
+
+def nanos_to_micros(nanos):
+    # Ollama 报告的耗时单位为纳秒
+    return nanos // 1000 if nanos is not None else None
+
+
+def request_record(job):
+    """Row for request_metrics describing a finished ChatJob."""
+    m = job.metrics()
+    data = job.final_data
+    return {
+        'created': int(time.time()),
+        'model': job.model,
+        'server': job.server,
+        'status': job.status,
+        'request_bytes': job.request_bytes,
+        'connect_us': micros(job.connect_time),
+        'ttft_us': micros(m['ttft']),
+        'total_us': micros(m['latency']),
+        'load_us': nanos_to_micros(data.get('load_duration')),
+        'prompt_eval_count': data.get('prompt_eval_count'),
+        'prompt_eval_us': nanos_to_micros(data.get('prompt_eval_duration')),
+        'eval_count': data.get('eval_count'),
+        'eval_us': nanos_to_micros(data.get('eval_duration')),
+    }
+
+
+class StartupTimer:
+    """Seconds from ``started`` (a perf_counter value) to each startup phase."""
+
+    def __init__(self, started):
+        self.started = started
+        self.phases = {}
+
+    def mark(self, phase):
+        # 每个阶段只记录第一次
+        if phase not in self.phases:
+            self.phases[phase] = time.perf_counter() - self.started
+            if all(name in self.phases for name in STARTUP_PHASES):
+                logging.info(f"Startup phases (s): {self.text()}")
+        return self.phases[phase]
+
+    def text(self):
+        return ", ".join(f"{name}={self.phases[name]:.3f}" for name in STARTUP_PHASES if name in self.phases)
+
+
+class MetricsRecorder:
+    """Per-request timings stored in the request_metrics table."""
+
+    def __init__(self, db, enabled=True):
+        self.db = db
+        self.enabled = enabled
+
+    @classmethod
+    def from_config(cls, config, db):
+        if not config.has_section('Metrics'):
+            return cls(db)
+        return cls(db, enabled=config['Metrics'].getboolean('Enabled', True))
+
+    def for_job(self, job):
+        # 已完成的请求随答案一起写入 (qa_db.insert_answer)，这样也能量到写库时间
+        if not self.enabled or job.start_time is None:
+            return None
+        return request_record(job)
+
+    def record(self, job, on_error=None):
+        # 失败或取消的请求没有答案可保存，单独写一条
+        record = self.for_job(job)
+        if record is not None:
+            self.db.submit_write(qa_db.insert_request_metrics, record, on_error=on_error)
+
+
+def summarize(rows):
+    """Group request_metrics rows by model; timings are converted to seconds."""
+    index = {column: i for i, column in enumerate(qa_db.METRIC_COLUMNS)}
+    models = {}
+    for row in rows:
+        model = row[index['model']]
+        entry = models.get(model)
+        if entry is None:
+            entry = models[model] = {'model': model, 'requests': 0, 'errors': 0, 'tokens': 0, 'statuses': {},
+                                     'values': {name: [] for name, _, _ in TIMINGS}, 'tokens_per_sec': []}
+        status = row[index['status']]
+        entry['requests'] += 1
+        entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+        if status != chat_jobs.DONE:
+            entry['errors'] += status != chat_jobs.CANCELLED
+            continue
+        for name, column, _ in TIMINGS:
+            value = row[index[column]]
+            if value is not None:
+                entry['values'][name].append(value / 1e6)
+        eval_count, eval_us = row[index['eval_count']], row[index['eval_us']]
+        if eval_count:
+            entry['tokens'] += eval_count
+            if eval_us:
+                entry['tokens_per_sec'].append(eval_count / (eval_us / 1e6))
+    return [models[model] for model in sorted(models)]
+
+
+def load_summary(conn, since=0):
+    # 在读线程中执行
+    return summarize(qa_db.fetch_metrics(conn, since))
+
+
+def summary_row(entry):
+    def seconds(name, pct):
+        value = percentile(entry['values'][name], pct)
+        if value is None:
+            return "-"
+        return f"{value * 1000:.2f} ms" if value < 1 else f"{value:.2f} s"
+
+    rate = percentile(entry['tokens_per_sec'], 50)
+    return (entry['model'], entry['requests'], entry['errors'], seconds('connect', 50),
+            seconds('ttft', 50), seconds('ttft', 95), seconds('total', 50), seconds('total', 95),
+            f"{rate:.1f}" if rate is not None else "-", seconds('prompt_eval', 50), seconds('db_write', 50))
+
+
+def write_csv(conn, path, since=0):
+    rows = qa_db.fetch_metrics(conn, since)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(qa_db.METRIC_COLUMNS)
+        writer.writerows(rows)
+    return len(rows)
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(summary):
+    """Prometheus text exposition format, e.g. for node_exporter's textfile collector."""
+    lines = []
+
+    def metric(name, kind, help_text):
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+
+    def quantiles(name, entry, values):
+        model = label(entry['model'])
+        for q in QUANTILES:
+            lines.append(f'{PROMETHEUS_PREFIX}_{name}{{model="{model}",quantile="{q}"}} {percentile(values, q * 100):.6g}')
+        lines.append(f'{PROMETHEUS_PREFIX}_{name}_sum{{model="{model}"}} {sum(values):.6g}')
+        lines.append(f'{PROMETHEUS_PREFIX}_{name}_count{{model="{model}"}} {len(values)}')
+
+    metric('requests_total', 'counter', "Chat requests by model and final status.")
+    for entry in summary:
+        for status, count in sorted(entry['statuses'].items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_requests_total{{model="{label(entry["model"])}",status="{label(status)}"}} {count}')
+    metric('generated_tokens_total', 'counter', "Tokens generated, as reported by Ollama's eval_count.")
+    for entry in summary:
+        lines.append(f'{PROMETHEUS_PREFIX}_generated_tokens_total{{model="{label(entry["model"])}"}} {entry["tokens"]}')
+    for name, _, help_text in TIMINGS:
+        metric(f'{name}_seconds', 'summary', help_text)
+        for entry in summary:
+            if entry['values'][name]:
+                quantiles(f'{name}_seconds', entry, entry['values'][name])
+    metric('eval_tokens_per_second', 'summary', "Generation speed (eval_count / eval_duration).")
+    for entry in summary:
+        if entry['tokens_per_sec']:
+            quantiles('eval_tokens_per_second', entry, entry['tokens_per_sec'])
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(conn, path, since=0):
+    summary = load_summary(conn, since)
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(prometheus_text(summary))
+    return sum(entry['requests'] for entry in summary)
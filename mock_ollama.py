@@ -0,0 +1,193 @@
+"""Local stand-in for an Ollama server, for benchmarks and offline testing of the UI.
+
+    python mock_ollama.py --port 11435 --tokens-per-sec 40 --latency 0.5
+
+Then point [Server] Address/Port in config.ini (or batch_eval.py --servers)
+at it. It answers /v1/models, /api/tags, /api/ps, /api/show and /api/chat
+(NDJSON streaming, or a single object with "stream": false). Answers are
+filler text; options.num_predict sets their length in tokens.
+"""
+import argparse
+import itertools
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_MODELS = ('mock-llama', 'mock-vision')
+DEFAULT_TOKENS = 200
+DEFAULT_TOKENS_PER_SEC = 0  # 0 = 不限速，尽快输出
+DEFAULT_LATENCY = 0.0  # 第一个 token 之前的等待 (秒)，模拟 prompt 处理
+DEFAULT_CONTEXT_LENGTH = 4096
+
+WORDS = ('the', 'model', 'streams', 'tokens', 'one', 'by', 'one', 'while', 'the', 'client', 'parses', 'each',
+         'line', 'of', 'json', 'and', 'updates', 'the', 'answer', 'box', '.', '\n')
+
+
+def tokens(count):
+    # 第一个 token 不带前导空格，其余与常见分词器一样以空格开头
+    for index, word in zip(range(count), itertools.cycle(WORDS)):
+        yield word if index == 0 or word in '.\n' else ' ' + word
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 与真实服务器一样保持连接，客户端的连接池才有意义
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        server = self.server
+        if self.path == '/v1/models':
+            self.send_json({'object': 'list', 'data': [{'id': name, 'object': 'model', 'created': server.created}
+                                                       for name in server.models]})
+        elif self.path in ('/api/tags', '/api/ps'):
+            names = server.models if self.path == '/api/tags' else sorted(server.loaded)
+            self.send_json({'models': [{'name': f"{name}:latest", 'model': f"{name}:latest"} for name in names]})
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        request = self.read_json()
+        model = request.get('model', '')
+        if self.path not in ('/api/chat', '/api/show'):
+            self.send_json({'error': 'not found'}, 404)
+        elif model.removesuffix(':latest') not in self.server.models:
+            self.send_json({'error': f"model '{model}' not found"}, 404)
+        elif self.path == '/api/show':
+            self.send_json({'capabilities': ['completion', 'vision'] if 'vision' in model else ['completion'],
+                            'details': {'family': 'llama'},
+                            'model_info': {'llama.context_length': self.server.context_length}})
+        else:
+            self.chat(request)
+
+    def chat(self, request):
+        server = self.server
+        model = request['model'].removesuffix(':latest')
+        server.count_request()
+        server.loaded.add(model)
+        count = int((request.get('options') or {}).get('num_predict') or server.tokens)
+        if not request.get('messages'):
+            count = 0  # 空请求只加载模型 (预加载)
+        start = time.perf_counter()
+        if server.latency:
+            time.sleep(server.latency)
+        prompt_done = time.perf_counter()
+
+        def final(content=''):
+            now = time.perf_counter()
+            return {'model': request['model'], 'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                    'message': {'role': 'assistant', 'content': content}, 'done': True, 'done_reason': 'stop',
+                    'total_duration': int((now - start) * 1e9), 'load_duration': 0,
+                    'prompt_eval_count': sum(len(str(m.get('content', ''))) // 4 for m in request['messages']),
+                    'prompt_eval_duration': int((prompt_done - start) * 1e9),
+                    'eval_count': count, 'eval_duration': max(1, int((now - prompt_done) * 1e9))}
+
+        if request.get('stream', True) is False:
+            if server.tokens_per_sec:
+                time.sleep(count / server.tokens_per_sec)
+            self.send_json(final(''.join(tokens(count))))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for index, token in enumerate(tokens(count)):
+                if server.tokens_per_sec:
+                    delay = prompt_done + index / server.tokens_per_sec - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                self.write_chunk({'model': request['model'], 'message': {'role': 'assistant', 'content': token},
+                                  'done': False})
+            self.write_chunk(final())
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # 客户端取消了请求
+
+    def write_chunk(self, data):
+        line = json.dumps(data).encode('utf-8') + b'\n'
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+
+
+class MockOllama(ThreadingHTTPServer):
+    """The mock server; start() serves from a daemon thread, close() stops it."""
+
+    daemon_threads = True
+
+    def __init__(self, port=0, models=DEFAULT_MODELS, tokens=DEFAULT_TOKENS, tokens_per_sec=DEFAULT_TOKENS_PER_SEC,
+                 latency=DEFAULT_LATENCY, context_length=DEFAULT_CONTEXT_LENGTH, host='127.0.0.1'):
+        super().__init__((host, port), MockHandler)
+        self.models = list(models)
+        self.tokens = tokens
+        self.tokens_per_sec = tokens_per_sec
+        self.latency = latency
+        self.context_length = context_length
+        self.created = int(time.time())
+        self.loaded = set()
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-ollama', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # 客户端关闭空闲的长连接是正常情况，不打印回溯
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a fake Ollama API for testing and benchmarks.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--models', default=','.join(DEFAULT_MODELS), help="comma separated model names")
+    parser.add_argument('--tokens', type=int, default=DEFAULT_TOKENS, help="tokens per answer (default 200)")
+    parser.add_argument('--tokens-per-sec', type=float, default=DEFAULT_TOKENS_PER_SEC, help="0 = unthrottled (default)")
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help="seconds before the first token")
+    args = parser.parse_args(argv)
+
+    server = MockOllama(args.port, [m.strip() for m in args.models.split(',') if m.strip()], args.tokens,
+                        args.tokens_per_sec, args.latency, host=args.host)
+    print(f"Mock Ollama on {server.url} with {', '.join(server.models)} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import logging
+import re
+import time
+
+import qa_db
+
+# 默认参数，可在 config.ini 的 [Generation] 段覆盖
+# 没有为模型单独设置 keep_alive 时使用；留空则由 Ollama 决定 (默认 5 分钟)
+DEFAULT_KEEP_ALIVE = ''
+
+# 选项对话框中可编辑的 Ollama options 及其类型
+OPTION_FIELDS = (
+    ('temperature', float, "Randomness; 0 = deterministic"),
+    ('top_p', float, "Nucleus sampling threshold"),
+    ('top_k', int, "Sample from the k most likely tokens"),
+    ('repeat_penalty', float, "Penalty for repeated tokens"),
+    ('seed', int, "Fixed seed for reproducible answers"),
+    ('num_ctx', int, "Context window (tokens)"),
+    ('num_predict', int, "Maximum tokens to generate (-1 = no limit)"),
+    ('num_thread', int, "CPU threads used by the server"),
+)
+OPTION_TYPES = {name: kind for name, kind, _ in OPTION_FIELDS}
+
+# 对话框中的 keep_alive 选项: -1 = 一直保持加载，0 = 用完立即卸载
+KEEP_ALIVE_CHOICES = ('5m', '30m', '2h', '-1', '0')
+_DURATION = re.compile(r'^-?\d+(\.\d+)?(ms|s|m|h)?$')
+
+
+def parse_options(values):
+    """{name: text} from the options dialog -> {name: number}; empty fields are left out."""
+    options = {}
+    for name, text in values.items():
+        text = text.strip()
+        if not text:
+            continue
+        kind = OPTION_TYPES.get(name)
+        if kind is None:
+            raise ValueError(f"Unknown option: {name}")
+        try:
+            options[name] = kind(text)
+        except ValueError:
+            raise ValueError(f"{name} must be {'an integer' if kind is int else 'a number'}, not {text!r}") from None
+    return options
+
+
+def parse_keep_alive(text):
+    # '' 表示使用默认值
+    text = text.strip()
+    if text and not _DURATION.match(text):
+        raise ValueError(f"Keep-alive must be a duration such as 30m, 2h, -1 or 0, not {text!r}")
+    return text or None
+
+
+def keep_alive_value(text):
+    # Ollama 把纯数字解释为秒数，须以数字而不是字符串发送
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def options_text(options):
+    return ", ".join(f"{name}={value}" for name, value in sorted(options.items()))
+
+
+class ModelOptions:
+    """Per-model generation options and keep-alive, saved in the model_options table.
+
+    apply() adds a model's saved options to a chat payload before it is
+    sent (and therefore before the cache key and the saved record see it).
+    Profiles are loaded once into memory and updated on save, so applying
+    them never waits for the database.
+    """
+
+    def __init__(self, db, keep_alive=DEFAULT_KEEP_ALIVE):
+        self.db = db
+        self.keep_alive = keep_alive or None
+        self.profiles = {}
+
+    @classmethod
+    def from_config(cls, config, db):
+        section = config['Generation'] if config.has_section('Generation') else {}
+        return cls(db, section.get('KeepAlive', DEFAULT_KEEP_ALIVE))
+
+    def load(self, callback=None, on_error=None):
+        def on_loaded(profiles):
+            self.profiles = profiles
+            if callback:
+                callback(profiles)
+
+        self.db.submit_read(qa_db.fetch_model_options, callback=on_loaded, on_error=on_error)
+
+    def get(self, model):
+        # (options, keep_alive)；没有保存过时为 ({}, None)
+        return self.profiles.get(model, ({}, None))
+
+    def apply(self, payload):
+        options, keep_alive = self.get(payload.get('model'))
+        if options and 'options' not in payload:
+            payload['options'] = dict(options)
+        if keep_alive:
+            payload['keep_alive'] = keep_alive_value(keep_alive)
+        elif self.keep_alive and 'keep_alive' not in payload:
+            payload['keep_alive'] = keep_alive_value(self.keep_alive)
+        return payload
+
+    def save(self, model, options, keep_alive, callback=None, on_error=None):
+        def on_saved(_):
+            if options or keep_alive:
+                self.profiles[model] = (options, keep_alive)
+            else:
+                self.profiles.pop(model, None)
+            if callback:
+                callback(model)
+
+        if options or keep_alive:
+            self.db.submit_write(qa_db.save_model_options, model, options, keep_alive, callback=on_saved, on_error=on_error)
+        else:
+            self.db.submit_write(qa_db.delete_model_options, model, callback=on_saved, on_error=on_error)
+
+    def preload(self, pool, model):
+        """Load model into memory with an empty chat request; returns the seconds it took.
+
+        Blocks, so call it from a worker thread. The saved options go along
+        so the model is loaded with the same num_ctx the questions will use.
+        """
+        payload = self.apply({"model": model, "messages": [], "stream": False})
+        host = pool.pick(model)
+        if host is None:
+            raise RuntimeError("No Ollama server available")
+        start = time.perf_counter()
+        try:
+            response = host.client.post("/api/chat", json=payload)
+            response.raise_for_status()
+        finally:
+            pool.release(host)
+        elapsed = time.perf_counter() - start
+        logging.info(f"Preloaded {model} on {host.url} in {elapsed:.1f}s")
+        pool.check(host)  # 更新该主机已加载的模型
+        return elapsed
@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# 默认模型列表缓存文件，可在 config.ini 的 [Models] 段覆盖
+DEFAULT_CACHE_FILE = 'models_cache.json'
+
+# 视觉模型的 family 名称 (旧版 Ollama 的 /api/show 没有 capabilities 字段)
+VISION_FAMILIES = ('clip', 'mllama')
+
+
+def parse_model_list(data):
+    # /v1/models 返回 OpenAI 格式 {"object": "list", "data": [...]}
+    if isinstance(data, dict) and data.get("object") == "list" and "data" in data:
+        return {model["id"]: model.get("created") for model in data["data"]}
+    elif isinstance(data, list):
+        return {model: None for model in data}
+    raise ValueError("Unexpected response format")
+
+
+def parse_capabilities(data):
+    capabilities = data.get('capabilities') or []
+    families = (data.get('details') or {}).get('families') or []
+    vision = ('vision' in capabilities or 'projector_info' in data
+              or any(family in VISION_FAMILIES for family in families))
+    context_length = None
+    for key, value in (data.get('model_info') or {}).items():
+        if key.endswith('.context_length'):
+            context_length = value
+            break
+    return {'vision': vision, 'context_length': context_length}
+
+
+class ModelRegistry:
+    """Model list of every host in the pool, cached on disk and refreshed in the background.
+
+    ``listener(models, error)`` is called from the refresh thread whenever
+    a refresh finishes; models maps name -> {'created', 'vision',
+    'context_length'}.
+    """
+
+    def __init__(self, pool, cache_path=DEFAULT_CACHE_FILE, listener=None):
+        self.pool = pool
+        self.cache_path = cache_path
+        self.listener = listener
+        self.models = {}
+        self.updated = None
+        self._refreshing = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, pool, listener=None):
+        section = config['Models'] if config.has_section('Models') else {}
+        return cls(pool, section.get('CacheFile', DEFAULT_CACHE_FILE), listener)
+
+    def servers(self):
+        return ','.join(host.url for host in self.pool.hosts)
+
+    def names(self):
+        return sorted(self.models)
+
+    def info(self, name):
+        return self.models.get(name, {})
+
+    def load_cached(self):
+        # 启动时立即可用，不访问网络
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self.names()
+        if data.get('server') == self.servers():
+            self.models = data.get('models', {})
+            self.updated = data.get('updated')
+        return self.names()
+
+    def refresh_async(self):
+        if not self._refreshing.acquire(blocking=False):
+            return  # 已经在刷新
+        threading.Thread(target=self._refresh_thread, name='model-refresh', daemon=True).start()
+
+    def _refresh_thread(self):
+        try:
+            models, error = self.refresh(), None
+        except Exception as e:
+            logging.error(f"Failed to retrieve models: {e}")
+            models, error = self.models, e
+        finally:
+            self._refreshing.release()
+        if self.listener:
+            self.listener(models, error)
+
+    def refresh(self):
+        # 合并所有主机的模型；部分主机不可用时仍返回其余主机的模型
+        listed = {}
+        owners = {}
+        errors = []
+        for client in self.pool.clients():
+            try:
+                response = client.get("/v1/models")
+                response.raise_for_status()
+                for name, created in parse_model_list(response.json()).items():
+                    listed.setdefault(name, created)
+                    owners.setdefault(name, client)
+            except Exception as e:
+                logging.warning(f"Failed to list models on {client.base_url}: {e}")
+                errors.append(e)
+        if errors and not listed:
+            raise errors[0]
+
+        models = {}
+        for name, created in listed.items():
+            known = self.models.get(name)
+            if known and known.get('created') == created and 'vision' in known:
+                models[name] = known  # 模型未变化，不再查询 /api/show
+                continue
+            entry = {'created': created, 'vision': False, 'context_length': None}
+            try:
+                response = owners[name].post("/api/show", json={"model": name})
+                response.raise_for_status()
+                entry.update(parse_capabilities(response.json()))
+            except Exception as e:
+                logging.warning(f"Failed to read capabilities of {name}: {e}")
+                entry.pop('vision')  # 下次刷新时重试
+            models[name] = entry
+
+        self.models = models
+        self.updated = time.time()
+        self.save()
+        return models
+
+    def save(self):
+        data = {'server': self.servers(), 'updated': self.updated, 'models': self.models}
+        tmp_path = self.cache_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.cache_path)  # 原子替换，避免写到一半的缓存
+        except OSError as e:
+            logging.error(f"Failed to save model cache: {e}")
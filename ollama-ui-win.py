@@ -1,14 +1,28 @@
+import time
+STARTED = time.perf_counter()  # 启动计时从导入其它模块之前开始
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, scrolledtext
-import sqlite3
-import requests
 import configparser
 import threading
+import queue
 import json
-import time
+import hashlib
+import uuid
 import logging
-from PIL import Image, ImageTk
-import base64  # 新增，用于编码图像数据
+import os
+from host_pool import HostPool
+import chat_jobs
+from response_cache import ResponseCache
+import qa_export
+import metrics
+import conversations
+from image_pipeline import ImagePipeline
+from answer_renderer import MarkdownRenderer
+from model_registry import ModelRegistry
+from semantic_index import SemanticIndex
+import document_index
+import model_options
+import qa_db
 
 # import ollama  # 已移除，因为不再使用 ollama 库
 
@@ -27,10 +41,33 @@ except KeyError as e:
     raise KeyError(f"Missing configuration for {e}")
 
 # Database setup
-myDATABASE = 'ollama_QA.db'
+myDATABASE = qa_db.DEFAULT_DATABASE
 smallFrame ='1000x750+150+0'
 bigFrame = '1000x870+150+0'
 
+# History list: rows fetched per page, and how close to the bottom (fraction) the next page is prefetched
+HISTORY_PAGE_SIZE = 100
+HISTORY_PREFETCH_AT = 0.8
+# At most this many pages stay in the Treeview; the page farthest from the scroll direction is dropped
+HISTORY_MAX_PAGES = 5
+
+# Search-as-you-type waits this long (ms) after the last keystroke before querying
+SEARCH_DEBOUNCE_MS = 300
+ALL_MODELS = 'All models'
+
+# "Related past answers": looked up this long (ms) after typing stops, once the question has enough characters
+RELATED_DEBOUNCE_MS = 800
+RELATED_MIN_CHARS = 12
+RELATED_COUNT = 5
+
+# Streaming answer refresh interval (ms); tokens arriving between two frames are merged into one insert
+STREAM_FRAME_MS = 50
+# Finished jobs kept in the job list
+JOB_HISTORY = 20
+
+# Metrics panel periods (seconds; None = everything kept in request_metrics)
+METRICS_PERIODS = {'Last hour': 3600, 'Last 24 hours': 86400, 'Last 7 days': 7 * 86400, 'All': None}
+
 def popup(event, text_widget, menu):
     try:
         menu.tk_popup(event.x_root, event.y_root)
@@ -69,17 +106,92 @@ def redo_action(text_widget):
     except tk.TclError:
         pass  # 沒有可重做的操作
 
+def new_parts(job, start):
+    # 工作线程可能同时在追加片段，先取长度作为快照: (新增文本, 已显示的片段数)
+    end = len(job.parts)
+    return ''.join(job.parts[start:end]), end
+
+
 class OllamaGUI:
-    def __init__(self, root):
+    def __init__(self, root, startup=None):
         self.root = root
+        self.startup = startup or metrics.StartupTimer(time.perf_counter())
         self.root.title("Ollama Chat UI for Windows Ver.03")
         #self.root.geometry('200x150+100+50')  # 設定視窗大小和位置+100+50
         self.root.geometry(smallFrame)
-        self.service_url = f"http://{OLLAMA_SERVICE_URL}:{OLLAMA_SERVICE_PORT}"
-        self.uploaded_image_data = None
+        # 一台或多台 Ollama 服务器，每台有自己的连接池；后台定期检查健康状态和已加载的模型
+        self.hosts = HostPool.from_config(config, lambda pool: self.root.after(0, self.update_host_status))
+        # 模型列表: 先用磁盘缓存立即显示，后台再向服务器刷新
+        self.model_registry = ModelRegistry.from_config(config, self.hosts,
+                                                        lambda models, error: self.root.after(0, self.on_models_refreshed, error))
+        self.image_pipeline = ImagePipeline.from_config(config)
+        self.uploaded_images = []  # 已预处理的图片 (PreparedImage)
+        self.pending_images = 0  # 仍在后台处理的图片数
+        self.stream_queue = queue.Queue()  # 工作线程 -> UI 的流式输出/状态事件队列
+        self.scheduler = chat_jobs.RequestScheduler.from_config(config, self.hosts, self.on_job_event)
+        self.displayed_job_id = None  # 答案区当前显示的任务
+        self.displayed_parts = 0  # 答案区已显示该任务的多少个片段
+        self.conversation_settings = conversations.ConversationSettings.from_config(config)
+        self.conversation_id = None  # 多轮对话模式下当前的对话
+        self.summarizing = set()
+        self.polling = False
+        self.busy = False
+        # 历史列表分页状态: mode 为 None(未加载) / 'recent'(分页浏览) / 'search'(搜索结果)
+        self.history_mode = None
+        self.history_oldest_id = None
+        self.history_exhausted = False
+        self.history_trimmed = False  # 列表顶部的较新记录已被移出，向上滚动时重新读取
+        self.history_loading = False
+        self.search_after_id = None
+        self.search_generation = 0  # 丢弃过期的搜索结果
         self.initialize_database()
+        self.cache = ResponseCache.from_config(config, self.db)  # 可选的重复问题答案缓存
+        self.metrics = metrics.MetricsRecorder.from_config(config, self.db)  # 每个请求的耗时记录
+        self.metrics_window = None
+        # 每个模型保存的生成参数 (options) 与 keep_alive，发送前加入请求
+        self.model_options = model_options.ModelOptions.from_config(config, self.db)
+        self.model_options.load(callback=lambda _: self.show_model_info(self.model_var.get()),
+                                on_error=lambda e: logging.error(f"Failed to load model options: {e}"))
+        self.options_window = None
+        # 比较模式: 同一问题并行发给多个模型，job id -> 该模型的答案窗格
+        self.compare_window = None
+        self.compare_panes = {}
+        # 语义搜索: 后台用 embedding 模型为历史问答计算向量 ([Semantic] Enabled = true 时启用)
+        self.semantic = SemanticIndex.from_config(config, self.db, self.hosts,
+                                                  lambda: self.root.after(0, self.update_semantic_status))
+        self.related_after_id = None
+        self.related_generation = 0
+        self.related_ids = []
+        # 本地文档检索 (RAG): 提问前取出最相关的文档片段随问题发送 ([Documents] Enabled = true 时启用)
+        self.documents = document_index.DocumentIndex.from_config(config, self.hosts,
+                                                                  dispatch=lambda fn, *args: self.root.after(0, fn, *args),
+                                                                  listener=lambda: self.root.after(0, self.update_documents_status))
+        self.documents_window = None
+        self.last_excerpts = ""
         self.create_widgets()
         self.configure_styles()  # 初始化样式
+        self.startup.mark('widgets')
+        # 数据库在写线程中打开 (含结构迁移)，模型列表在后台刷新，窗口不必等待它们
+        self.stats_var.set("Opening database...")
+        self.db.submit_read(qa_db.schema_version, callback=self.on_database_ready, on_error=self.on_database_error)
+        self.root.after_idle(lambda: self.root.after(0, self.on_first_frame))
+        self.semantic.start()
+        self.documents.start()
+
+    def on_first_frame(self):
+        self.startup.mark('first_frame')
+        logging.info(f"Window interactive after {self.startup.phases['first_frame']:.3f}s")
+
+    def on_database_ready(self, version):
+        phases = self.startup.phases
+        self.startup.mark('database')
+        if self.stats_var.get() == "Opening database...":  # 不覆盖已经开始的回答的统计
+            self.stats_var.set(f"Window ready after {phases.get('first_frame', phases['widgets']):.2f}s"
+                               f" | database after {phases['database']:.2f}s (schema v{version})")
+
+    def on_database_error(self, e):
+        self.stats_var.set("Database unavailable")
+        self.show_db_error(e)
 
     def configure_styles(self):
         style = ttk.Style()
@@ -112,37 +224,74 @@ class OllamaGUI:
                   background=[('pressed', '#FF8C00'), ('active', '#FF8C00')])
 
     def initialize_database(self):
-        conn = sqlite3.connect(myDATABASE)
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS questions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                model TEXT NOT NULL,
-                topic TEXT NOT NULL,
-                question TEXT NOT NULL,
-                answer TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        # 长连接 + 后台读写线程，结果通过 root.after 回到主线程
+        self.db = qa_db.QADatabase.from_config(config, myDATABASE, dispatch=lambda fn, *args: self.root.after(0, fn, *args))
+
+    def show_db_error(self, e):
+        messagebox.showerror("Database Error", str(e))
+        logging.error(f"Database Error: {e}")
 
     def create_widgets(self):
-        # Ollama Server
-        tk.Label(self.root, text="Server:", font=('Helvetica', 12)).grid(row=0, column=0, padx=10, pady=10, sticky='w')
-        tk.Label(self.root, text=self.service_url, fg='blue', font=('Helvetica', 12)).grid(row=0, column=1, padx=10, pady=10, sticky='w')
+        # Ollama Server (每台主机一行状态: 地址 / 正在生成的请求数 / 已加载的模型，不可用时显示红色)
+        tk.Label(self.root, text="Server:", font=('Helvetica', 12)).grid(row=0, column=0, padx=10, pady=10, sticky='nw')
+        hosts_frame = ttk.Frame(self.root)
+        hosts_frame.grid(row=0, column=1, padx=10, pady=10, sticky='w')
+        self.host_labels = []
+        for index, host in enumerate(self.hosts.hosts):
+            label = tk.Label(hosts_frame, text=host.url, fg='blue', font=('Helvetica', 12 if len(self.hosts.hosts) == 1 else 10))
+            label.grid(row=index, column=0, sticky='w')
+            self.host_labels.append(label)
+        self.hosts.start_monitor()
 
         # Model Selection
         self.model_var = tk.StringVar()
         tk.Label(self.root, text="Model:", font=('Helvetica', 12)).grid(row=1, column=0, padx=10, pady=10, sticky='w')
-        self.model_menu = ttk.OptionMenu(self.root, self.model_var, 'Select Model', *self.get_models(), command=self.select_model)
+        self.model_menu = ttk.OptionMenu(self.root, self.model_var, 'Select Model', *self.model_registry.load_cached(), command=self.select_model)
         self.model_menu.grid(row=1, column=1, padx=10, pady=10, sticky='w')
 
-        # 手动选择是否支持 Vision
+        # 是否支持 Vision (选择模型时按 /api/show 的结果自动勾选，仍可手动修改)
         self.vision_var = tk.BooleanVar()
         self.vision_checkbutton = tk.Checkbutton(self.root, text="Support Vision (Image Upload)", variable=self.vision_var, command=self.toggle_image_upload)
         self.vision_checkbutton.grid(row=1, column=1, padx=150, pady=10, sticky='w')
+        self.model_info_var = tk.StringVar(value="Refreshing models...")
+        tk.Label(self.root, textvariable=self.model_info_var, fg='grey', font=('Helvetica', 10)).grid(row=1, column=1, padx=400, pady=10, sticky='w')
+        model_buttons = ttk.Frame(self.root)
+        model_buttons.grid(row=1, column=1, padx=10, pady=10, sticky='e')
+        ttk.Button(model_buttons, text="Options...", style="Other.TButton", command=self.show_model_options).grid(row=0, column=0, padx=(0, 5))
+        ttk.Button(model_buttons, text="Preload", style="Other.TButton", command=self.preload_model).grid(row=0, column=1, padx=(0, 5))
+        ttk.Button(model_buttons, text="Refresh Models", style="Other.TButton", command=self.refresh_models).grid(row=0, column=2)
+        self.model_registry.refresh_async()
         
+        # Job queue (正在排队/生成的请求，可选中查看或取消)
+        tk.Label(self.root, text="Jobs:", font=('Helvetica', 12)).grid(row=2, column=0, padx=10, pady=5, sticky='nw')
+        jobs_frame = ttk.Frame(self.root)
+        jobs_frame.grid(row=2, column=1, padx=10, pady=5, sticky='we')
+        self.jobs_tree = ttk.Treeview(jobs_frame, columns=("Job", "Model", "Server", "Status", "Stats", "Question"), show='headings', height=3)
+        for column, width in (("Job", 40), ("Model", 120), ("Server", 130), ("Status", 70), ("Stats", 320), ("Question", 140)):
+            self.jobs_tree.heading(column, text=column)
+            self.jobs_tree.column(column, width=width)
+        self.jobs_tree.grid(row=0, column=0, sticky='we')
+        ttk.Button(jobs_frame, text="Cancel", style="Other.TButton", command=self.cancel_job).grid(row=0, column=1, padx=5, sticky='n')
+        ttk.Button(jobs_frame, text="Metrics", style="Other.TButton", command=self.show_metrics).grid(row=0, column=1, padx=5, sticky='s')
+        self.jobs_tree.bind('<<TreeviewSelect>>', self.on_job_select)
+
+        # Conversation mode (多轮对话: 之前的问答会在预算内随问题一起发送)
+        tk.Label(self.root, text="Chat:", font=('Helvetica', 12)).grid(row=3, column=0, padx=10, pady=5, sticky='w')
+        chat_frame = ttk.Frame(self.root)
+        chat_frame.grid(row=3, column=1, padx=10, pady=5, sticky='w')
+        self.conversation_var = tk.BooleanVar()
+        tk.Checkbutton(chat_frame, text="Multi-turn conversation", variable=self.conversation_var).grid(row=0, column=0)
+        ttk.Button(chat_frame, text="New Conversation", style="Other.TButton", command=self.new_conversation).grid(row=0, column=1, padx=10)
+        self.conversation_status_var = tk.StringVar(value="No conversation")
+        tk.Label(chat_frame, textvariable=self.conversation_status_var, fg='grey', font=('Helvetica', 10)).grid(row=0, column=2, padx=5)
+        # 文档检索: 勾选后提问时附上本地文档中最相关的片段
+        self.use_documents_var = tk.BooleanVar(value=self.documents.available)
+        self.documents_status_var = tk.StringVar(value=self.documents.status_text())
+        if self.documents.available:
+            tk.Checkbutton(chat_frame, text="Use documents", variable=self.use_documents_var).grid(row=1, column=0, sticky='w')
+            ttk.Button(chat_frame, text="Documents...", style="Other.TButton", command=self.show_documents).grid(row=1, column=1, padx=10)
+            tk.Label(chat_frame, textvariable=self.documents_status_var, fg='grey', font=('Helvetica', 10)).grid(row=1, column=2, padx=5, sticky='w')
+
         # Topic Entry
         tk.Label(self.root, text="Topic:", font=('Helvetica', 12)).grid(row=4, column=0, padx=10, pady=10, sticky='w')
         self.topic_entry = ttk.Entry(self.root, width=50)
@@ -152,12 +301,25 @@ class OllamaGUI:
         tk.Label(self.root, text="Question:", font=('Helvetica', 12)).grid(row=5, column=0, padx=10, pady=10, sticky='w')
         self.question_frame = ttk.Frame(self.root)
         self.question_frame.grid(row=5, column=1, columnspan=2, padx=10, pady=10, sticky='ew')
-        self.image_label = tk.Label(self.question_frame, bg="grey")  # 背景色暂时设为灰色以便可视化
+        self.image_label = tk.Label(self.question_frame, bg="grey", compound='top')  # 背景色暂时设为灰色以便可视化
         self.image_label.grid(row=0, column=0, padx=10, pady=10)
         self.image_label.grid_remove()
+        # 图片右键选单
+        right_click_menu_image = tk.Menu(root, tearoff=0)
+        right_click_menu_image.add_command(label="Clear Images", command=self.clear_images)
+        self.image_label.bind("<Button-3>", lambda event: popup(event, self.image_label, right_click_menu_image))
         #self.question_text = tk.Text(self.question_frame, height=10, width=50)
         self.question_text = scrolledtext.ScrolledText(self.question_frame, wrap=tk.WORD, width=60, height=8, undo=True)
         self.question_text.grid(row=0, column=1, padx=5, pady=5)
+        # 输入问题时列出语义相近的历史问答，双击查看
+        if self.semantic.available:
+            related_frame = ttk.Frame(self.question_frame)
+            related_frame.grid(row=0, column=2, padx=5, pady=5, sticky='ns')
+            tk.Label(related_frame, text="Related past answers:", font=('Helvetica', 10)).grid(row=0, column=0, sticky='w')
+            self.related_list = tk.Listbox(related_frame, width=40, height=7, activestyle='none')
+            self.related_list.grid(row=1, column=0, sticky='ns')
+            self.related_list.bind('<Double-Button-1>', self.open_related)
+            self.question_text.bind('<KeyRelease>', self.schedule_related)
 
         # Answer Text
         tk.Label(self.root, text="Answer:", font=('Helvetica', 12)).grid(row=6, column=0, padx=10, pady=10, sticky='w')
@@ -169,7 +331,12 @@ class OllamaGUI:
         #self.answer_entry = tk.Text(self.answer_frame, height=10, width=110)
         self.answer_entry = scrolledtext.ScrolledText(self.answer_frame, wrap=tk.WORD, width=115, height=8, undo=True)
         self.answer_entry.grid(row=0, column=1, padx=5, pady=5)
-        
+        # Markdown 标题/代码块以标签显示 (文字本身不变)，流式输出时只标记新增的行
+        self.answer_renderer = MarkdownRenderer.from_config(config, self.answer_entry)
+        # 流式输出统计 (TTFT / tokens per second)
+        self.stats_var = tk.StringVar()
+        tk.Label(self.answer_frame, textvariable=self.stats_var, fg='grey', font=('Helvetica', 10)).grid(row=1, column=1, padx=5, sticky='w')
+
         # 創建右鍵選單（可編輯文字框）
         right_click_menu_question = tk.Menu(root, tearoff=0)
         right_click_menu_question.add_command(label="Copy(C)", command=lambda: copy_to_clipboard(self.question_text))
@@ -213,16 +380,55 @@ class OllamaGUI:
         ttk.Button(button_frame, text="Edit", style="Other.TButton", command=self.edit_data).grid(row=0, column=1, padx=5)
         ttk.Button(button_frame, text="Delete", style="Other.TButton", command=self.delete_data).grid(row=0, column=2, padx=5)
         ttk.Button(button_frame, text="Search", style="Other.TButton", command=self.search_data).grid(row=0, column=3, padx=5)
-        ttk.Button(button_frame, text="Export to Text", style="Other.TButton", command=self.export_to_text).grid(row=0, column=4, padx=5)
+        ttk.Button(button_frame, text="Export...", style="Other.TButton", command=self.export_data).grid(row=0, column=4, padx=5)
+        ttk.Button(button_frame, text="Import...", style="Other.TButton", command=self.import_data).grid(row=0, column=5, padx=5)
         # Image Upload Button (hidden by default)
         self.upload_image_button = ttk.Button(button_frame, text="Upload Image", style="ImageUpload.TButton", command=self.upload_image)
-        self.upload_image_button.grid(row=0, column=5, padx=5)
+        self.upload_image_button.grid(row=0, column=6, padx=5)
         self.upload_image_button.grid_remove()
-        ttk.Button(button_frame, text="Ask", style="Ask.TButton", command=self.ask_question).grid(row=0, column=6, padx=5)
+        ttk.Button(button_frame, text="Ask", style="Ask.TButton", command=self.ask_question).grid(row=0, column=7, padx=5)
+        ttk.Button(button_frame, text="Compare...", style="Other.TButton", command=self.show_compare).grid(row=0, column=8, padx=5)
+        # 答案缓存 (config.ini [Cache] Enabled = true 时显示)
+        self.bypass_cache_var = tk.BooleanVar()
+        self.cache_stats_var = tk.StringVar(value=self.cache.stats_text())
+        if self.cache.enabled:
+            tk.Checkbutton(button_frame, text="Bypass cache", variable=self.bypass_cache_var).grid(row=0, column=9, padx=5)
+            tk.Label(button_frame, textvariable=self.cache_stats_var, fg='grey', font=('Helvetica', 10)).grid(row=0, column=10, padx=5)
         
 
-        # Treeview for displaying data
-        self.tree = ttk.Treeview(self.root, columns=("ID", "Model", "Topic", "Question", "Answer", "Timestamp"), show='headings')
+        # Treeview for displaying data (只保存预览文字，完整内容在选中时再读取)
+        tree_frame = ttk.Frame(self.root)
+        tree_frame.grid(row=8, column=0, columnspan=2, padx=10, pady=5, sticky='nsew')
+        tree_frame.grid_columnconfigure(0, weight=1)
+        tree_frame.grid_rowconfigure(1, weight=1)
+
+        # 全文搜索栏: 关键词 + 模型 + 日期范围 (YYYY-MM-DD)
+        search_frame = ttk.Frame(tree_frame)
+        search_frame.grid(row=0, column=0, columnspan=2, pady=(0, 5), sticky='we')
+        tk.Label(search_frame, text="Search:", font=('Helvetica', 10)).grid(row=0, column=0, padx=(0, 5))
+        self.search_var = tk.StringVar()
+        ttk.Entry(search_frame, textvariable=self.search_var, width=40).grid(row=0, column=1, padx=5)
+        self.search_model_var = tk.StringVar(value=ALL_MODELS)
+        self.search_model_combo = ttk.Combobox(search_frame, textvariable=self.search_model_var, values=[ALL_MODELS], width=20, state='readonly', postcommand=self.refresh_search_models)
+        self.search_model_combo.grid(row=0, column=2, padx=5)
+        self.refresh_search_models()
+        tk.Label(search_frame, text="From:", font=('Helvetica', 10)).grid(row=0, column=3, padx=(10, 0))
+        self.search_from_var = tk.StringVar()
+        ttk.Entry(search_frame, textvariable=self.search_from_var, width=11).grid(row=0, column=4, padx=5)
+        tk.Label(search_frame, text="To:", font=('Helvetica', 10)).grid(row=0, column=5)
+        self.search_to_var = tk.StringVar()
+        ttk.Entry(search_frame, textvariable=self.search_to_var, width=11).grid(row=0, column=6, padx=5)
+        ttk.Button(search_frame, text="Clear", style="Other.TButton", command=self.clear_search).grid(row=0, column=7, padx=5)
+        # 语义搜索: 按意思而不是关键词匹配 (需要 [Semantic] Enabled = true)
+        self.semantic_search_var = tk.BooleanVar()
+        self.semantic_status_var = tk.StringVar(value=self.semantic.status_text())
+        if self.semantic.available:
+            tk.Checkbutton(search_frame, text="Semantic", variable=self.semantic_search_var).grid(row=0, column=8, padx=5)
+            tk.Label(search_frame, textvariable=self.semantic_status_var, fg='grey', font=('Helvetica', 10)).grid(row=0, column=9, padx=5)
+        for var in (self.search_var, self.search_model_var, self.search_from_var, self.search_to_var, self.semantic_search_var):
+            var.trace_add('write', self.schedule_search)
+
+        self.tree = ttk.Treeview(tree_frame, columns=("ID", "Model", "Topic", "Question", "Answer", "Timestamp"), show='headings')
         self.tree.heading("ID", text="ID")
         self.tree.heading("Model", text="Model")
         self.tree.heading("Topic", text="Topic")
@@ -235,7 +441,10 @@ class OllamaGUI:
         self.tree.column("Question", width=250)
         self.tree.column("Answer", width=250)
         self.tree.column("Timestamp", width=150)
-        self.tree.grid(row=8, column=0, columnspan=2, padx=10, pady=5, sticky='nsew')
+        self.tree.grid(row=1, column=0, sticky='nsew')
+        self.tree_scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=self.tree.yview)
+        self.tree_scrollbar.grid(row=1, column=1, sticky='ns')
+        self.tree.configure(yscrollcommand=self.on_tree_scroll)
 
         # Configure grid to make treeview expandable
         self.root.grid_rowconfigure(6, weight=1)
@@ -250,35 +459,129 @@ class OllamaGUI:
 
         self.tree.bind('<<TreeviewSelect>>', self.on_tree_select)
 
-    def get_models(self):
-        try:
-            response = requests.get(f"{self.service_url}/v1/models")
-            response.raise_for_status()
-            data = response.json()
-
-            if isinstance(data, dict) and data.get("object") == "list" and "data" in data:
-                models = data["data"]
-                return [model["id"] for model in models]
-            elif isinstance(data, list):
-                return data
-            else:
-                raise ValueError("Unexpected response format")
-        except requests.RequestException as e:
-            messagebox.showerror("Error", f"Failed to retrieve models: {e}")
-            print(f"Error details: {e}")
-        except ValueError as ve:
-            messagebox.showerror("Error", str(ve))
-            print(f"ValueError: {ve}")
-        return []
+    def refresh_models(self):
+        self.model_info_var.set("Refreshing models...")
+        self.model_registry.refresh_async()
+
+    def on_models_refreshed(self, error):
+        self.startup.mark('models')
+        if error is not None:
+            # 服务器不可用时继续使用缓存的列表，不弹出阻塞对话框
+            self.model_info_var.set(f"Server unavailable, showing cached models ({error.__class__.__name__})")
+        self.update_model_menu(self.model_registry.names())
+        if error is None:
+            self.show_model_info(self.model_var.get())
+
+    def update_model_menu(self, names):
+        # 原地更新下拉菜单，保留当前选择
+        menu = self.model_menu['menu']
+        menu.delete(0, 'end')
+        for name in names:
+            menu.add_command(label=name, command=tk._setit(self.model_var, name, self.select_model))
 
     def select_model(self, value):
         print(f'Selected model: {value}')
+        info = self.model_registry.info(value)
+        if 'vision' in info and info['vision'] != self.vision_var.get():
+            self.vision_var.set(info['vision'])
+            self.toggle_image_upload()
+        self.show_model_info(value)
+
+    def show_model_info(self, name):
+        info = self.model_registry.info(name)
+        if not info:
+            self.model_info_var.set(f"{len(self.model_registry.models)} models")
+            return
+        details = ["vision" if info.get('vision') else "text only"]
+        if info.get('context_length'):
+            details.append(f"context {info['context_length']}")
+        options, keep_alive = self.model_options.get(name)
+        if options:
+            details.append(model_options.options_text(options))
+        if keep_alive:
+            details.append(f"keep-alive {keep_alive}")
+        self.model_info_var.set(" | ".join(details))
+
+    def selected_model_name(self):
+        model = self.model_var.get()
+        if not model or model == 'Select Model':
+            messagebox.showwarning("Input Error", "Please select a model.")
+            return None
+        return model
+
+    def preload_model(self):
+        # 发送空请求让服务器先把模型载入内存，第一次提问不必等待加载
+        model = self.selected_model_name()
+        if model is None:
+            return
+        self.model_info_var.set(f"Loading {model}...")
+
+        def preload_thread():
+            try:
+                elapsed = self.model_options.preload(self.hosts, model)
+            except Exception as e:
+                logging.error(f"Failed to preload {model}: {e}")
+                self.root.after(0, self.model_info_var.set, f"Failed to load {model} ({e.__class__.__name__})")
+                return
+            self.root.after(0, self.model_info_var.set, f"{model} loaded in {elapsed:.1f}s")
+
+        threading.Thread(target=preload_thread, name='preload', daemon=True).start()
+
+    def show_model_options(self):
+        # 编辑所选模型的生成参数；留空的项使用模型自身的默认值
+        model = self.selected_model_name()
+        if model is None:
+            return
+        if self.options_window is not None and self.options_window.winfo_exists():
+            self.options_window.destroy()
+        window = self.options_window = tk.Toplevel(self.root)
+        window.title(f"Options for {model}")
+        options, keep_alive = self.model_options.get(model)
+        entries = {}
+        for row, (name, _, help_text) in enumerate(model_options.OPTION_FIELDS):
+            tk.Label(window, text=f"{name}:").grid(row=row, column=0, padx=10, pady=2, sticky='w')
+            entry = tk.Entry(window, width=12)
+            entry.insert(0, str(options.get(name, '')))
+            entry.grid(row=row, column=1, padx=5, pady=2, sticky='w')
+            tk.Label(window, text=help_text, fg='grey').grid(row=row, column=2, padx=10, pady=2, sticky='w')
+            entries[name] = entry
+        row = len(model_options.OPTION_FIELDS)
+        tk.Label(window, text="keep_alive:").grid(row=row, column=0, padx=10, pady=2, sticky='w')
+        keep_alive_var = tk.StringVar(value=keep_alive or '')
+        ttk.Combobox(window, textvariable=keep_alive_var, values=model_options.KEEP_ALIVE_CHOICES, width=10).grid(row=row, column=1, padx=5, pady=2, sticky='w')
+        tk.Label(window, text=f"How long the model stays loaded (empty = {self.model_options.keep_alive or 'server default'})",
+                 fg='grey').grid(row=row, column=2, padx=10, pady=2, sticky='w')
+
+        def save():
+            try:
+                options = model_options.parse_options({name: entry.get() for name, entry in entries.items()})
+                keep_alive = model_options.parse_keep_alive(keep_alive_var.get())
+            except ValueError as e:
+                messagebox.showwarning("Input Error", str(e), parent=window)
+                return
+            self.model_options.save(model, options, keep_alive, callback=self.on_model_options_saved, on_error=self.show_db_error)
+            window.destroy()
+
+        def clear():
+            for entry in entries.values():
+                entry.delete(0, tk.END)
+            keep_alive_var.set('')
+
+        buttons = ttk.Frame(window)
+        buttons.grid(row=row + 1, column=0, columnspan=3, padx=10, pady=10, sticky='w')
+        ttk.Button(buttons, text="Save", style="Other.TButton", command=save).grid(row=0, column=0, padx=(0, 5))
+        ttk.Button(buttons, text="Clear", style="Other.TButton", command=clear).grid(row=0, column=1, padx=(0, 5))
+        ttk.Button(buttons, text="Cancel", style="Other.TButton", command=window.destroy).grid(row=0, column=2)
+
+    def on_model_options_saved(self, model):
+        if model == self.model_var.get():
+            self.show_model_info(model)
 
     def toggle_image_upload(self):
         if self.vision_var.get():  # 如果手动选择支持 Vision
             self.upload_image_button.grid()
             self.image_label.grid()
-            if self.uploaded_image_data:
+            if self.uploaded_images:
                 self.root.geometry(bigFrame)
                 self.question_text.config(height=16)
                 self.question_text.update_idletasks()  # 強制更新顯示
@@ -294,20 +597,53 @@ class OllamaGUI:
             self.question_text.update_idletasks()  # 強制更新顯示
     
     def upload_image(self):
-        file_path = filedialog.askopenfilename(
-            filetypes=[("Image files", "*.jpg *.jpeg *.png *.bmp *.gif"), ("All files", "*.*")]
+        # 可一次选择多张图片，解码/缩放/编码都在后台线程完成
+        file_paths = filedialog.askopenfilenames(
+            filetypes=[("Image files", "*.jpg *.jpeg *.png *.bmp *.gif *.webp"), ("All files", "*.*")]
         )
-        if file_path:
-            with open(file_path, 'rb') as img_file:
-                self.uploaded_image_data = img_file.read()
-            self.display_image(file_path)
-            
-    def display_image(self, file_path):
+        for file_path in file_paths:
+            self.pending_images += 1
+            self.image_pipeline.submit(file_path,
+                                       lambda prepared: self.root.after(0, self.on_image_ready, prepared),
+                                       lambda e, path=file_path: self.root.after(0, self.on_image_error, path, e))
+        if file_paths:
+            self.image_label.config(text=f"Processing {self.pending_images} image(s)...")
+
+    def on_image_ready(self, prepared):
+        self.pending_images -= 1
+        # 同一张图片不重复上传
+        if not any(image.digest == prepared.digest for image in self.uploaded_images):
+            self.uploaded_images.append(prepared)
+        self.display_image()
+
+    def on_image_error(self, file_path, e):
+        self.pending_images -= 1
+        self.display_image()
+        messagebox.showerror("Image Error", f"Failed to load {file_path}: {e}")
+
+    def clear_images(self):
+        self.uploaded_images = []
+        self.display_image()
+
+    def display_image(self):
+        if not self.uploaded_images:
+            self.image_label.config(image='', text=f"Processing {self.pending_images} image(s)..." if self.pending_images else '')
+            self.image_label.image = None
+            self.root.geometry(smallFrame)
+            self.question_text.config(height=8)
+            self.question_text.update_idletasks()  # 強制更新顯示
+            return
         self.root.geometry(bigFrame)
-        img = Image.open(file_path)
-        img.thumbnail((360, 280))  # Resize image to fit in the UI
-        img = ImageTk.PhotoImage(img)
-        self.image_label.config(image=img)
+        # 显示最新一张的缩略图 (预处理时已生成)，其余以数量提示
+        latest = self.uploaded_images[-1]
+        from PIL import ImageTk  # 第一次显示图片时才导入 Pillow
+        img = ImageTk.PhotoImage(latest.thumbnail)
+        caption = latest.describe()
+        if len(self.uploaded_images) > 1:
+            caption = f"{len(self.uploaded_images)} images | latest: {caption}"
+        if self.pending_images:
+            caption += f" | processing {self.pending_images}..."
+        self.image_label.config(image=img, text=caption)
         self.image_label.image = img
         self.question_text.config(height=16)
         self.question_text.update_idletasks()  # 強制更新顯示
@@ -326,118 +662,476 @@ class OllamaGUI:
             messagebox.showwarning("Input Error", "Question field cannot be empty.")
             return
 
-        # 启动新线程处理请求
-        thread = threading.Thread(target=self._ask_question_thread, args=(selected_model, topic, question))
-        thread.start()
+        if self.vision_var.get() and self.pending_images:
+            messagebox.showwarning("Input Error", "Images are still being processed, please wait a moment.")
+            return
 
-    def _ask_question_thread(self, selected_model, topic, question):
-        logging.info(f"Sending question to model {selected_model}: {question}")
-        self.root.after(0, self.progress.start)  # 启动进度条
-        self.root.after(0, self.set_cursor_wait)  # 设置游标为等待状态
+        images = []
+        if self.vision_var.get() and self.uploaded_images:
+            # 如果选择了 Vision 且上传了图片，添加 images 字段 (已缩放并编码的 Base64 数据)
+            images = [image.b64 for image in self.uploaded_images]
 
-        try:
+        if self.conversation_var.get():
+            self.ask_in_conversation(selected_model, topic, question, images)
+            return
+
+        payload = {
+            "model": selected_model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": question
+                }
+            ]
+        }
+        if images:
+            payload["messages"][0]["images"] = images
+        self.model_options.apply(payload)
+        self.send_with_documents(selected_model, topic, question, payload)
+
+    def ask_in_conversation(self, selected_model, topic, question, images):
+        if self.conversation_id is None:
+            # 第一次提问时建立对话，再继续
+            def on_created(conversation_id):
+                self.conversation_id = conversation_id
+                self.ask_in_conversation(selected_model, topic, question, images)
+
+            self.db.submit_write(qa_db.create_conversation, selected_model, question[:60],
+                                 callback=on_created, on_error=self.show_db_error)
+            return
+
+        conversation_id = self.conversation_id
+
+        def on_context(context):
+            summary, _, history = context
+            messages, prompt_tokens, kept_turns = conversations.build_messages(
+                summary, history, question, self.conversation_settings.token_budget, images)
+            self.conversation_status_var.set(
+                f"Conversation #{conversation_id} | {kept_turns} previous turns sent"
+                f"{' + summary' if summary else ''} | ~{prompt_tokens} prompt tokens")
             payload = {
                 "model": selected_model,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": question
-                    }
-                ]
+                "messages": messages,
+                "keep_alive": self.conversation_settings.keep_alive,  # 对话期间保持模型常驻
             }
+            self.model_options.apply(payload)
+            self.send_with_documents(selected_model, topic, question, payload, conversation_id)
+
+        self.db.submit_read(qa_db.fetch_conversation, conversation_id, callback=on_context, on_error=self.show_db_error)
+
+    def new_conversation(self):
+        self.conversation_id = None
+        self.conversation_status_var.set("No conversation")
+        self.conversation_var.set(True)
+
+    def send_with_documents(self, selected_model, topic, question, payload, conversation_id=None):
+        if not (self.documents.available and self.use_documents_var.get()):
+            self.send_payload(selected_model, topic, question, payload, conversation_id)
+            return
+
+        def on_excerpts(excerpts):
+            # 文档片段作为 system 消息放在本次提问之前 (也参与缓存键的计算)
+            if excerpts:
+                payload["messages"].insert(-1, {"role": "system", "content": document_index.context_prompt(excerpts)})
+                files = sorted({os.path.basename(path) for path, _, _ in excerpts})
+                self.last_excerpts = f"{len(excerpts)} excerpts from {', '.join(files)}"
+            else:
+                self.last_excerpts = "no relevant excerpts"
+            self.update_documents_status()
+            self.send_payload(selected_model, topic, question, payload, conversation_id)
+
+        def on_error(e):
+            # 检索失败时照常提问
+            logging.warning(f"Document retrieval failed: {e}")
+            self.last_excerpts = "retrieval failed"
+            self.update_documents_status()
+            self.send_payload(selected_model, topic, question, payload, conversation_id)
+
+        self.documents.submit(self.documents.retrieve, question, callback=on_excerpts, on_error=on_error)
+
+    def update_documents_status(self):
+        text = self.documents.status_text()
+        if self.last_excerpts:
+            text += f" | last question: {self.last_excerpts}"
+        self.documents_status_var.set(text)
+        if self.documents_window is not None and self.documents_window.winfo_exists():
+            self.documents_window_status.set(self.documents.status_text())
+
+    def show_documents(self):
+        # 管理要索引的文件夹
+        if self.documents_window is not None and self.documents_window.winfo_exists():
+            self.documents_window.lift()
+            return
+        window = self.documents_window = tk.Toplevel(self.root)
+        window.title("Documents")
+        tk.Label(window, text="Indexed folders (text, Markdown and PDF files):").grid(row=0, column=0, columnspan=4, padx=10, pady=(10, 0), sticky='w')
+        folders = tk.Listbox(window, width=80, height=8)
+        folders.grid(row=1, column=0, columnspan=4, padx=10, pady=5, sticky='nsew')
+
+        def refresh():
+            folders.delete(0, tk.END)
+            for folder in self.documents.folders():
+                folders.insert(tk.END, folder)
+
+        def add_folder():
+            folder = filedialog.askdirectory(parent=window)
+            if folder:
+                self.documents.add_folder(folder)
+                refresh()
+
+        def remove_folder():
+            selection = folders.curselection()
+            if selection:
+                self.documents.remove_folder(folders.get(selection[0]))
+                refresh()
+
+        ttk.Button(window, text="Add Folder...", style="Other.TButton", command=add_folder).grid(row=2, column=0, padx=10, pady=10, sticky='w')
+        ttk.Button(window, text="Remove", style="Other.TButton", command=remove_folder).grid(row=2, column=1, padx=5, pady=10, sticky='w')
+        ttk.Button(window, text="Reindex", style="Other.TButton", command=self.documents.reindex).grid(row=2, column=2, padx=5, pady=10, sticky='w')
+        self.documents_window_status = tk.StringVar(value=self.documents.status_text())
+        tk.Label(window, textvariable=self.documents_window_status, fg='grey').grid(row=3, column=0, columnspan=4, padx=10, pady=(0, 10), sticky='w')
+        window.grid_rowconfigure(1, weight=1)
+        window.grid_columnconfigure(3, weight=1)
+        refresh()
+
+    def send_payload(self, selected_model, topic, question, payload, conversation_id=None):
+        if self.cache.enabled and not self.bypass_cache_var.get():
+            # 先查缓存，未命中再交给调度器
+            def on_cache_error(e):
+                logging.error(f"Cache Error: {e}")
+                self.submit_job(selected_model, topic, question, payload, conversation_id)
+
+            self.cache.lookup(payload, lambda answer: self.on_cache_result(answer, selected_model, topic, question, payload, conversation_id),
+                              on_error=on_cache_error)
+            return
+        self.submit_job(selected_model, topic, question, payload, conversation_id)
+
+    def on_cache_result(self, answer, selected_model, topic, question, payload, conversation_id):
+        self.cache_stats_var.set(self.cache.stats_text())
+        if answer is None:
+            self.submit_job(selected_model, topic, question, payload, conversation_id)
+            return
+        logging.info(f"Cache hit for model {selected_model}: {question}")
+        self.displayed_job_id = None
+        self.display_answer(answer)
+        self.stats_var.set("Answer from cache (tick 'Bypass cache' to regenerate)")
+        if conversation_id:
+            self.record_turn(conversation_id, selected_model, question, answer)
+
+    def record_turn(self, conversation_id, model, question, answer):
+        self.db.submit_write(qa_db.add_turn, conversation_id, model,
+                             question, conversations.estimate_tokens(question),
+                             answer, conversations.estimate_tokens(answer),
+                             callback=lambda _: self.check_conversation_budget(conversation_id, model),
+                             on_error=self.show_db_error)
+
+    def check_conversation_budget(self, conversation_id, model):
+        # 历史超出预算时在后台把较早的对话压缩成摘要
+        if conversation_id in self.summarizing:
+            return
+
+        def on_context(context):
+            summary, _, history = context
+            dropped = conversations.overflow(history, self.conversation_settings.token_budget)
+            if not dropped:
+                return
+            self.summarizing.add(conversation_id)
+            threading.Thread(target=self._summarize_thread, args=(conversation_id, model, summary, dropped), daemon=True).start()
 
-            if self.vision_var.get() and self.uploaded_image_data:
-                # 如果选择了 Vision 且上传了图片，添加 images 字段
-                # 假设 API 需要 Base64 编码的图像数据
-                encoded_image = base64.b64encode(self.uploaded_image_data).decode('utf-8')
-                payload["messages"][0]["images"] = [encoded_image]
-
-            headers = {"Content-Type": "application/json"}
-            response = requests.post(f"{self.service_url}/api/chat", json=payload, headers=headers, stream=True)
-            response.raise_for_status()
-
-            collected_content = []
-            for line in response.iter_lines():
-                if line:
-                    data = json.loads(line.decode('utf-8'))
-                    if "error" in data:
-                        raise ValueError(data["error"])
-                    content = data.get('message', {}).get('content', '')
-                    if content:
-                        collected_content.append(content)
-                    if data.get('done', False):
-                        break
-            answer = ''.join(collected_content).strip()
-
-            # 更新 GUI 必须在主线程中进行
-            self.root.after(0, self.display_answer, answer)
-
-            # 自动保存问答对到数据库
-            self.root.after(0, self.save_question_answer, selected_model, topic, question, answer)
+        self.db.submit_read(qa_db.fetch_conversation, conversation_id, callback=on_context, on_error=self.show_db_error)
 
+    def _summarize_thread(self, conversation_id, model, summary, dropped):
+        try:
+            host = self.hosts.pick(model)
+            try:
+                new_summary = conversations.summarize(host.client, model, summary, dropped, self.conversation_settings.keep_alive)
+            finally:
+                self.hosts.release(host)
+            if new_summary:
+                self.db.submit_write(qa_db.set_conversation_summary, conversation_id, new_summary, dropped[-1][0])
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to send question: {e}")
-            logging.error(f"RequestException: {e}")
+            # 摘要失败不影响对话，下一轮只是少带一些早期上下文
+            logging.error(f"Summary Error: {e}")
         finally:
-            self.root.after(0, self.reset_cursor)  # 恢复游标
-            self.root.after(0, self.progress.stop)  # 停止进度条
+            self.root.after(0, self.summarizing.discard, conversation_id)
+
+    def submit_job(self, selected_model, topic, question, payload, conversation_id=None):
+        # 交给调度器排队执行；相同的请求正在进行时直接显示它
+        job, is_new = self.scheduler.submit(selected_model, topic, question, payload, conversation_id)
+        if not is_new:
+            logging.info(f"Duplicate request merged into job {job.id}")
+        self.show_job(job.id)
+        self.ensure_polling()
+
+    def on_job_event(self, job, event, data):
+        # 在工作线程中调用，只入队，由 poll_stream 在主线程处理
+        self.stream_queue.put((job, event, data))
+
+    def ensure_polling(self):
+        if not self.polling:
+            self.polling = True
+            self.root.after(STREAM_FRAME_MS, self.poll_stream)
+
+    def poll_stream(self):
+        # 一次取出队列中所有事件，每帧只做一次 insert，避免每个 token 都刷新 Tk
+        streamed = set()
+        finished_panes = {}
+        changed = {}
+        try:
+            while True:
+                job, event, data = self.stream_queue.get_nowait()
+                changed[job.id] = job
+                if event == 'chunk':
+                    streamed.add(job.id)
+                    continue
+                pane = None
+                if event in (chat_jobs.DONE, chat_jobs.FAILED, chat_jobs.CANCELLED):
+                    # 任务结束的事件到达后才移除比较窗格 (job.status 在事件入队之前就已改变)
+                    pane = self.compare_panes.pop(job.id, None)
+                    if pane is not None:
+                        finished_panes[job.id] = pane
+                if event == chat_jobs.DONE:
+                    # 自动保存问答对到数据库
+                    if pane is not None:
+                        self.save_comparison_result(job, pane)
+                    else:
+                        self.save_question_answer(job.model, job.topic, job.question, job.answer, self.metrics.for_job(job),
+                                                  job.payload.get('options'))
+                    if self.cache.enabled:
+                        self.cache.store(job.payload, job.model, job.answer)
+                    if job.conversation_id:
+                        self.record_turn(job.conversation_id, job.model, job.question, job.answer)
+                elif event == chat_jobs.FAILED:
+                    self.metrics.record(job, on_error=self.show_db_error)
+                    if pane is None:  # 比较模式的错误显示在该模型的窗格中
+                        messagebox.showerror("Error", f"Failed to send question: {data}")
+                elif event == chat_jobs.CANCELLED:
+                    self.metrics.record(job, on_error=self.show_db_error)
+        except queue.Empty:
+            pass
+
+        if self.displayed_job_id in streamed:
+            # 片段先加入 job.parts 再入队，直接取尚未显示的部分，不会与 show_job 已显示的重复
+            job = changed[self.displayed_job_id]
+            text, self.displayed_parts = new_parts(job, self.displayed_parts)
+            if text:
+                self.answer_renderer.append(text)
+                self.answer_entry.see(tk.END)
+        if self.compare_panes or finished_panes:
+            self.update_compare_panes(changed, finished_panes)
+        for job in changed.values():
+            self.update_job_row(job)
+        if changed:
+            self.update_host_status()
+        job = changed.get(self.displayed_job_id)
+        if job is not None:
+            self.stats_var.set(f"[{job.status}] {job.stats()}" if not job.active else job.stats())
+        self.trim_job_list()
+
+        busy = bool(self.scheduler.active_jobs())
+        if busy != self.busy:
+            self.busy = busy
+            if busy:
+                self.progress.start()  # 启动进度条
+                self.set_cursor_wait()  # 设置游标为等待状态
+            else:
+                self.progress.stop()  # 停止进度条
+                self.reset_cursor()  # 恢复游标
+        if busy or not self.stream_queue.empty():
+            self.root.after(STREAM_FRAME_MS, self.poll_stream)
+        else:
+            self.polling = False
+
+    def update_job_row(self, job):
+        server = job.server.split('://')[-1] if job.server else ''
+        values = (job.id, job.model, server, job.status, job.stats(), job.question.replace('\n', ' ')[:80])
+        iid = str(job.id)
+        if self.jobs_tree.exists(iid):
+            self.jobs_tree.item(iid, values=values)
+        else:
+            self.jobs_tree.insert('', 0, iid=iid, values=values)
+
+    def trim_job_list(self):
+        finished = [job for job in self.scheduler.jobs.values() if not job.active]
+        for job in sorted(finished, key=lambda j: j.id)[:-JOB_HISTORY or None]:
+            self.scheduler.forget(job.id)
+            if self.jobs_tree.exists(str(job.id)):
+                self.jobs_tree.delete(str(job.id))
+
+    def update_host_status(self):
+        for host, label in zip(self.hosts.hosts, self.host_labels):
+            label.config(text=host.status_text(), fg='blue' if host.healthy else 'red')
+
+    def show_job(self, job_id):
+        job = self.scheduler.jobs.get(job_id)
+        if job is None:
+            return
+        self.displayed_job_id = job_id
+        self.update_job_row(job)
+        if self.jobs_tree.selection() != (str(job_id),):
+            self.jobs_tree.selection_set(str(job_id))
+        text, self.displayed_parts = new_parts(job, 0)
+        self.display_answer(text)
+        self.stats_var.set(job.stats())
+
+    def on_job_select(self, event):
+        selection = self.jobs_tree.selection()
+        if selection and int(selection[0]) != self.displayed_job_id:
+            self.show_job(int(selection[0]))
+
+    def cancel_job(self):
+        selection = self.jobs_tree.selection()
+        if not selection:
+            messagebox.showwarning("Selection Error", "Please select a job to cancel.")
+            return
+        self.scheduler.cancel(int(selection[0]))
+        self.ensure_polling()
 
     def set_cursor_wait(self):
         self.root.config(cursor="wait")
         self.root.update()
 
     def display_answer(self, answer):
-        self.answer_entry.delete("1.0", tk.END)
-        self.answer_entry.insert(tk.END, answer)
+        self.answer_renderer.set_text(answer)
 
     def reset_cursor(self):
         self.root.config(cursor="")
         self.root.update()
 
-    def save_question_answer(self, model, topic, question, answer):
-        try:
-            conn = sqlite3.connect(myDATABASE)
-            c = conn.cursor()
-            c.execute("INSERT INTO questions (model, topic, question, answer) VALUES (?, ?, ?, ?)", (model, topic, question, answer))
-            conn.commit()
-            conn.close()
-            self.load_data()  # 刷新数据展示
-        except Exception as e:
+    def save_question_answer(self, model, topic, question, answer, request_metrics=None, options=None):
+        def on_error(e):
             messagebox.showerror("Database Error", f"Failed to save question and answer: {e}")
             logging.error(f"Database Error: {e}")
 
+        self.db.submit_write(qa_db.insert_answer, model, topic, question, answer, request_metrics, options,
+                             callback=self.on_record_inserted, on_error=on_error)
+
     def load_data(self):
-        try:
-            conn = sqlite3.connect(myDATABASE)
-            c = conn.cursor()
-            c.execute("SELECT * FROM questions ORDER BY ID DESC")
-            rows = c.fetchall()
-            conn.close()
-            
-            # 清除现有的树状视图数据
-            for item in self.tree.get_children():
-                self.tree.delete(item)
-            
-            # 插入新的数据
-            for row in rows:
-                self.tree.insert('', tk.END, values=row)
-        except Exception as e:
-            messagebox.showerror("Database Error", str(e))
-            logging.error(f"Database Error: {e}")
+        # 重新从最新一页开始浏览
+        self.history_mode = 'recent'
+        self.history_oldest_id = None
+        self.history_exhausted = False
+        self.history_trimmed = False
+        self.history_loading = False
+        self.tree.delete(*self.tree.get_children())
+        self.load_next_page()
+
+    def load_next_page(self):
+        if self.history_mode != 'recent' or self.history_loading or self.history_exhausted:
+            return
+        self.history_loading = True
+        self.db.submit_read(qa_db.fetch_page, self.history_oldest_id, HISTORY_PAGE_SIZE,
+                            callback=self.append_page, on_error=self.on_page_error)
+
+    def append_page(self, rows):
+        self.history_loading = False
+        if self.history_mode != 'recent':
+            return  # 加载期间已切换到搜索结果
+        for row in rows:
+            if not self.tree.exists(str(row[0])):
+                self.tree.insert('', tk.END, iid=str(row[0]), values=row)
+        if rows:
+            self.history_oldest_id = rows[-1][0]
+        if len(rows) < HISTORY_PAGE_SIZE:
+            self.history_exhausted = True
+        # 只保留最近读取的几页: 移出顶部的行，并保持可见的行不动
+        items = self.tree.get_children()
+        extra = len(items) - HISTORY_PAGE_SIZE * HISTORY_MAX_PAGES
+        if extra > 0:
+            top = round(self.tree.yview()[0] * len(items))
+            self.tree.delete(*items[:extra])
+            self.tree.yview_moveto(max(0, top - extra) / (len(items) - extra))
+            self.history_trimmed = True
+
+    def load_previous_page(self):
+        if self.history_mode != 'recent' or self.history_loading or not self.history_trimmed:
+            return
+        items = self.tree.get_children()
+        if not items:
+            return
+        self.history_loading = True
+        self.db.submit_read(qa_db.fetch_page_after, int(items[0]), HISTORY_PAGE_SIZE,
+                            callback=self.prepend_page, on_error=self.on_page_error)
+
+    def prepend_page(self, rows):
+        self.history_loading = False
+        if self.history_mode != 'recent':
+            return
+        items = self.tree.get_children()
+        top = round(self.tree.yview()[0] * len(items))
+        for row in reversed(rows):
+            if not self.tree.exists(str(row[0])):
+                self.tree.insert('', 0, iid=str(row[0]), values=row)
+        if len(rows) < HISTORY_PAGE_SIZE:
+            self.history_trimmed = False  # 已回到最新的记录
+        # 移出底部多余的行，之后向下滚动时从 history_oldest_id 重新读取
+        items = self.tree.get_children()
+        extra = len(items) - HISTORY_PAGE_SIZE * HISTORY_MAX_PAGES
+        if extra > 0:
+            self.tree.delete(*items[-extra:])
+            items = items[:-extra]
+            self.history_oldest_id = int(items[-1])
+            self.history_exhausted = False
+        if items:
+            self.tree.yview_moveto((top + len(rows)) / len(items))
+
+    def on_page_error(self, e):
+        self.history_loading = False
+        self.show_db_error(e)
+
+    def on_tree_scroll(self, first, last):
+        self.tree_scrollbar.set(first, last)
+        # 滚动接近底部时预取下一页，接近顶部时重新读取被移出的较新记录
+        if float(last) >= HISTORY_PREFETCH_AT:
+            self.load_next_page()
+        elif float(first) <= 1 - HISTORY_PREFETCH_AT:
+            self.load_previous_page()
+
+    def show_rows(self, rows):
+        self.tree.delete(*self.tree.get_children())
+        for row in rows:
+            self.tree.insert('', tk.END, iid=str(row[0]), values=row)
+
+    # 增量更新: 只插入/更新/删除受影响的一行，不重建整个列表
+    def on_record_inserted(self, record_id):
+        self.semantic.wake()  # 新记录在后台计算向量
+        if self.history_mode is None:
+            self.load_data()
+        elif self.history_mode == 'recent':
+            self.db.submit_read(qa_db.fetch_preview, record_id, callback=self.insert_tree_row, on_error=self.show_db_error)
+
+    def insert_tree_row(self, row):
+        # 顶部的较新记录已移出时，新记录等向上滚动到顶部时再读取
+        if row and not self.history_trimmed and not self.tree.exists(str(row[0])):
+            self.tree.insert('', 0, iid=str(row[0]), values=row)
+
+    def update_tree_row(self, row):
+        if row and self.tree.exists(str(row[0])):
+            self.tree.item(str(row[0]), values=row)
+
+    def remove_tree_row(self, record_id):
+        if self.tree.exists(str(record_id)):
+            self.tree.delete(str(record_id))
 
     def on_tree_select(self, event):
         selected_item = self.tree.focus()
         if selected_item:
-            values = self.tree.item(selected_item, 'values')
-            if values:
-                _, model, topic, question, answer, timestamp = values
-                self.model_var.set(model)  # 设置选中的模型
-                self.topic_entry.delete(0, tk.END)
-                self.topic_entry.insert(0, topic)
-                self.question_text.delete("1.0", tk.END)
-                self.question_text.insert(tk.END, question)
-                self.answer_entry.delete("1.0", tk.END)
-                self.answer_entry.insert(tk.END, answer)
+            # 列表里只有预览，完整问答按需读取
+            self.db.submit_read(qa_db.fetch_question, int(selected_item), callback=self.show_record, on_error=self.show_db_error)
+
+    def show_record(self, row):
+        if not row or self.tree.focus() != str(row[0]):
+            return  # 读取期间选中了其它记录
+        self.displayed_job_id = None  # 答案区改为显示历史记录，不再追加流式输出
+        _, model, topic, question, answer, timestamp, options = row
+        self.model_var.set(model)  # 设置选中的模型
+        self.topic_entry.delete(0, tk.END)
+        self.topic_entry.insert(0, topic)
+        self.question_text.delete("1.0", tk.END)
+        self.question_text.insert(tk.END, question)
+        self.answer_renderer.set_text(answer or '')
+        # 显示生成这条答案时使用的参数
+        self.stats_var.set(f"Options: {model_options.options_text(json.loads(options))}" if options else '')
 
     def edit_data(self):
         selected_item = self.tree.focus()
@@ -450,7 +1144,7 @@ class OllamaGUI:
             messagebox.showwarning("Selection Error", "Selected item has no data.")
             return
         
-        record_id, model, topic, question, answer, timestamp = values
+        record_id = int(selected_item)
         
         new_model = self.model_var.get().strip()
         new_topic = self.topic_entry.get().strip()
@@ -465,17 +1159,13 @@ class OllamaGUI:
             messagebox.showwarning("Input Error", "Topic and Question fields cannot be empty.")
             return
         
-        try:
-            conn = sqlite3.connect(myDATABASE)
-            c = conn.cursor()
-            c.execute("UPDATE questions SET model=?, topic=?, question=?, answer=? WHERE id=?", (new_model, new_topic, new_question, new_answer, record_id))
-            conn.commit()
-            conn.close()
+        def on_updated(_):
+            self.semantic.updated(record_id)  # 内容有变化时，向量在后台重新计算
             messagebox.showinfo("Success", "Record updated successfully.")
-            self.load_data()
-        except Exception as e:
-            messagebox.showerror("Database Error", str(e))
-            logging.error(f"Database Error: {e}")
+            self.db.submit_read(qa_db.fetch_preview, record_id, callback=self.update_tree_row, on_error=self.show_db_error)
+
+        self.db.submit_write(qa_db.update_question, record_id, new_model, new_topic, new_question, new_answer,
+                             callback=on_updated, on_error=self.show_db_error)
 
     def delete_data(self):
         selected_item = self.tree.focus()
@@ -488,81 +1178,447 @@ class OllamaGUI:
             messagebox.showwarning("Selection Error", "Selected item has no data.")
             return
         
-        record_id = values[0]
+        record_id = int(selected_item)
         
         confirm = messagebox.askyesno("Confirm Deletion", "Are you sure you want to delete the selected record?")
         if not confirm:
             return
         
-        try:
-            conn = sqlite3.connect(myDATABASE)
-            c = conn.cursor()
-            c.execute("DELETE FROM questions WHERE id=?", (record_id,))
-            conn.commit()
-            conn.close()
-            self.load_data()
-        except Exception as e:
-            messagebox.showerror("Database Error", str(e))
-            logging.error(f"Database Error: {e}")
+        def on_deleted(_):
+            self.semantic.forget(record_id)
+            self.remove_tree_row(record_id)
+
+        self.db.submit_write(qa_db.delete_question, record_id, callback=on_deleted, on_error=self.show_db_error)
 
     def search_data(self):
-        topic = self.topic_entry.get().strip()
-        if not topic:
-            messagebox.showwarning("Input Error", "Please enter a topic to search.")
+        # 搜索栏为空时沿用 Topic 作为关键词
+        if not self.search_var.get().strip() and not self.search_filters_set():
+            topic = self.topic_entry.get().strip()
+            if not topic:
+                messagebox.showwarning("Input Error", "Please enter a topic or keywords to search.")
+                return
+            self.search_var.set(topic)
+        self.run_search()
+
+    def search_filters_set(self):
+        return (self.search_model_var.get() != ALL_MODELS
+                or self.search_from_var.get().strip() or self.search_to_var.get().strip())
+
+    def schedule_search(self, *args):
+        # 防抖: 停止输入 SEARCH_DEBOUNCE_MS 后才查询
+        if self.search_after_id:
+            self.root.after_cancel(self.search_after_id)
+        self.search_after_id = self.root.after(SEARCH_DEBOUNCE_MS, self.run_search)
+
+    def run_search(self):
+        self.search_after_id = None
+        text = self.search_var.get().strip()
+        if not text and not self.search_filters_set():
+            if self.history_mode == 'search':
+                self.load_data()  # 清空条件后回到最近记录
             return
-        
-        try:
-            conn = sqlite3.connect(myDATABASE)
-            c = conn.cursor()
-            c.execute("SELECT * FROM questions WHERE topic LIKE ?", ('%' + topic + '%',))
-            rows = c.fetchall()
-            conn.close()
-            
-            # 清除现有数据
-            for item in self.tree.get_children():
-                self.tree.delete(item)
-            
-            # 插入搜索结果
-            for row in rows:
-                self.tree.insert('', tk.END, values=row)
-        except Exception as e:
-            messagebox.showerror("Database Error", str(e))
-            logging.error(f"Database Error: {e}")
 
-    def export_to_text(self):
-        try:
-            file_path = filedialog.asksaveasfilename(
-                defaultextension=".txt",
-                filetypes=[("Text files", "*.txt"), ("All files", "*.*")],
-                title="Save as"
-            )
+        model = self.search_model_var.get()
+        model = None if model == ALL_MODELS else model
+        date_from = self.search_from_var.get().strip() or None
+        date_to = self.search_to_var.get().strip() or None
+
+        self.history_mode = 'search'
+        self.search_generation += 1
+        generation = self.search_generation
+
+        def search_job(conn):
+            if generation != self.search_generation:
+                return None  # 已有更新的搜索在排队
+            return qa_db.search(conn, text, model, date_from, date_to)
+
+        def on_results(rows):
+            if rows is not None and generation == self.search_generation and self.history_mode == 'search':
+                self.show_rows(rows)
+
+        if text and self.semantic_search_var.get():
+            # 语义搜索: 先计算关键词的向量找出最相近的记录，再按相似度顺序读取预览 (筛选条件在读取时应用)
+            def semantic_job():
+                if generation != self.search_generation:
+                    return None
+                return self.semantic.search(text, qa_db.SEARCH_LIMIT)
+
+            def on_matches(matches):
+                if matches is not None and generation == self.search_generation:
+                    self.db.submit_read(qa_db.fetch_previews, [record_id for record_id, _ in matches], model, date_from, date_to,
+                                        callback=on_results, on_error=self.show_db_error)
+
+            self.semantic.submit(semantic_job, callback=on_matches, on_error=self.show_semantic_error)
+            return
+        self.db.submit_read(search_job, callback=on_results, on_error=self.show_db_error)
+
+    def show_semantic_error(self, e):
+        messagebox.showerror("Semantic Search Error", f"Embedding with {self.semantic.model} failed: {e}")
+        logging.error(f"Semantic Search Error: {e}")
+
+    def update_semantic_status(self):
+        self.semantic_status_var.set(self.semantic.status_text())
+
+    def schedule_related(self, event=None):
+        if self.related_after_id:
+            self.root.after_cancel(self.related_after_id)
+        self.related_after_id = self.root.after(RELATED_DEBOUNCE_MS, self.find_related)
+
+    def find_related(self):
+        self.related_after_id = None
+        text = self.question_text.get("1.0", tk.END).strip()
+        self.related_generation += 1
+        generation = self.related_generation
+        if len(text) < RELATED_MIN_CHARS:
+            self.show_related([])
+            return
+
+        def related_job():
+            if generation != self.related_generation:
+                return None
+            matches = self.semantic.search(text, RELATED_COUNT)
+            rows = self.db.read(qa_db.fetch_previews, [record_id for record_id, _ in matches])
+            scores = dict(matches)
+            return [(scores[row[0]], row) for row in rows]
+
+        def on_related(related):
+            if related is not None and generation == self.related_generation:
+                self.show_related(related)
+
+        # 服务器暂时不可用时只记录日志，不打断输入
+        self.semantic.submit(related_job, callback=on_related,
+                             on_error=lambda e: logging.warning(f"Related answers lookup failed: {e}"))
+
+    def show_related(self, related):
+        self.related_list.delete(0, tk.END)
+        self.related_ids = []
+        for score, (record_id, model, topic, question, answer, timestamp) in related:
+            self.related_list.insert(tk.END, f"{score:.2f}  {topic} | {question}")
+            self.related_ids.append(record_id)
+
+    def open_related(self, event=None):
+        selection = self.related_list.curselection()
+        if selection:
+            self.db.submit_read(qa_db.fetch_question, self.related_ids[selection[0]],
+                                callback=self.show_related_record, on_error=self.show_db_error)
+
+    def show_related_record(self, row):
+        # 在单独的窗口中查看，不覆盖正在输入的问题
+        if not row:
+            return
+        record_id, model, topic, question, answer, timestamp, options = row
+        window = tk.Toplevel(self.root)
+        window.title(f"{topic} ({model}, {timestamp})")
+        text = scrolledtext.ScrolledText(window, wrap=tk.WORD, width=90, height=25)
+        text.grid(row=0, column=0, padx=10, pady=10, sticky='nsew')
+        text.insert(tk.END, f"Question:\n{question}\n\nAnswer:\n{answer or ''}")
+        text.configure(state='disabled')
+        window.grid_rowconfigure(0, weight=1)
+        window.grid_columnconfigure(0, weight=1)
+
+    def clear_search(self):
+        self.search_var.set('')
+        self.search_model_var.set(ALL_MODELS)
+        self.search_from_var.set('')
+        self.search_to_var.set('')
+
+    def refresh_search_models(self):
+        self.db.submit_read(qa_db.fetch_models, callback=lambda models: self.search_model_combo.configure(values=[ALL_MODELS] + models))
+
+    def export_data(self):
+        # 导出对话框: 选择格式与筛选条件 (默认沿用搜索栏的条件)，在后台线程中流式写出
+        window = tk.Toplevel(self.root)
+        window.title("Export")
+        form = ttk.Frame(window)
+        form.grid(row=0, column=0, padx=10, pady=10, sticky='we')
+        format_var = tk.StringVar(value='JSONL')
+        gzip_var = tk.BooleanVar()
+        text_var = tk.StringVar(value=self.search_var.get().strip() if self.history_mode == 'search' else '')
+        model_var = tk.StringVar(value=self.search_model_var.get())
+        topic_var = tk.StringVar()
+        from_var = tk.StringVar(value=self.search_from_var.get().strip())
+        to_var = tk.StringVar(value=self.search_to_var.get().strip())
+
+        tk.Label(form, text="Format:").grid(row=0, column=0, sticky='w')
+        ttk.Combobox(form, textvariable=format_var, values=list(qa_export.FORMATS), state='readonly', width=12).grid(row=0, column=1, sticky='w', pady=2)
+        tk.Checkbutton(form, text="Compress (gzip)", variable=gzip_var).grid(row=0, column=2, sticky='w', padx=5)
+        tk.Label(form, text="Keywords:").grid(row=1, column=0, sticky='w')
+        ttk.Entry(form, textvariable=text_var, width=40).grid(row=1, column=1, columnspan=2, sticky='we', pady=2)
+        tk.Label(form, text="Model:").grid(row=2, column=0, sticky='w')
+        model_combo = ttk.Combobox(form, textvariable=model_var, values=[ALL_MODELS], state='readonly', width=25)
+        model_combo.grid(row=2, column=1, columnspan=2, sticky='w', pady=2)
+        self.db.submit_read(qa_db.fetch_models, callback=lambda models: model_combo.configure(values=[ALL_MODELS] + models)
+                            if model_combo.winfo_exists() else None)
+        tk.Label(form, text="Topic:").grid(row=3, column=0, sticky='w')
+        ttk.Entry(form, textvariable=topic_var, width=40).grid(row=3, column=1, columnspan=2, sticky='we', pady=2)
+        tk.Label(form, text="From / To (YYYY-MM-DD):").grid(row=4, column=0, sticky='w')
+        ttk.Entry(form, textvariable=from_var, width=12).grid(row=4, column=1, sticky='w', pady=2)
+        ttk.Entry(form, textvariable=to_var, width=12).grid(row=4, column=2, sticky='w', pady=2)
+        progress, status_var, buttons = self.transfer_widgets(window)
+
+        def start():
+            fmt = format_var.get()
+            compress = gzip_var.get()
+            extension = qa_export.FORMATS[fmt] + ('.gz' if compress and fmt != 'Parquet' else '')
+            file_path = filedialog.asksaveasfilename(parent=window, defaultextension=extension, title="Save as",
+                                                     filetypes=[(f"{fmt} files", "*" + extension), ("All files", "*.*")])
             if not file_path:
-                return  # 如果用户取消操作，则退出函数
-
-            conn = sqlite3.connect(myDATABASE)
-            c = conn.cursor()
-            c.execute("SELECT * FROM questions")
-            rows = c.fetchall()
-            conn.close()
-
-            with open(file_path, 'w', encoding='utf-8') as f:
-                for row in rows:
-                    id, model, topic, question, answer, timestamp = row
-                    f.write(f"ID: {id}\n")
-                    f.write(f"Model: {model}\n")
-                    f.write(f"Topic: {topic}\n")
-                    f.write(f"Question: {question}\n")
-                    f.write(f"Answer: {answer}\n")
-                    f.write(f"Timestamp: {timestamp}\n")
-                    f.write("-" * 50 + "\n")
-
-            messagebox.showinfo("Success", f"Data exported successfully to {file_path}")
-            logging.info(f"Data exported successfully to {file_path}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to export data: {e}")
+                return
+            model = model_var.get()
+            filters = {'text': text_var.get().strip(), 'model': None if model == ALL_MODELS else model,
+                       'topic': topic_var.get().strip() or None,
+                       'date_from': from_var.get().strip() or None, 'date_to': to_var.get().strip() or None}
+            export_button.config(state='disabled')
+
+            def on_done(count):
+                messagebox.showinfo("Success", f"Exported {count} records to {file_path}")
+                logging.info(f"Exported {count} records to {file_path}")
+
+            self.run_transfer(window, progress, status_var, on_done,
+                              qa_export.export_records, file_path, fmt, filters, compress)
+
+        export_button = ttk.Button(buttons, text="Export", style="Other.TButton", command=start)
+        export_button.grid(row=0, column=0, padx=5)
+
+    def import_data(self):
+        file_path = filedialog.askopenfilename(
+            title="Import",
+            filetypes=[("Exported records", " ".join(f"*{ext} *{ext}.gz" for ext in qa_export.IMPORT_EXTENSIONS)), ("All files", "*.*")]
+        )
+        if not file_path:
+            return
+        window = tk.Toplevel(self.root)
+        window.title("Import")
+        tk.Label(window, text=f"Importing {file_path}").grid(row=0, column=0, padx=10, pady=10, sticky='w')
+        progress, status_var, _ = self.transfer_widgets(window)
+
+        def on_done(count):
+            messagebox.showinfo("Success", f"Imported {count} records from {file_path}")
+            logging.info(f"Imported {count} records from {file_path}")
+            self.load_data()
+            self.semantic.wake()
+
+        self.run_transfer(window, progress, status_var, on_done, qa_export.import_records, file_path)
+
+    def transfer_widgets(self, window):
+        progress = ttk.Progressbar(window, mode='determinate', maximum=1.0, length=400)
+        progress.grid(row=1, column=0, padx=10, pady=5, sticky='we')
+        status_var = tk.StringVar()
+        tk.Label(window, textvariable=status_var, fg='grey').grid(row=2, column=0, padx=10, sticky='w')
+        buttons = ttk.Frame(window)
+        buttons.grid(row=3, column=0, padx=10, pady=10, sticky='e')
+        ttk.Button(buttons, text="Cancel", style="Other.TButton", command=window.destroy).grid(row=0, column=1, padx=5)
+        return progress, status_var, buttons
+
+    def run_transfer(self, window, progress, status_var, on_done, work, *args):
+        # work(conn, *args, progress=, cancel=) 在后台线程中用独立的数据库连接运行 (WAL 允许与界面的读写并发)
+        cancel = threading.Event()
+        window.bind('<Destroy>', lambda event: cancel.set() if event.widget is window else None)
+
+        def show_progress(fraction, count):
+            if window.winfo_exists():
+                progress['value'] = fraction
+                status_var.set(f"{count} records")
+
+        def finish(result, error):
+            if window.winfo_exists():
+                window.destroy()
+            if isinstance(error, qa_export.Cancelled):
+                logging.info(f"{work.__name__} cancelled after {error.count} records")
+                if work is qa_export.import_records:
+                    self.load_data()  # 已提交的批次保留
+                    self.semantic.wake()
+            elif error is not None:
+                messagebox.showerror("Error", f"Failed: {error}")
+                logging.error(f"Transfer Error: {error}")
+            else:
+                on_done(result)
+
+        def transfer_thread():
+            # 首次启动时写线程可能还在迁移数据库结构，等它完成后再打开独立的连接
+            self.db.ready.wait()
+            conn = None
+            try:
+                if self.db.open_error is not None:
+                    raise self.db.open_error
+                conn = self.db.connect()
+                result = work(conn, *args, progress=lambda f, n: self.root.after(0, show_progress, f, n), cancel=cancel)
+                self.root.after(0, finish, result, None)
+            except Exception as e:
+                self.root.after(0, finish, None, e)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+        status_var.set("Working...")
+        threading.Thread(target=transfer_thread, name='transfer', daemon=True).start()
+
+    def show_compare(self):
+        # 比较模式: 主窗口中的问题同时发给选中的多个模型，答案与 TTFT / tokens/s / 总时间并排显示
+        if self.compare_window is not None and self.compare_window.winfo_exists():
+            self.compare_window.lift()
+            return
+        window = self.compare_window = tk.Toplevel(self.root)
+        window.title("Compare Models")
+        controls = ttk.Frame(window)
+        controls.grid(row=0, column=0, padx=10, pady=10, sticky='we')
+        tk.Label(controls, text="Models:", font=('Helvetica', 10)).grid(row=0, column=0, sticky='nw')
+        self.compare_models = tk.Listbox(controls, selectmode=tk.MULTIPLE, exportselection=False, height=6, width=40)
+        for index, name in enumerate(self.model_registry.names()):
+            self.compare_models.insert(tk.END, name)
+            if name == self.model_var.get():
+                self.compare_models.selection_set(index)
+        self.compare_models.grid(row=0, column=1, padx=5, sticky='w')
+        ttk.Button(controls, text="Compare", style="Ask.TButton", command=self.start_comparison).grid(row=0, column=2, padx=10, sticky='n')
+        self.compare_status_var = tk.StringVar(value="The question and topic are taken from the main window.")
+        tk.Label(controls, textvariable=self.compare_status_var, fg='grey', font=('Helvetica', 10)).grid(row=0, column=3, padx=5, sticky='nw')
+        self.compare_frame = ttk.Frame(window)
+        self.compare_frame.grid(row=1, column=0, padx=10, sticky='nsew')
+        window.grid_rowconfigure(1, weight=1)
+        window.grid_columnconfigure(0, weight=1)
+
+    def start_comparison(self):
+        window = self.compare_window
+        models = [self.compare_models.get(index) for index in self.compare_models.curselection()]
+        topic = self.topic_entry.get().strip()
+        question = self.question_text.get("1.0", tk.END).strip()
+        if len(models) < 2:
+            messagebox.showwarning("Input Error", "Select at least two models to compare.", parent=window)
+            return
+        if not question:
+            messagebox.showwarning("Input Error", "Question field cannot be empty.", parent=window)
+            return
+
+        # 所有答案照常存入 questions，并在 batch_results 中以同一个 run 名归为一组
+        # batch_results 以 (run, prompt_key, model) 为主键，同一秒内的两次比较也要分开
+        run = f"compare:{time.strftime('%Y-%m-%d %H:%M:%S')} {uuid.uuid4().hex[:6]}"
+        key = hashlib.sha1(question.encode('utf-8')).hexdigest()
+        frame = self.compare_frame
+        for child in frame.winfo_children():
+            child.destroy()
+        for column, model in enumerate(models):
+            tk.Label(frame, text=model, font=('Helvetica', 11, 'bold')).grid(row=0, column=column, padx=5, sticky='w')
+            stats_var = tk.StringVar(value="Queued")
+            tk.Label(frame, textvariable=stats_var, fg='grey', font=('Helvetica', 9)).grid(row=1, column=column, padx=5, sticky='w')
+            text = scrolledtext.ScrolledText(frame, wrap=tk.WORD, width=max(30, 160 // len(models)), height=25)
+            text.grid(row=2, column=column, padx=5, pady=(0, 10), sticky='nsew')
+            frame.grid_columnconfigure(column, weight=1, uniform='pane')
+            payload = {"model": model, "messages": [{"role": "user", "content": question}]}
+            self.model_options.apply(payload)
+            # 每台服务器同时生成的数量仍由调度器的 MaxPerServer 限制，其余排队。
+            # 不与正在进行的相同请求合并，每个窗格有自己的任务，结果只属于这一次比较
+            job, _ = self.scheduler.submit(model, topic, question, payload, shared=False)
+            renderer = MarkdownRenderer.from_config(config, text)
+            self.compare_panes[job.id] = {'run': run, 'key': key, 'stats': stats_var, 'text': text, 'renderer': renderer,
+                                          'parts': 0}
+            self.update_job_row(job)
+        frame.grid_rowconfigure(2, weight=1)
+        self.compare_status_var.set(f"{len(models)} models | saved as run '{run}'")
+        self.ensure_polling()
+
+    def update_compare_panes(self, changed, finished):
+        for job in changed.values():
+            pane = self.compare_panes.get(job.id) or finished.get(job.id)
+            if pane is None or not pane['text'].winfo_exists():  # 比较窗口关闭后任务继续，结果照常保存
+                continue
+            text, pane['parts'] = new_parts(job, pane['parts'])
+            if text:
+                pane['renderer'].append(text)
+                pane['text'].see(tk.END)
+            if job.status == chat_jobs.FAILED:
+                pane['stats'].set(f"Failed: {job.error}")
+            else:
+                pane['stats'].set(job.stats() if job.active else f"[{job.status}] {job.stats()}")
+
+    def save_comparison_result(self, job, pane):
+        m = job.metrics()
+        self.db.submit_write(qa_db.insert_batch_result, pane['run'], pane['key'], job.model, job.server, job.topic,
+                             job.question, job.answer, m['latency'], m['ttft'], m['tokens'], m['tokens_per_sec'],
+                             self.metrics.for_job(job), job.payload.get('options'),
+                             callback=self.on_record_inserted, on_error=self.show_db_error)
+
+    def show_metrics(self):
+        # 指标面板: 按模型汇总的 p50/p95 耗时，可导出 CSV 或 Prometheus 文本格式
+        if self.metrics_window is not None and self.metrics_window.winfo_exists():
+            self.metrics_window.lift()
+            self.refresh_metrics()
+            return
+        window = tk.Toplevel(self.root)
+        window.title("Request Metrics")
+        self.metrics_window = window
+
+        controls = ttk.Frame(window)
+        controls.grid(row=0, column=0, padx=10, pady=10, sticky='we')
+        tk.Label(controls, text="Period:", font=('Helvetica', 10)).grid(row=0, column=0)
+        self.metrics_period_var = tk.StringVar(value='Last 24 hours')
+        period = ttk.Combobox(controls, textvariable=self.metrics_period_var, values=list(METRICS_PERIODS), state='readonly', width=14)
+        period.grid(row=0, column=1, padx=5)
+        period.bind('<<ComboboxSelected>>', lambda event: self.refresh_metrics())
+        ttk.Button(controls, text="Refresh", style="Other.TButton", command=self.refresh_metrics).grid(row=0, column=2, padx=5)
+        ttk.Button(controls, text="Export CSV", style="Other.TButton", command=lambda: self.export_metrics('csv')).grid(row=0, column=3, padx=5)
+        ttk.Button(controls, text="Export Prometheus", style="Other.TButton", command=lambda: self.export_metrics('prom')).grid(row=0, column=4, padx=5)
+        if not self.metrics.enabled:
+            tk.Label(controls, text="Recording is off ([Metrics] Enabled = false)", fg='red', font=('Helvetica', 10)).grid(row=0, column=5, padx=5)
+
+        self.metrics_tree = ttk.Treeview(window, columns=metrics.SUMMARY_COLUMNS, show='headings', height=12)
+        for column in metrics.SUMMARY_COLUMNS:
+            self.metrics_tree.heading(column, text=column)
+            self.metrics_tree.column(column, width=160 if column == "Model" else 85, anchor='w' if column == "Model" else 'e')
+        self.metrics_tree.grid(row=1, column=0, padx=10, pady=(0, 10), sticky='nsew')
+        window.grid_rowconfigure(1, weight=1)
+        window.grid_columnconfigure(0, weight=1)
+        self.refresh_metrics()
+
+    def metrics_since(self):
+        seconds = METRICS_PERIODS.get(self.metrics_period_var.get())
+        return int(time.time()) - seconds if seconds else 0
+
+    def refresh_metrics(self):
+        def show(summary):
+            if not self.metrics_window.winfo_exists():
+                return
+            self.metrics_tree.delete(*self.metrics_tree.get_children())
+            for entry in summary:
+                self.metrics_tree.insert('', tk.END, values=metrics.summary_row(entry))
+
+        self.db.submit_read(metrics.load_summary, self.metrics_since(), callback=show, on_error=self.show_db_error)
+
+    def export_metrics(self, kind):
+        if kind == 'csv':
+            filetypes, extension, writer = [("CSV files", "*.csv")], ".csv", metrics.write_csv
+        else:
+            filetypes, extension, writer = [("Prometheus text", "*.prom")], ".prom", metrics.write_prometheus
+        file_path = filedialog.asksaveasfilename(parent=self.metrics_window, defaultextension=extension,
+                                                 filetypes=filetypes + [("All files", "*.*")], title="Export metrics")
+        if not file_path:
+            return
+
+        def on_exported(count):
+            messagebox.showinfo("Success", f"Exported metrics of {count} requests to {file_path}", parent=self.metrics_window)
+            logging.info(f"Metrics exported to {file_path}")
+
+        def on_error(e):
+            messagebox.showerror("Error", f"Failed to export metrics: {e}", parent=self.metrics_window)
             logging.error(f"Export Error: {e}")
 
+        self.db.submit_read(writer, file_path, self.metrics_since(), callback=on_exported, on_error=on_error)
+
 if __name__ == "__main__":
+    startup = metrics.StartupTimer(STARTED)
+    startup.mark('imports')
     root = tk.Tk()
-    gui = OllamaGUI(root)
+    root.geometry(smallFrame)
+    # 先把窗口画出来，再建立完整的界面
+    splash = tk.Label(root, text="Starting Ollama Chat UI...", font=('Helvetica', 14))
+    splash.grid(row=0, column=0, padx=40, pady=40)
+    root.update()
+    startup.mark('window')
+    gui = OllamaGUI(root, startup)
+    splash.destroy()
     root.mainloop()
+    gui.scheduler.shutdown()
+    gui.image_pipeline.shutdown()
+    gui.semantic.close()
+    gui.documents.close()
+    gui.hosts.close()
+    gui.db.close()  # 提交尚未写入的数据
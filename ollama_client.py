@@ -0,0 +1,89 @@
+import json
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 默认网络参数，可在 config.ini 的 [Network] 段覆盖
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 300.0  # 大模型冷启动加载可能需要较长时间
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_POOL_SIZE = 10
+
+
+class OllamaClient:
+    """Shared HTTP layer for every call to an Ollama server.
+
+    One requests.Session keeps connections alive between questions; the
+    adapter pool and retry policy are built once from config.ini.
+    """
+
+    def __init__(self, base_url, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, pool_size=DEFAULT_POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+
+        # 连接失败对所有方法重试；读取失败和 5xx 只对幂等的 GET 重试，避免重复生成
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_config(cls, config, base_url):
+        section = config['Network'] if config.has_section('Network') else {}
+        return cls(
+            base_url,
+            connect_timeout=float(section.get('ConnectTimeout', DEFAULT_CONNECT_TIMEOUT)),
+            read_timeout=float(section.get('ReadTimeout', DEFAULT_READ_TIMEOUT)),
+            retries=int(section.get('Retries', DEFAULT_RETRIES)),
+            backoff=float(section.get('BackoffFactor', DEFAULT_BACKOFF)),
+            pool_size=int(section.get('PoolSize', DEFAULT_POOL_SIZE)),
+        )
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def get(self, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(self.url(path), **kwargs)
+
+    def post(self, path, json=None, stream=False, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.post(self.url(path), json=json, stream=stream, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def is_unreachable(error):
+    # 连不上或超时: 可以换一台服务器重试
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def is_missing_model(error):
+    # 该服务器上没有这个模型 (HTTP 404)
+    response = getattr(error, 'response', None)
+    return isinstance(error, requests.HTTPError) and response is not None and response.status_code == 404
+
+
+def iter_chat(response):
+    # 逐行解析 /api/chat 的 NDJSON 流，直到 done
+    for line in response.iter_lines():
+        if line:
+            data = json.loads(line.decode('utf-8'))
+            if "error" in data:
+                raise ValueError(data["error"])
+            yield data
+            if data.get('done', False):
+                break
@@ -0,0 +1,1039 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import queue
+import logging
+import zlib
+
+DEFAULT_DATABASE = 'ollama_QA.db'
+
+# 每个批次最多合并提交的写操作数量
+WRITE_BATCH_SIZE = 64
+
+# 历史列表中问题/答案只保存截断后的预览文字
+PREVIEW_CHARS = 80
+
+# 全文搜索最多返回的结果数，以及摘要中的高亮标记
+SEARCH_LIMIT = 200
+HIGHLIGHT_OPEN = '['
+HIGHLIGHT_CLOSE = ']'
+# 摘要长度 (token 数)，trigram 的一个 token 约等于一个字符
+SNIPPET_TOKENS = {'trigram': 48, 'unicode61': 12}
+
+# SQL 语句保持为常量，sqlite3 会按语句文本缓存编译结果 (prepared statements)
+# 数据库结构版本记录在 PRAGMA user_version 中，打开时依次执行 MIGRATIONS 中尚未执行的迁移
+SCHEMA_VERSION = 5
+
+# 答案压缩: 长度达到阈值 (字节) 的答案以 zlib 压缩后存入 answer_z 列；None 表示不压缩
+DEFAULT_COMPRESS_MIN_BYTES = 2048
+ZLIB_LEVEL = 6
+
+# 版本 1: 最初的 questions 表 (model/topic 直接存文本)，只在迁移中使用
+CREATE_QUESTIONS_V1 = '''
+    CREATE TABLE IF NOT EXISTS questions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        model TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        question TEXT NOT NULL,
+        answer TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+# 版本 2: 模型与主题放进查找表，questions 只存 id；answer 为 TEXT 或压缩后的 BLOB
+CREATE_LOOKUPS = [
+    "CREATE TABLE IF NOT EXISTS models (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS topics (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+]
+CREATE_QUESTIONS_V2 = '''
+    CREATE TABLE questions_v2 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        model_id INTEGER NOT NULL REFERENCES models(id),
+        topic_id INTEGER NOT NULL REFERENCES topics(id),
+        question TEXT NOT NULL,
+        answer,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+COPY_QUESTIONS_V2 = [
+    "INSERT OR IGNORE INTO models (name) SELECT DISTINCT model FROM questions",
+    "INSERT OR IGNORE INTO topics (name) SELECT DISTINCT topic FROM questions",
+    '''
+    INSERT INTO questions_v2 (id, model_id, topic_id, question, answer, timestamp)
+    SELECT q.id, m.id, t.id, q.question, q.answer, q.timestamp
+    FROM questions q JOIN models m ON m.name = q.model JOIN topics t ON t.name = q.topic
+    ''',
+]
+CREATE_QUESTION_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS questions_model ON questions (model_id)",
+    "CREATE INDEX IF NOT EXISTS questions_topic ON questions (topic_id)",
+    "CREATE INDEX IF NOT EXISTS questions_timestamp ON questions (timestamp)",
+]
+# 读取一律通过 qa 视图，列与原来的 questions 表相同
+CREATE_QA_VIEW_V2 = '''
+    CREATE VIEW IF NOT EXISTS qa AS
+    SELECT q.id AS id, m.name AS model, t.name AS topic, q.question AS question,
+           qa_unzip(q.answer) AS answer, q.timestamp AS timestamp
+    FROM questions q JOIN models m ON m.id = q.model_id JOIN topics t ON t.id = q.topic_id
+'''
+# 版本 4: 每条答案记录生成时使用的 options (JSON)；每个模型可保存一组默认 options 与 keep_alive
+ADD_QUESTION_OPTIONS = "ALTER TABLE questions ADD COLUMN options TEXT"
+CREATE_QA_VIEW_V4 = '''
+    CREATE VIEW IF NOT EXISTS qa AS
+    SELECT q.id AS id, m.name AS model, t.name AS topic, q.question AS question,
+           qa_unzip(q.answer) AS answer, q.timestamp AS timestamp, q.options AS options
+    FROM questions q JOIN models m ON m.id = q.model_id JOIN topics t ON t.id = q.topic_id
+'''
+# 版本 5: 压缩的答案移到单独的 answer_z 列 (此时 answer 为 NULL)。文件中的视图和触发器只用 SQLite
+# 自带的函数，sqlite3 命令行等其它工具也能读写；解压由本程序每个连接上的临时视图与临时触发器负责
+ADD_ANSWER_Z = "ALTER TABLE questions ADD COLUMN answer_z BLOB"
+MOVE_COMPRESSED = "UPDATE questions SET answer_z = answer, answer = NULL WHERE typeof(answer) = 'blob'"
+QA_VIEW = '''
+    CREATE {temp}VIEW IF NOT EXISTS qa AS
+    SELECT q.id AS id, m.name AS model, t.name AS topic, q.question AS question,
+           {answer} AS answer, q.timestamp AS timestamp, q.options AS options, q.answer_z AS answer_z
+    FROM questions q JOIN models m ON m.id = q.model_id JOIN topics t ON t.id = q.topic_id
+'''
+# 文件中的视图: 压缩的答案为 NULL；临时视图与它同名，本程序的查询看到的总是解压后的答案
+CREATE_QA_VIEW = QA_VIEW.format(temp='', answer='q.answer')
+CREATE_TEMP_QA_VIEW = QA_VIEW.format(temp='TEMP ', answer='COALESCE(q.answer, qa_unzip(q.answer_z))')
+CREATE_MODEL_OPTIONS = '''
+    CREATE TABLE IF NOT EXISTS model_options (
+        model_id INTEGER PRIMARY KEY REFERENCES models(id),
+        options TEXT NOT NULL,
+        keep_alive TEXT,
+        updated DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+SELECT_MODEL_OPTIONS = "SELECT m.name, o.options, o.keep_alive FROM model_options o JOIN models m ON m.id = o.model_id"
+UPSERT_MODEL_OPTIONS = '''
+    INSERT INTO model_options (model_id, options, keep_alive) VALUES (?, ?, ?)
+    ON CONFLICT(model_id) DO UPDATE SET options=excluded.options, keep_alive=excluded.keep_alive, updated=CURRENT_TIMESTAMP
+'''
+DELETE_MODEL_OPTIONS = "DELETE FROM model_options WHERE model_id = (SELECT id FROM models WHERE name=?)"
+INSERT_LOOKUP = {table: f"INSERT OR IGNORE INTO {table} (name) VALUES (?)" for table in ('models', 'topics')}
+SELECT_LOOKUP = {table: f"SELECT id FROM {table} WHERE name=?" for table in ('models', 'topics')}
+
+INSERT_QUESTION = "INSERT INTO questions (model_id, topic_id, question, answer, answer_z, options) VALUES (?, ?, ?, ?, ?, ?)"
+UPDATE_QUESTION = "UPDATE questions SET model_id=?, topic_id=?, question=?, answer=?, answer_z=? WHERE id=?"
+DELETE_QUESTION = "DELETE FROM questions WHERE id=?"
+# 导出/导入: 完整记录按 id 顺序流式读取，导入时保留原时间戳
+RECORD_COLUMNS = ('id', 'model', 'topic', 'question', 'answer', 'timestamp')
+SELECT_QUESTION = f"SELECT {', '.join(RECORD_COLUMNS)}, options FROM qa WHERE id=?"
+# 预览列只从数据库取出前 PREVIEW_CHARS+1 个字符，不把整段答案读进内存
+PREVIEW_COLUMNS = "id, model, topic, substr(question, 1, ?), substr(answer, 1, ?), timestamp"
+# 基于 id 的 keyset 分页，避免 OFFSET 扫描
+SELECT_PAGE = f"SELECT {PREVIEW_COLUMNS} FROM qa WHERE id < ? ORDER BY id DESC LIMIT ?"
+SELECT_PAGE_AFTER = f"SELECT {PREVIEW_COLUMNS} FROM qa WHERE id > ? ORDER BY id LIMIT ?"
+SELECT_PREVIEW = f"SELECT {PREVIEW_COLUMNS} FROM qa WHERE id=?"
+SELECT_MODELS = "SELECT name FROM models m WHERE EXISTS (SELECT 1 FROM questions WHERE model_id = m.id) ORDER BY name"
+SELECT_RECORDS = f"SELECT {', '.join(RECORD_COLUMNS)} FROM qa q WHERE 1 {{filters}} ORDER BY id"
+COUNT_RECORDS = "SELECT COUNT(*) FROM qa q WHERE 1 {filters}"
+INSERT_IMPORTED = '''
+    INSERT INTO questions (model_id, topic_id, question, answer, answer_z, timestamp)
+    VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+'''
+SELECT_DUPLICATE = "SELECT 1 FROM qa WHERE timestamp=? AND model=? AND question=? AND answer IS ? LIMIT 1"
+# 维护: 分批压缩已有的长答案 / 全部解压
+SELECT_UNCOMPRESSED = '''
+    SELECT id, answer FROM questions
+    WHERE id > ? AND answer_z IS NULL AND length(CAST(answer AS BLOB)) >= ? ORDER BY id LIMIT ?
+'''
+STORE_COMPRESSED = "UPDATE questions SET answer = NULL, answer_z = ? WHERE id = ?"
+DECOMPRESS_ANSWERS = "UPDATE questions SET answer = qa_unzip(answer_z), answer_z = NULL WHERE answer_z IS NOT NULL"
+SELECT_COMPRESSED = "SELECT COUNT(*) FROM questions WHERE answer_z IS NOT NULL"
+REPACK_CHUNK = 500
+
+# FTS5 全文索引 (external content，不重复存储文本)，由触发器与 questions 保持同步
+# 优先使用 trigram 分词器以支持中文等无空格文本的子串搜索
+CREATE_FTS = '''
+    CREATE VIRTUAL TABLE questions_fts USING fts5(
+        topic, question, answer,
+        content='qa', content_rowid='id', tokenize='{tokenizer}'
+    )
+'''
+FTS_NEW = "new.id, (SELECT name FROM topics WHERE id = new.topic_id), new.question, {answer}"
+FTS_OLD = "'delete', old.id, (SELECT name FROM topics WHERE id = old.topic_id), old.question, {answer}"
+FTS_TRIGGER_NAMES = ('questions_fts_ai', 'questions_fts_ad', 'questions_fts_au')
+
+
+def fts_triggers(temp, condition, new_answer, old_answer):
+    # 插入、删除、修改三个触发器；condition 为 (插入, 删除, 修改) 各自的 WHEN 条件
+    new, old = FTS_NEW.format(answer=new_answer), FTS_OLD.format(answer=old_answer)
+    suffix = '_z' if temp else ''
+    return [
+        f'''
+        CREATE {temp}TRIGGER IF NOT EXISTS questions_fts_ai{suffix} AFTER INSERT ON questions {condition[0]} BEGIN
+            INSERT INTO questions_fts(rowid, topic, question, answer) VALUES ({new});
+        END
+        ''',
+        f'''
+        CREATE {temp}TRIGGER IF NOT EXISTS questions_fts_ad{suffix} AFTER DELETE ON questions {condition[1]} BEGIN
+            INSERT INTO questions_fts(questions_fts, rowid, topic, question, answer) VALUES ({old});
+        END
+        ''',
+        f'''
+        CREATE {temp}TRIGGER IF NOT EXISTS questions_fts_au{suffix} AFTER UPDATE ON questions {condition[2]} BEGIN
+            INSERT INTO questions_fts(questions_fts, rowid, topic, question, answer) VALUES ({old});
+            INSERT INTO questions_fts(rowid, topic, question, answer) VALUES ({new});
+        END
+        ''',
+    ]
+
+
+FTS_TRIGGERS_V2 = fts_triggers('', ('', '', ''), 'qa_unzip(new.answer)', 'qa_unzip(old.answer)')
+# 版本 5: 文件中的触发器只处理未压缩的答案，压缩的答案由本程序连接上的临时触发器解压后写入索引
+FTS_TRIGGERS = fts_triggers('', ("WHEN new.answer_z IS NULL", "WHEN old.answer_z IS NULL",
+                                 "WHEN old.answer_z IS NULL AND new.answer_z IS NULL"),
+                            'new.answer', 'old.answer')
+TEMP_FTS_TRIGGERS = fts_triggers('TEMP ', ("WHEN new.answer_z IS NOT NULL", "WHEN old.answer_z IS NOT NULL",
+                                           "WHEN old.answer_z IS NOT NULL OR new.answer_z IS NOT NULL"),
+                                 'COALESCE(new.answer, qa_unzip(new.answer_z))',
+                                 'COALESCE(old.answer, qa_unzip(old.answer_z))')
+# 版本 3: 语义搜索的 embedding 向量 (归一化后的 float32，小端序)，记录被删除或内容被修改时由触发器清除
+CREATE_EMBEDDINGS = [
+    '''
+    CREATE TABLE IF NOT EXISTS embeddings (
+        question_id INTEGER PRIMARY KEY,
+        model TEXT NOT NULL,
+        vector BLOB NOT NULL
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS embeddings_ad AFTER DELETE ON questions BEGIN
+        DELETE FROM embeddings WHERE question_id = old.id;
+    END
+    ''',
+    # 只压缩/解压答案 (repack_answers) 时内容不变，保留向量
+    '''
+    CREATE TRIGGER IF NOT EXISTS embeddings_au AFTER UPDATE OF topic_id, question, answer ON questions
+    WHEN old.topic_id IS NOT new.topic_id OR old.question IS NOT new.question
+         OR qa_unzip(old.answer) IS NOT qa_unzip(new.answer)
+    BEGIN
+        DELETE FROM embeddings WHERE question_id = old.id;
+    END
+    ''',
+]
+# 版本 5: 答案在 answer 与 answer_z 之间移动 (压缩/解压) 时，只有临时触发器能比较解压后的内容
+CREATE_EMBEDDINGS_AU = '''
+    CREATE TRIGGER IF NOT EXISTS embeddings_au AFTER UPDATE OF topic_id, question, answer, answer_z ON questions
+    WHEN old.topic_id IS NOT new.topic_id OR old.question IS NOT new.question
+         OR (old.answer_z IS NULL AND new.answer_z IS NULL AND old.answer IS NOT new.answer)
+         OR (old.answer_z IS NOT NULL AND new.answer_z IS NOT NULL AND old.answer_z IS NOT new.answer_z)
+    BEGIN
+        DELETE FROM embeddings WHERE question_id = old.id;
+    END
+'''
+CREATE_TEMP_EMBEDDINGS_AU = '''
+    CREATE TEMP TRIGGER IF NOT EXISTS embeddings_au_z AFTER UPDATE OF answer, answer_z ON questions
+    WHEN (old.answer_z IS NULL) != (new.answer_z IS NULL)
+         AND COALESCE(old.answer, qa_unzip(old.answer_z)) IS NOT COALESCE(new.answer, qa_unzip(new.answer_z))
+    BEGIN
+        DELETE FROM embeddings WHERE question_id = old.id;
+    END
+'''
+# 还没有当前模型向量的记录，从新到旧 (keyset 分页)
+SELECT_UNEMBEDDED = '''
+    SELECT q.id, q.topic, q.question, substr(q.answer, 1, ?) FROM qa q
+    WHERE q.id < ? AND NOT EXISTS (SELECT 1 FROM embeddings e WHERE e.question_id = q.id AND e.model = ?)
+    ORDER BY q.id DESC LIMIT ?
+'''
+COUNT_UNEMBEDDED = '''
+    SELECT COUNT(*) FROM questions q
+    WHERE NOT EXISTS (SELECT 1 FROM embeddings e WHERE e.question_id = q.id AND e.model = ?)
+'''
+# 计算期间记录可能已被删除或修改，此时不保存 (修改后的内容会重新计算)
+STORE_EMBEDDING = '''
+    INSERT OR REPLACE INTO embeddings (question_id, model, vector)
+    SELECT ?, ?, ? WHERE EXISTS (
+        SELECT 1 FROM qa WHERE id = ? AND topic = ? AND question = ? AND substr(answer, 1, ?) IS ?
+    )
+'''
+SELECT_EMBEDDINGS = "SELECT question_id, vector FROM embeddings WHERE model=? AND question_id > ? ORDER BY question_id LIMIT ?"
+SELECT_HAS_EMBEDDING = "SELECT 1 FROM embeddings WHERE question_id=? AND model=?"
+SELECT_PREVIEWS = f"SELECT {PREVIEW_COLUMNS} FROM qa q WHERE q.id IN (SELECT value FROM json_each(?)) {{filters}}"
+
+# 重复提问的答案缓存 (key 为模型、参数、消息和图片内容的哈希)
+CREATE_RESPONSE_CACHE = [
+    '''
+    CREATE TABLE IF NOT EXISTS response_cache (
+        key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created REAL NOT NULL,
+        last_used REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS response_cache_last_used ON response_cache (last_used)",
+]
+SELECT_CACHED = "SELECT answer FROM response_cache WHERE key=? AND created >= ?"
+TOUCH_CACHED = "UPDATE response_cache SET last_used=?, hits=hits+1 WHERE key=?"
+UPSERT_CACHED = '''
+    INSERT INTO response_cache (key, model, answer, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET model=excluded.model, answer=excluded.answer, size=excluded.size,
+        created=excluded.created, last_used=excluded.last_used
+'''
+DELETE_EXPIRED_CACHED = "DELETE FROM response_cache WHERE created < ?"
+SELECT_CACHE_TOTALS = "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache"
+SELECT_CACHE_LRU = "SELECT key, size FROM response_cache ORDER BY last_used"
+DELETE_CACHED = "DELETE FROM response_cache WHERE key=?"
+# 多轮对话: 每个对话保存完整消息，以及早期消息的摘要 (summary_upto 之前的消息已被摘要覆盖)
+CREATE_CONVERSATIONS = [
+    '''
+    CREATE TABLE IF NOT EXISTS conversations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        model TEXT NOT NULL,
+        title TEXT NOT NULL,
+        summary TEXT,
+        summary_upto INTEGER NOT NULL DEFAULT 0,
+        created DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        conversation_id INTEGER NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        tokens INTEGER NOT NULL,
+        model TEXT,
+        created DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation_id, id)",
+]
+INSERT_CONVERSATION = "INSERT INTO conversations (model, title) VALUES (?, ?)"
+INSERT_MESSAGE = "INSERT INTO messages (conversation_id, role, content, tokens, model) VALUES (?, ?, ?, ?, ?)"
+TOUCH_CONVERSATION = "UPDATE conversations SET updated=CURRENT_TIMESTAMP WHERE id=?"
+SELECT_CONVERSATION = "SELECT summary, summary_upto FROM conversations WHERE id=?"
+SELECT_MESSAGES = "SELECT id, role, content, tokens FROM messages WHERE conversation_id=? AND id > ? ORDER BY id"
+UPDATE_SUMMARY = "UPDATE conversations SET summary=?, summary_upto=? WHERE id=? AND summary_upto < ?"
+# 批量评测 (batch_eval.py) 的完成记录，用于中断后续跑和统计
+CREATE_BATCH_RESULTS = [
+    '''
+    CREATE TABLE IF NOT EXISTS batch_results (
+        run TEXT NOT NULL,
+        prompt_key TEXT NOT NULL,
+        model TEXT NOT NULL,
+        server TEXT,
+        question_id INTEGER REFERENCES questions(id) ON DELETE SET NULL,
+        latency REAL,
+        ttft REAL,
+        tokens INTEGER,
+        tokens_per_sec REAL,
+        created DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (run, prompt_key, model)
+    )
+    ''',
+]
+INSERT_BATCH_RESULT = '''
+    INSERT OR REPLACE INTO batch_results (run, prompt_key, model, server, question_id, latency, ttft, tokens, tokens_per_sec)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SELECT_BATCH_DONE = "SELECT prompt_key, model FROM batch_results WHERE run=?"
+SELECT_BATCH_RESULTS = "SELECT model, latency, ttft, tokens, tokens_per_sec FROM batch_results WHERE run=? ORDER BY model"
+# 每个请求的耗时记录，时间均为整数微秒 (created 为 Unix 秒)，保持表紧凑
+METRIC_COLUMNS = ('created', 'model', 'server', 'status', 'request_bytes', 'connect_us', 'ttft_us', 'total_us',
+                  'load_us', 'prompt_eval_count', 'prompt_eval_us', 'eval_count', 'eval_us', 'db_write_us')
+METRICS_MAX_ROWS = 100000
+CREATE_REQUEST_METRICS = [
+    '''
+    CREATE TABLE IF NOT EXISTS request_metrics (
+        id INTEGER PRIMARY KEY,
+        created INTEGER NOT NULL,
+        model TEXT NOT NULL,
+        server TEXT,
+        status TEXT NOT NULL,
+        request_bytes INTEGER,
+        connect_us INTEGER,
+        ttft_us INTEGER,
+        total_us INTEGER,
+        load_us INTEGER,
+        prompt_eval_count INTEGER,
+        prompt_eval_us INTEGER,
+        eval_count INTEGER,
+        eval_us INTEGER,
+        db_write_us INTEGER
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS request_metrics_created ON request_metrics(created)",
+]
+INSERT_METRICS = f"INSERT INTO request_metrics ({', '.join(METRIC_COLUMNS)}) VALUES ({', '.join('?' * len(METRIC_COLUMNS))})"
+PRUNE_METRICS = "DELETE FROM request_metrics WHERE id <= ?"
+SELECT_METRICS = f"SELECT {', '.join(METRIC_COLUMNS)} FROM request_metrics WHERE created >= ? ORDER BY id"
+SELECT_FTS_SQL = "SELECT sql FROM sqlite_master WHERE type='table' AND name='questions_fts'"
+# bm25 权重: topic > question > answer
+SEARCH_FTS = f'''
+    SELECT q.id, q.model, q.topic,
+           snippet(questions_fts, 1, '{HIGHLIGHT_OPEN}', '{HIGHLIGHT_CLOSE}', '...', {{tokens}}),
+           COALESCE(snippet(questions_fts, 2, '{HIGHLIGHT_OPEN}', '{HIGHLIGHT_CLOSE}', '...', {{tokens}}),
+                    substr(q.answer, 1, {PREVIEW_CHARS})),
+           q.timestamp
+    FROM questions_fts JOIN qa q ON q.id = questions_fts.rowid
+    WHERE questions_fts MATCH ? {{filters}}
+    ORDER BY bm25(questions_fts, 5.0, 2.0, 1.0)
+    LIMIT ?
+'''
+SEARCH_PLAIN = f"SELECT {PREVIEW_COLUMNS} FROM qa q WHERE 1 {{filters}} ORDER BY id DESC LIMIT ?"
+
+
+def unzip_answer(value):
+    return zlib.decompress(value).decode('utf-8') if isinstance(value, bytes) else value
+
+
+def pack_answer(answer, min_bytes):
+    # -> (answer, answer_z) 两列的值；压缩后确实更小才存入 answer_z
+    if min_bytes is None or answer is None:
+        return answer, None
+    data = answer.encode('utf-8')
+    if len(data) < min_bytes:
+        return answer, None
+    packed = zlib.compress(data, ZLIB_LEVEL)
+    return (None, packed) if len(packed) < len(data) else (answer, None)
+
+
+class Connection(sqlite3.Connection):
+    compress_min = None  # 写入时达到此长度 (字节) 的答案压缩保存
+
+
+def connect(path, compress_min=None):
+    # isolation_level=None: 事务由写线程显式控制
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=256, factory=Connection)
+    conn.compress_min = compress_min
+    conn.execute("PRAGMA journal_mode=WAL")  # 读写互不阻塞
+    conn.execute("PRAGMA synchronous=NORMAL")  # WAL 模式下足够安全，少一次 fsync
+    conn.execute("PRAGMA cache_size=-16000")  # 约 16 MB 页缓存
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA busy_timeout=5000")
+    # 解压答案的函数只注册在本程序的连接上，文件中的结构对象不使用它
+    conn.create_function('qa_unzip', 1, unzip_answer, deterministic=True)
+    if schema_version(conn) >= 5:
+        create_temp_schema(conn)
+    return conn
+
+
+def create_temp_schema(conn):
+    # 只存在于这个连接: 解压答案的 qa 视图 (遮住文件中的同名视图) 和处理压缩答案的触发器
+    conn.execute(CREATE_TEMP_QA_VIEW)
+    conn.execute(CREATE_TEMP_EMBEDDINGS_AU)
+    if fts_tokenizer(conn) is not None:
+        for trigger in TEMP_FTS_TRIGGERS:
+            conn.execute(trigger)
+
+
+def migrate_v1(conn):
+    # 最初的表结构；已有的旧数据库中这些表都已存在
+    conn.execute(CREATE_QUESTIONS_V1)
+    for statement in CREATE_RESPONSE_CACHE + CREATE_CONVERSATIONS + CREATE_BATCH_RESULTS + CREATE_REQUEST_METRICS:
+        conn.execute(statement)
+
+
+def migrate_v2(conn):
+    # 模型/主题改为查找表，加索引，全文索引改为以 qa 视图为内容表
+    for statement in CREATE_LOOKUPS:
+        conn.execute(statement)
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='questions'").fetchone()
+    conn.execute(CREATE_QUESTIONS_V2)
+    for statement in COPY_QUESTIONS_V2:
+        conn.execute(statement)
+    if row is not None:
+        # 保留自增序号，已删除记录的 id 不会被重新使用
+        if not conn.execute("UPDATE sqlite_sequence SET seq=max(seq, ?) WHERE name='questions_v2'", row).rowcount:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('questions_v2', ?)", row)
+    conn.execute("DROP TABLE IF EXISTS questions_fts")
+    conn.execute("DROP TABLE questions")  # 旧的全文索引触发器随之删除
+    conn.execute("ALTER TABLE questions_v2 RENAME TO questions")
+    for statement in CREATE_QUESTION_INDEXES:
+        conn.execute(statement)
+    conn.execute(CREATE_QA_VIEW_V2)
+    initialize_fts(conn, FTS_TRIGGERS_V2)
+
+
+def migrate_v3(conn):
+    # 语义搜索的向量表；已有记录由 semantic_index 在后台补算
+    for statement in CREATE_EMBEDDINGS:
+        conn.execute(statement)
+
+
+def migrate_v4(conn):
+    # 视图多一列 options；全文索引只按列名读取视图，不受影响
+    conn.execute(ADD_QUESTION_OPTIONS)
+    conn.execute("DROP VIEW IF EXISTS qa")
+    conn.execute(CREATE_QA_VIEW_V4)
+    conn.execute(CREATE_MODEL_OPTIONS)
+
+
+def migrate_v5(conn):
+    # 压缩的答案移到 answer_z，视图和触发器改为不依赖 qa_unzip；全文索引的内容不变，无需重建
+    for name in FTS_TRIGGER_NAMES + ('embeddings_au',):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.execute(ADD_ANSWER_Z)
+    conn.execute(MOVE_COMPRESSED)
+    conn.execute("DROP VIEW IF EXISTS qa")
+    conn.execute(CREATE_QA_VIEW)
+    conn.execute(CREATE_EMBEDDINGS_AU)
+    if fts_tokenizer(conn) is not None:
+        for trigger in FTS_TRIGGERS:
+            conn.execute(trigger)
+
+
+MIGRATIONS = [
+    (1, migrate_v1),
+    (2, migrate_v2),
+    (3, migrate_v3),
+    (4, migrate_v4),
+    (5, migrate_v5),
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def initialize(conn):
+    """Bring the database up to SCHEMA_VERSION; each migration runs in its own transaction."""
+    version = schema_version(conn)
+    for number, migrate in MIGRATIONS:
+        if version >= number:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version={number}")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        logging.info(f"Migrated database to schema version {number}")
+        version = number
+    create_temp_schema(conn)
+
+
+def initialize_fts(conn, triggers):
+    if conn.execute(SELECT_FTS_SQL).fetchone() is None:
+        # 建立索引并回填已有记录
+        for tokenizer in ('trigram', 'unicode61'):
+            try:
+                conn.execute(CREATE_FTS.format(tokenizer=tokenizer))
+                break
+            except sqlite3.OperationalError:
+                continue
+        else:
+            logging.warning("SQLite FTS5 is not available; search falls back to LIKE")
+            return
+        conn.execute("INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')")
+        logging.info(f"Built full-text index with {tokenizer} tokenizer")
+    for trigger in triggers:
+        conn.execute(trigger)
+
+
+def fts_tokenizer(conn):
+    # None 表示没有全文索引
+    row = conn.execute(SELECT_FTS_SQL).fetchone()
+    if row is None:
+        return None
+    return 'trigram' if 'trigram' in row[0] else 'unicode61'
+
+
+# ---- 查询函数，均以连接为第一个参数，在读/写线程中执行 ----
+
+def lookup_id(conn, table, name):
+    # 模型/主题名称 -> 查找表 id，不存在时插入
+    conn.execute(INSERT_LOOKUP[table], (name,))
+    return conn.execute(SELECT_LOOKUP[table], (name,)).fetchone()[0]
+
+
+def options_json(options):
+    return json.dumps(options, sort_keys=True) if options else None
+
+
+def insert_question(conn, model, topic, question, answer, options=None):
+    # options: 生成这条答案时发送的 options，便于之后重现
+    model_id, topic_id = lookup_id(conn, 'models', model), lookup_id(conn, 'topics', topic)
+    answer, answer_z = pack_answer(answer, conn.compress_min)
+    return conn.execute(INSERT_QUESTION, (model_id, topic_id, question, answer, answer_z, options_json(options))).lastrowid
+
+
+def insert_answer(conn, model, topic, question, answer, metrics=None, options=None):
+    # 保存问答，同时记录该请求的耗时 (含这次写入本身)
+    start = time.perf_counter()
+    record_id = insert_question(conn, model, topic, question, answer, options)
+    if metrics is not None:
+        insert_request_metrics(conn, dict(metrics, db_write_us=round((time.perf_counter() - start) * 1e6)))
+    return record_id
+
+
+def update_question(conn, record_id, model, topic, question, answer):
+    model_id, topic_id = lookup_id(conn, 'models', model), lookup_id(conn, 'topics', topic)
+    answer, answer_z = pack_answer(answer, conn.compress_min)
+    return conn.execute(UPDATE_QUESTION, (model_id, topic_id, question, answer, answer_z, record_id)).rowcount
+
+
+def delete_question(conn, record_id):
+    return conn.execute(DELETE_QUESTION, (record_id,)).rowcount
+
+
+def preview(text):
+    text = ' '.join((text or '').split())
+    return text if len(text) <= PREVIEW_CHARS else text[:PREVIEW_CHARS - 3] + '...'
+
+
+def preview_row(row):
+    record_id, model, topic, question, answer, timestamp = row
+    return (record_id, model, topic, preview(question), preview(answer), timestamp)
+
+
+def fetch_question(conn, record_id):
+    return conn.execute(SELECT_QUESTION, (record_id,)).fetchone()
+
+
+def fetch_page(conn, before_id=None, limit=100):
+    # before_id 为 None 时从最新一条开始
+    if before_id is None:
+        before_id = 2 ** 63 - 1
+    rows = conn.execute(SELECT_PAGE, (PREVIEW_CHARS + 1, PREVIEW_CHARS + 1, before_id, limit))
+    return [preview_row(row) for row in rows]
+
+
+def fetch_page_after(conn, after_id, limit=100):
+    # 向上滚动时读取比 after_id 新的一页，仍按 id 从新到旧返回
+    rows = conn.execute(SELECT_PAGE_AFTER, (PREVIEW_CHARS + 1, PREVIEW_CHARS + 1, after_id, limit))
+    return [preview_row(row) for row in rows][::-1]
+
+
+def fetch_preview(conn, record_id):
+    row = conn.execute(SELECT_PREVIEW, (PREVIEW_CHARS + 1, PREVIEW_CHARS + 1, record_id)).fetchone()
+    return preview_row(row) if row else None
+
+
+def fetch_models(conn):
+    return [row[0] for row in conn.execute(SELECT_MODELS)]
+
+
+def fts_match_query(terms, tokenizer):
+    # 每个词加引号避免 FTS5 语法字符报错；trigram 不支持少于 3 个字符的词
+    if not terms or tokenizer is None:
+        return None
+    if tokenizer == 'trigram' and any(len(term) < 3 for term in terms):
+        return None
+    quoted = ['"' + term.replace('"', '""') + '"' for term in terms]
+    if tokenizer != 'trigram':
+        quoted[-1] += '*'  # 边输入边搜索: 最后一个词按前缀匹配
+    return ' '.join(quoted)
+
+
+def base_filters(model=None, date_from=None, date_to=None, topic=None):
+    filters, params = [], []
+    if model:
+        filters.append("q.model = ?")
+        params.append(model)
+    if topic:
+        filters.append("q.topic = ?")
+        params.append(topic)
+    if date_from:
+        filters.append("q.timestamp >= ?")
+        params.append(date_from)
+    if date_to:
+        filters.append("q.timestamp < date(?, '+1 day')")
+        params.append(date_to)
+    return filters, params
+
+
+def search(conn, text, model=None, date_from=None, date_to=None, limit=SEARCH_LIMIT):
+    """Search topics, questions and answers.
+
+    Uses the FTS5 index ranked by bm25 with highlighted snippets when it
+    can, otherwise a LIKE scan. Dates are 'YYYY-MM-DD' strings, inclusive.
+    """
+    filters, params = base_filters(model, date_from, date_to)
+    terms = text.split()
+    tokenizer = fts_tokenizer(conn)
+    match = fts_match_query(terms, tokenizer)
+    if match:
+        sql = SEARCH_FTS.format(filters=''.join(f" AND {f}" for f in filters), tokens=SNIPPET_TOKENS[tokenizer])
+        rows = conn.execute(sql, [match] + params + [limit])
+        return [(record_id, model, topic, ' '.join((q or '').split()), ' '.join((a or '').split()), timestamp)
+                for record_id, model, topic, q, a, timestamp in rows]
+
+    for term in terms:
+        filters.append("(q.topic LIKE ? OR q.question LIKE ? OR q.answer LIKE ?)")
+        params.extend(['%' + term + '%'] * 3)
+    sql = SEARCH_PLAIN.format(filters=''.join(f" AND {f}" for f in filters))
+    rows = conn.execute(sql, [PREVIEW_CHARS + 1, PREVIEW_CHARS + 1] + params + [limit])
+    return [preview_row(row) for row in rows]
+
+
+def select_records(conn, text='', model=None, topic=None, date_from=None, date_to=None):
+    """Return (count, cursor) over full records matching the filters, oldest first.
+
+    The cursor is meant to be read with fetchmany() so large archives are
+    streamed instead of loaded at once. Keywords use the full-text index
+    when possible, like search().
+    """
+    filters, params = base_filters(model, date_from, date_to, topic)
+    terms = (text or '').split()
+    match = fts_match_query(terms, fts_tokenizer(conn))
+    if match:
+        filters.append("q.id IN (SELECT rowid FROM questions_fts WHERE questions_fts MATCH ?)")
+        params.append(match)
+    else:
+        for term in terms:
+            filters.append("(q.topic LIKE ? OR q.question LIKE ? OR q.answer LIKE ?)")
+            params.extend(['%' + term + '%'] * 3)
+    where = ''.join(f" AND {f}" for f in filters)
+    count = conn.execute(COUNT_RECORDS.format(filters=where), params).fetchone()[0]
+    return count, conn.execute(SELECT_RECORDS.format(filters=where), params)
+
+
+def import_records(conn, records, skip_duplicates=True):
+    # records: (model, topic, question, answer, timestamp)；调用方负责事务
+    inserted = 0
+    for model, topic, question, answer, timestamp in records:
+        if skip_duplicates and timestamp and conn.execute(SELECT_DUPLICATE, (timestamp, model, question, answer)).fetchone():
+            continue
+        model_id, topic_id = lookup_id(conn, 'models', model), lookup_id(conn, 'topics', topic)
+        conn.execute(INSERT_IMPORTED, (model_id, topic_id, question, *pack_answer(answer, conn.compress_min), timestamp))
+        inserted += 1
+    return inserted
+
+
+def fetch_previews(conn, record_ids, model=None, date_from=None, date_to=None):
+    # 按 record_ids 的顺序 (如语义搜索的相似度) 返回预览，不符合筛选条件的记录被略去
+    filters, params = base_filters(model, date_from, date_to)
+    sql = SELECT_PREVIEWS.format(filters=''.join(f" AND {f}" for f in filters))
+    rows = conn.execute(sql, [PREVIEW_CHARS + 1, PREVIEW_CHARS + 1, json.dumps(record_ids)] + params)
+    found = {row[0]: preview_row(row) for row in rows}
+    return [found[record_id] for record_id in record_ids if record_id in found]
+
+
+def fetch_unembedded(conn, model, before_id=None, limit=32, chars=2000):
+    # (id, topic, question, answer 前 chars 个字符)
+    if before_id is None:
+        before_id = 2 ** 63 - 1
+    return conn.execute(SELECT_UNEMBEDDED, (chars, before_id, model, limit)).fetchall()
+
+
+def count_unembedded(conn, model):
+    return conn.execute(COUNT_UNEMBEDDED, (model,)).fetchone()[0]
+
+
+def store_embeddings(conn, model, rows, vectors, chars=2000):
+    # rows 为 fetch_unembedded 的结果，vectors 为对应的 float32 bytes；返回实际保存的 id
+    stored = []
+    for (record_id, topic, question, answer), vector in zip(rows, vectors):
+        if conn.execute(STORE_EMBEDDING, (record_id, model, vector, record_id, topic, question, chars, answer)).rowcount:
+            stored.append(record_id)
+    return stored
+
+
+def fetch_embeddings(conn, model, after_id=0, limit=2000):
+    return conn.execute(SELECT_EMBEDDINGS, (model, after_id, limit)).fetchall()
+
+
+def has_embedding(conn, record_id, model):
+    return conn.execute(SELECT_HAS_EMBEDDING, (record_id, model)).fetchone() is not None
+
+
+def cache_get(conn, key, ttl_seconds, now):
+    row = conn.execute(SELECT_CACHED, (key, now - ttl_seconds)).fetchone()
+    return row[0] if row else None
+
+
+def cache_touch(conn, key, now):
+    conn.execute(TOUCH_CACHED, (now, key))
+
+
+def cache_put(conn, key, model, answer, now, ttl_seconds, max_entries, max_bytes):
+    size = len(answer.encode('utf-8'))
+    conn.execute(UPSERT_CACHED, (key, model, answer, size, now, now))
+    conn.execute(DELETE_EXPIRED_CACHED, (now - ttl_seconds,))
+    # 超出条目数或总大小时按最近最少使用 (LRU) 淘汰
+    count, total = conn.execute(SELECT_CACHE_TOTALS).fetchone()
+    if count <= max_entries and total <= max_bytes:
+        return
+    evict = []
+    for old_key, old_size in conn.execute(SELECT_CACHE_LRU):
+        if count <= max_entries and total <= max_bytes:
+            break
+        evict.append((old_key,))
+        count -= 1
+        total -= old_size
+    conn.executemany(DELETE_CACHED, evict)
+
+
+def create_conversation(conn, model, title):
+    return conn.execute(INSERT_CONVERSATION, (model, title)).lastrowid
+
+
+def add_turn(conn, conversation_id, model, question, question_tokens, answer, answer_tokens):
+    conn.execute(INSERT_MESSAGE, (conversation_id, 'user', question, question_tokens, model))
+    conn.execute(INSERT_MESSAGE, (conversation_id, 'assistant', answer, answer_tokens, model))
+    conn.execute(TOUCH_CONVERSATION, (conversation_id,))
+
+
+def fetch_conversation(conn, conversation_id):
+    # 返回 (summary, summary_upto, 摘要之后的消息列表)
+    row = conn.execute(SELECT_CONVERSATION, (conversation_id,)).fetchone()
+    if row is None:
+        return None, 0, []
+    summary, summary_upto = row
+    return summary, summary_upto, conn.execute(SELECT_MESSAGES, (conversation_id, summary_upto)).fetchall()
+
+
+def set_conversation_summary(conn, conversation_id, summary, summary_upto):
+    # 只接受比现有摘要更新的结果
+    return conn.execute(UPDATE_SUMMARY, (summary, summary_upto, conversation_id, summary_upto)).rowcount
+
+
+def insert_batch_result(conn, run, prompt_key, model, server, topic, question, answer, latency, ttft, tokens, tokens_per_sec,
+                        metrics=None, options=None):
+    # 问答与评测记录在同一个事务中写入，中断后不会出现只有一半的结果
+    question_id = insert_answer(conn, model, topic, question, answer, metrics, options)
+    conn.execute(INSERT_BATCH_RESULT, (run, prompt_key, model, server, question_id, latency, ttft, tokens, tokens_per_sec))
+    return question_id
+
+
+def fetch_model_options(conn):
+    # {model: (options dict, keep_alive)}
+    return {model: (json.loads(options), keep_alive) for model, options, keep_alive in conn.execute(SELECT_MODEL_OPTIONS)}
+
+
+def save_model_options(conn, model, options, keep_alive):
+    conn.execute(UPSERT_MODEL_OPTIONS, (lookup_id(conn, 'models', model), json.dumps(options, sort_keys=True), keep_alive))
+
+
+def delete_model_options(conn, model):
+    return conn.execute(DELETE_MODEL_OPTIONS, (model,)).rowcount
+
+
+def fetch_batch_done(conn, run):
+    return set(conn.execute(SELECT_BATCH_DONE, (run,)).fetchall())
+
+
+def fetch_batch_results(conn, run):
+    return conn.execute(SELECT_BATCH_RESULTS, (run,)).fetchall()
+
+
+def insert_request_metrics(conn, metrics, max_rows=METRICS_MAX_ROWS):
+    row_id = conn.execute(INSERT_METRICS, tuple(metrics.get(column) for column in METRIC_COLUMNS)).lastrowid
+    # 只保留最近 max_rows 条，按主键范围删除很便宜
+    if row_id > max_rows:
+        conn.execute(PRUNE_METRICS, (row_id - max_rows,))
+    return row_id
+
+
+def fetch_metrics(conn, since=0):
+    return conn.execute(SELECT_METRICS, (since,)).fetchall()
+
+
+def database_size(path):
+    # 数据库文件加上 WAL 文件的字节数
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+
+def repack_answers(conn, compress_min):
+    """Compress long answers (compress_min bytes or more), or decompress all when compress_min is None."""
+    if compress_min is None:
+        return conn.execute(DECOMPRESS_ANSWERS).rowcount
+    changed, last_id = 0, 0
+    while True:
+        rows = conn.execute(SELECT_UNCOMPRESSED, (last_id, compress_min, REPACK_CHUNK)).fetchall()
+        if not rows:
+            return changed
+        packed = []
+        for record_id, answer in rows:
+            _, answer_z = pack_answer(answer, compress_min)
+            if answer_z is not None:  # 压缩后没有变小的保持原样
+                packed.append((answer_z, record_id))
+        conn.executemany(STORE_COMPRESSED, packed)
+        changed += len(packed)
+        last_id = rows[-1][0]
+
+
+def maintain(conn, path):
+    """Optimise the full-text index, ANALYZE and VACUUM; returns (size_before, size_after) in bytes.
+
+    VACUUM needs exclusive access for a moment, so this is best run while
+    the GUI and batch runs are closed.
+    """
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    before = database_size(path)
+    if fts_tokenizer(conn) is not None:
+        conn.execute("INSERT INTO questions_fts(questions_fts) VALUES ('optimize')")
+    conn.execute("ANALYZE")
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return before, database_size(path)
+
+
+class QADatabase:
+    """Long-lived access layer for ollama_QA.db.
+
+    Writes are serialised through one writer thread that commits whatever
+    is queued as a single transaction; reads run on a separate reader
+    connection. Results are handed back through ``dispatch`` (the GUI
+    passes ``root.after``) so callbacks always run on the caller's thread.
+    The file is opened and migrated on the writer thread, so the
+    constructor returns at once; work submitted meanwhile waits its turn.
+    """
+
+    def __init__(self, path, dispatch=None, compress_min=None):
+        self.path = path
+        self.compress_min = compress_min
+        self.dispatch = dispatch or (lambda fn, *args: fn(*args))
+        self.ready = threading.Event()  # 打开 (含结构迁移) 完成后设置，失败时 open_error 为异常
+        self.open_error = None
+        self._write_conn = self._read_conn = None
+        self._writes = queue.Queue()
+        self._reads = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name="qa-db-writer", daemon=True)
+        self._reader = threading.Thread(target=self._reader_loop, name="qa-db-reader", daemon=True)
+        self._writer.start()
+        self._reader.start()
+
+    @classmethod
+    def from_config(cls, config, path=DEFAULT_DATABASE, dispatch=None):
+        if not config.has_section('Database'):
+            return cls(path, dispatch)
+        section = config['Database']
+        compress_min = None
+        if section.getboolean('CompressAnswers', False):
+            compress_min = int(section.get('CompressMinBytes', DEFAULT_COMPRESS_MIN_BYTES))
+        return cls(path, dispatch, compress_min)
+
+    def connect(self):
+        # 额外的连接 (如后台导出/导入) 使用同样的设置
+        return connect(self.path, self.compress_min)
+
+    def submit_write(self, fn, *args, callback=None, on_error=None):
+        self._writes.put((fn, args, callback, on_error))
+
+    def submit_read(self, fn, *args, callback=None, on_error=None):
+        self._reads.put((fn, args, callback, on_error))
+
+    def read(self, fn, *args):
+        """Run fn on the reader thread and wait for the result (not for the Tk thread)."""
+        return self._wait(self.submit_read, fn, args)
+
+    def write(self, fn, *args):
+        """Run fn on the writer thread and wait until its batch is committed (not for the Tk thread)."""
+        return self._wait(self.submit_write, fn, args)
+
+    def flush(self):
+        # 等待此前提交的所有写操作提交完成
+        self.write(lambda conn: None)
+
+    def _wait(self, submit, fn, args):
+        done = threading.Event()
+        outcome = {}
+
+        def on_result(result):
+            outcome['result'] = result
+            done.set()
+
+        def on_error(e):
+            outcome['error'] = e
+            done.set()
+
+        submit(fn, *args, callback=on_result, on_error=on_error)
+        done.wait()
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome['result']
+
+    def close(self):
+        # 先处理完队列中剩余的写操作再关闭
+        self._writes.put(None)
+        self._reads.put(None)
+        self._writer.join()
+        self._reader.join()
+        for conn in (self._write_conn, self._read_conn):
+            if conn is not None:
+                conn.close()
+
+    def _open(self):
+        # 在写线程中打开数据库并执行迁移，构造函数不必等待 (如第一次建立全文索引)；
+        # 此前提交的读写在队列中等待，读线程等迁移完成后再开始
+        try:
+            self._write_conn = self.connect()
+            initialize(self._write_conn)
+            self._read_conn = self.connect()
+        except Exception as e:
+            logging.error(f"Failed to open {self.path}: {e}")
+            self.open_error = e
+        self.ready.set()
+
+    def _deliver(self, callback, on_error, result, error):
+        if error is not None:
+            if on_error:
+                self.dispatch(on_error, error)
+            else:
+                logging.error(f"Database Error: {error}")
+        elif callback:
+            self.dispatch(callback, result)
+
+    def _writer_loop(self):
+        self._open()
+        running = True
+        while running:
+            job = self._writes.get()
+            if job is None:
+                break
+            batch = [job]
+            # 把已经排队的写操作合并到同一个事务
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    job = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    running = False
+                    break
+                batch.append(job)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        conn = self._write_conn
+        outcomes = []
+        if self.open_error is not None:
+            for _, _, callback, on_error in batch:
+                self._deliver(callback, on_error, None, self.open_error)
+            return
+        try:
+            conn.execute("BEGIN")
+            for fn, args, _, _ in batch:
+                # 每个写操作一个 savepoint，单条失败不影响同批其它写入
+                conn.execute("SAVEPOINT job")
+                try:
+                    outcomes.append((fn(conn, *args), None))
+                    conn.execute("RELEASE job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    outcomes.append((None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            outcomes = [(None, e)] * len(batch)
+        for (_, _, callback, on_error), (result, error) in zip(batch, outcomes):
+            self._deliver(callback, on_error, result, error)
+
+    def _reader_loop(self):
+        self.ready.wait()
+        while True:
+            job = self._reads.get()
+            if job is None:
+                break
+            fn, args, callback, on_error = job
+            try:
+                if self.open_error is not None:
+                    raise self.open_error
+                result, error = fn(self._read_conn, *args), None
+            except Exception as e:
+                result, error = None, e
+            self._deliver(callback, on_error, result, error)
@@ -0,0 +1,244 @@
+import csv
+import gzip
+import importlib.util
+import io
+import json
+import os
+
+import qa_db
+
+# Parquet 是可选格式，需要 pip install pyarrow；pyarrow 较大，第一次用到时才导入 (见 load_pyarrow)
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+pyarrow = parquet = None
+
+# 每次从游标取出 / 每个事务写入的记录数
+EXPORT_CHUNK = 500
+IMPORT_BATCH = 500
+
+# 导出格式 -> 扩展名 (Text 为原来的纯文本格式，只能导出)
+FORMATS = {'JSONL': '.jsonl', 'CSV': '.csv', 'Markdown': '.md', 'Text': '.txt'}
+if HAS_PYARROW:
+    FORMATS['Parquet'] = '.parquet'
+IMPORT_EXTENSIONS = ('.jsonl', '.csv', '.md', '.parquet')
+
+MD_RECORD = '<!-- record '
+MD_QUESTION = '<!-- question -->\n'
+MD_ANSWER = '\n\n<!-- answer -->\n'
+
+
+def load_pyarrow():
+    global pyarrow, parquet
+    if parquet is None:
+        import pyarrow
+        import pyarrow.parquet as parquet
+
+
+class Cancelled(Exception):
+    def __init__(self, count):
+        super().__init__(f"Cancelled after {count} records")
+        self.count = count
+
+
+def base_extension(path):
+    path = path.lower()
+    if path.endswith('.gz'):
+        path = path[:-3]
+    return os.path.splitext(path)[1]
+
+
+class JsonlWriter:
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, rows):
+        self.f.writelines(json.dumps(dict(zip(qa_db.RECORD_COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows)
+
+
+class CsvWriter:
+    def __init__(self, f):
+        self.writer = csv.writer(f)
+        self.writer.writerow(qa_db.RECORD_COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+
+class MarkdownWriter:
+    # 每条记录前的 HTML 注释在渲染时不可见，导入时用来还原字段
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, rows):
+        for record_id, model, topic, question, answer, timestamp in rows:
+            meta = json.dumps({'id': record_id, 'model': model, 'topic': topic, 'timestamp': timestamp},
+                              ensure_ascii=False).replace('>', '\\u003e')
+            self.f.write(f"{MD_RECORD}{meta} -->\n## {topic or 'Untitled'}\n\n*{model} · {timestamp}*\n\n"
+                         f"{MD_QUESTION}{question}{MD_ANSWER}{answer or ''}\n\n")
+
+
+class TextWriter:
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, rows):
+        for record_id, model, topic, question, answer, timestamp in rows:
+            self.f.write(f"ID: {record_id}\nModel: {model}\nTopic: {topic}\nQuestion: {question}\n"
+                         f"Answer: {answer}\nTimestamp: {timestamp}\n" + "-" * 50 + "\n")
+
+
+class ParquetWriter:
+    def __init__(self, path, compress):
+        load_pyarrow()
+        schema = pyarrow.schema([('id', pyarrow.int64())] + [(name, pyarrow.string()) for name in qa_db.RECORD_COLUMNS[1:]])
+        # 每次 write 成为一个 row group，内存中只保留一个分块
+        self.writer = parquet.ParquetWriter(path, schema, compression='gzip' if compress else 'snappy')
+        self.schema = schema
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self.writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(c) for c in columns], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+TEXT_WRITERS = {'JSONL': JsonlWriter, 'CSV': CsvWriter, 'Markdown': MarkdownWriter, 'Text': TextWriter}
+
+
+def open_text(path, mode, compress):
+    if compress:
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def export_records(conn, path, fmt, filters=None, compress=False, progress=None, cancel=None, chunk=EXPORT_CHUNK):
+    """Stream the matching records into path; returns the number written.
+
+    Rows are read with fetchmany(chunk), so memory use does not grow with
+    the archive. progress(fraction, count) is called after each chunk;
+    setting the cancel Event stops the export and removes the partial file.
+    """
+    # 先确定格式，未知格式不会留下空文件
+    writer_class = TEXT_WRITERS.get(fmt)
+    if writer_class is None and fmt != 'Parquet':
+        raise ValueError(f"Unsupported export format: {fmt}")
+    total, cursor = qa_db.select_records(conn, **(filters or {}))
+    if writer_class is None:
+        writer = ParquetWriter(path, compress)
+        f = writer
+    else:
+        f = open_text(path, 'w', compress)
+        writer = writer_class(f)
+    count = 0
+    try:
+        while True:
+            if cancel is not None and cancel.is_set():
+                raise Cancelled(count)
+            rows = cursor.fetchmany(chunk)
+            if not rows:
+                break
+            writer.write(rows)
+            count += len(rows)
+            if progress:
+                # total 与读取的行不是同一快照，期间可能有记录增删
+                progress(min(1.0, count / total) if total else 1.0, count)
+    except BaseException:
+        f.close()
+        os.remove(path)
+        raise
+    finally:
+        cursor.close()
+    f.close()
+    return count
+
+
+def read_markdown(f):
+    record, lines = None, []
+
+    def parse():
+        block = ''.join(lines)
+        start = block.index(MD_QUESTION) + len(MD_QUESTION)
+        middle = block.index(MD_ANSWER, start)
+        answer = block[middle + len(MD_ANSWER):]
+        return dict(record, question=block[start:middle], answer=answer[:-2] if answer.endswith('\n\n') else answer)
+
+    for line in f:
+        if line.startswith(MD_RECORD) and line.rstrip().endswith('-->'):
+            if record is not None:
+                yield parse()
+            record, lines = json.loads(line[len(MD_RECORD):line.rindex('-->')]), []
+        elif record is not None:
+            lines.append(line)
+    if record is not None:
+        yield parse()
+
+
+def read_records(path, raw):
+    # raw 是原始二进制文件；gzip 按文件名识别
+    extension = base_extension(path)
+    if extension == '.parquet':
+        load_pyarrow()
+        for batch in parquet.ParquetFile(raw).iter_batches(batch_size=IMPORT_BATCH):
+            yield from batch.to_pylist()
+        return
+    stream = gzip.GzipFile(fileobj=raw) if path.lower().endswith('.gz') else raw
+    f = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if extension == '.jsonl':
+        yield from (json.loads(line) for line in f if line.strip())
+    elif extension == '.csv':
+        yield from csv.DictReader(f)
+    elif extension == '.md':
+        yield from read_markdown(f)
+    else:
+        raise ValueError(f"Unsupported import format: {extension or path}")
+
+
+def record_values(record):
+    question = record.get('question') or ''
+    if not question.strip():
+        return None
+    return (record.get('model') or '', record.get('topic') or '', question,
+            record.get('answer'), record.get('timestamp') or None)
+
+
+def import_records(conn, path, progress=None, cancel=None, batch=IMPORT_BATCH, skip_duplicates=True):
+    """Read a file written by export_records back into questions; returns the number inserted.
+
+    Each batch of records is committed in its own transaction; progress is
+    reported by position in the (possibly compressed) file.
+    """
+    if base_extension(path) == '.parquet' and not HAS_PYARROW:
+        raise ValueError("Importing Parquet needs pyarrow (pip install pyarrow)")
+    size = os.path.getsize(path) or 1
+    inserted = 0
+    with open(path, 'rb') as raw:
+        records = (record_values(record) for record in read_records(path, raw))
+        pending = []
+        for values in records:
+            if values is not None:
+                pending.append(values)
+            if len(pending) < batch:
+                continue
+            if cancel is not None and cancel.is_set():
+                raise Cancelled(inserted)
+            inserted += _import_batch(conn, pending, skip_duplicates)
+            pending = []
+            if progress:
+                progress(min(raw.tell() / size, 1.0), inserted)
+        inserted += _import_batch(conn, pending, skip_duplicates)
+    if progress:
+        progress(1.0, inserted)
+    return inserted
+
+
+def _import_batch(conn, records, skip_duplicates):
+    if not records:
+        return 0
+    conn.execute("BEGIN")
+    try:
+        inserted = qa_db.import_records(conn, records, skip_duplicates)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return inserted
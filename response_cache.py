@@ -0,0 +1,79 @@
+import base64
+import hashlib
+import json
+import time
+
+import qa_db
+
+# 默认缓存参数，可在 config.ini 的 [Cache] 段覆盖
+DEFAULT_TTL_HOURS = 168
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_MB = 50
+
+
+def cache_key(payload):
+    # 模型、生成参数、消息内容和图片内容 (哈希) 都相同才算同一个问题
+    messages = []
+    for message in payload.get('messages', []):
+        entry = {'role': message.get('role'), 'content': message.get('content')}
+        if message.get('images'):
+            entry['images'] = [hashlib.sha256(base64.b64decode(image)).hexdigest() for image in message['images']]
+        messages.append(entry)
+    key_data = {
+        'model': payload.get('model'),
+        'options': payload.get('options') or {},
+        'format': payload.get('format'),
+        'messages': messages,
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Opt-in answer cache stored in the response_cache table of ollama_QA.db."""
+
+    def __init__(self, db, enabled=False, ttl_hours=DEFAULT_TTL_HOURS, max_entries=DEFAULT_MAX_ENTRIES, max_mb=DEFAULT_MAX_MB):
+        self.db = db
+        self.enabled = enabled
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config, db):
+        if not config.has_section('Cache'):
+            return cls(db)
+        section = config['Cache']
+        return cls(
+            db,
+            enabled=section.getboolean('Enabled', False),
+            ttl_hours=float(section.get('TTLHours', DEFAULT_TTL_HOURS)),
+            max_entries=int(section.get('MaxEntries', DEFAULT_MAX_ENTRIES)),
+            max_mb=float(section.get('MaxMB', DEFAULT_MAX_MB)),
+        )
+
+    def lookup(self, payload, callback, on_error=None):
+        """Look the payload up on the reader thread; callback(answer or None) runs via dispatch."""
+        key = cache_key(payload)
+
+        def on_result(answer):
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.db.submit_write(qa_db.cache_touch, key, time.time())
+            callback(answer)
+
+        self.db.submit_read(qa_db.cache_get, key, self.ttl_seconds, time.time(), callback=on_result, on_error=on_error)
+
+    def store(self, payload, model, answer):
+        if not answer:
+            return
+        self.db.submit_write(qa_db.cache_put, cache_key(payload), model, answer, time.time(),
+                             self.ttl_seconds, self.max_entries, self.max_bytes)
+
+    def stats_text(self):
+        total = self.hits + self.misses
+        rate = f" ({self.hits / total:.0%})" if total else ""
+        return f"Cache: {self.hits} hits / {self.misses} misses{rate}"
@@ -0,0 +1,374 @@
+import logging
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import qa_db
+
+# 语义搜索需要 pip install numpy，没有时该功能不启用；只在启用时才导入 (见 load_numpy)
+numpy = None
+
+# 默认参数，可在 config.ini 的 [Semantic] 段覆盖
+DEFAULT_MODEL = 'nomic-embed-text'
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_MIN_SCORE = 0.5
+DEFAULT_IVF_THRESHOLD = 20000  # 向量数达到后建立 IVF 索引，查询只扫描最接近的几个聚类
+EMBED_CHARS = 2000  # 每条记录送去计算向量的文字上限
+LOAD_CHUNK = 2000  # 启动时每次从数据库读入的向量数
+RETRY_SECONDS = 60  # 服务器不可用或模型未下载时，隔一段时间再补算
+# IVF: 聚类数约为 sqrt(向量数)，每次查询扫描 IVF_PROBES 个聚类
+IVF_MIN_LISTS = 16
+IVF_MAX_LISTS = 1024
+IVF_PROBES = 12
+IVF_ITERATIONS = 10
+IVF_SAMPLE_PER_LIST = 64
+IVF_ASSIGN_CHUNK = 8192
+
+
+def load_numpy():
+    """Import numpy on first use; False when it is not installed."""
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+    return True
+
+
+def normalize(vectors):
+    # 行向量归一化后余弦相似度就是点积
+    vectors = numpy.asarray(vectors, dtype=numpy.float32)
+    norms = numpy.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def pack_vector(vector):
+    return numpy.asarray(vector, dtype='<f4').tobytes()
+
+
+def unpack_vector(blob):
+    return numpy.frombuffer(blob, dtype='<f4')
+
+
+def embed(pool, model, texts):
+    """Normalised embeddings (one row per text) from the least busy host that has model."""
+    host = pool.pick(model)
+    if host is None:
+        raise RuntimeError("No Ollama server available")
+    try:
+        response = host.client.post("/api/embed", json={'model': model, 'input': texts, 'truncate': True})
+        response.raise_for_status()
+        vectors = response.json()['embeddings']
+    finally:
+        pool.release(host)
+    return normalize(vectors)
+
+
+def embed_text(topic, question, answer):
+    return f"{topic}\n{question}\n{answer or ''}"[:EMBED_CHARS]
+
+
+def kmeans(sample, lists, iterations=IVF_ITERATIONS, seed=0):
+    """Spherical k-means over normalised rows; returns normalised centroids."""
+    rng = numpy.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = numpy.argmax(sample @ centroids.T, axis=1)
+        sums = numpy.zeros_like(centroids)
+        numpy.add.at(sums, assign, sample)
+        empty = ~sums.any(axis=1)
+        sums[empty] = centroids[empty]  # 空聚类保留原中心
+        centroids = normalize(sums)
+    return centroids
+
+
+class VectorStore:
+    """Normalised vectors in one growable float32 matrix.
+
+    Rows are updated in place (id -> row), freed rows are reused, and a
+    query is a single matrix-vector product. Past ivf_threshold vectors an
+    IVF index (k-means centroids plus a list number per row) limits the
+    scan to the rows of the closest clusters.
+    """
+
+    def __init__(self, ivf_threshold=DEFAULT_IVF_THRESHOLD):
+        self.ivf_threshold = ivf_threshold
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._ids = numpy.empty(0, dtype=numpy.int64)  # -1 表示空行
+        self._assign = numpy.empty(0, dtype=numpy.int32)  # 所属聚类，-1 表示尚未分配
+        self._rows = {}
+        self._free = []
+        self._size = 0
+        self._centroids = None
+        self._ivf_built_for = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _grow(self, dim, needed):
+        capacity = 0 if self._matrix is None else len(self._matrix)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        matrix = numpy.zeros((capacity, dim), dtype=numpy.float32)
+        ids = numpy.full(capacity, -1, dtype=numpy.int64)
+        assign = numpy.full(capacity, -1, dtype=numpy.int32)
+        if self._matrix is not None:
+            matrix[:self._size] = self._matrix[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+            assign[:self._size] = self._assign[:self._size]
+        self._matrix, self._ids, self._assign = matrix, ids, assign
+
+    def add(self, ids, vectors):
+        # vectors 应已归一化
+        if not len(ids):
+            return
+        with self._lock:
+            if self._matrix is not None and vectors.shape[1] != self._matrix.shape[1]:
+                raise ValueError(f"Embedding size changed from {self._matrix.shape[1]} to {vectors.shape[1]}")
+            self._grow(vectors.shape[1], self._size + len(ids))
+            for record_id, vector in zip(ids, vectors):
+                row = self._rows.get(record_id)
+                if row is None:
+                    if self._free:
+                        row = self._free.pop()
+                    else:
+                        row = self._size
+                        self._size += 1
+                    self._rows[record_id] = row
+                self._matrix[row] = vector
+                self._ids[row] = record_id
+                self._assign[row] = -1 if self._centroids is None else int(numpy.argmax(self._centroids @ vector))
+
+    def remove(self, record_id):
+        with self._lock:
+            row = self._rows.pop(record_id, None)
+            if row is not None:
+                self._matrix[row] = 0
+                self._ids[row] = -1
+                self._free.append(row)
+
+    def search(self, query, k, min_score=None, exclude=()):
+        """Top k (id, cosine similarity) pairs for a normalised query vector."""
+        with self._lock:
+            if not self._rows:
+                return []
+            size = self._size
+            if self._centroids is None:
+                ids = self._ids[:size]
+                scores = self._matrix[:size] @ query
+            else:
+                probes = numpy.argsort(self._centroids @ query)[-IVF_PROBES:]
+                assign = self._assign[:size]
+                rows = numpy.flatnonzero(numpy.isin(assign, probes) | (assign < 0))
+                ids = self._ids[rows]
+                scores = self._matrix[rows] @ query
+        keep = ids >= 0
+        if min_score is not None:
+            keep &= scores >= min_score
+        ids, scores = ids[keep], scores[keep]
+        wanted = min(k + len(exclude), len(ids))
+        if not wanted:
+            return []
+        top = numpy.argpartition(-scores, wanted - 1)[:wanted]
+        top = top[numpy.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if int(ids[i]) not in exclude][:k]
+
+    def needs_ivf(self):
+        # 首次达到阈值时建立，之后向量数每翻一倍重建一次
+        size = len(self._rows)
+        return size >= self.ivf_threshold and size >= 2 * self._ivf_built_for
+
+    def build_ivf(self):
+        with self._lock:
+            size = self._size
+            live = numpy.flatnonzero(self._ids[:size] >= 0)
+            lists = min(IVF_MAX_LISTS, max(IVF_MIN_LISTS, int(math.sqrt(len(live)))))
+            rng = numpy.random.default_rng(0)
+            sample_rows = rng.choice(live, min(len(live), lists * IVF_SAMPLE_PER_LIST), replace=False)
+            sample = self._matrix[sample_rows].copy()
+        if len(sample) < lists:
+            return
+        centroids = kmeans(sample, lists)
+        with self._lock:
+            self._centroids = centroids
+            self._assign[:self._size] = -1
+            self._ivf_built_for = len(self._rows)
+        # 分块分配已有的行，期间的查询仍会扫描尚未分配的行
+        for start in range(0, size, IVF_ASSIGN_CHUNK):
+            with self._lock:
+                end = min(start + IVF_ASSIGN_CHUNK, self._size)
+                block = self._matrix[start:end]
+                self._assign[start:end] = numpy.argmax(block @ centroids.T, axis=1)
+        logging.info(f"Built IVF index with {lists} lists over {len(live)} vectors")
+
+
+class SemanticIndex:
+    """Semantic search over the Q&A archive with Ollama embeddings.
+
+    A background thread embeds records that have no vector for the
+    configured model yet (newest first) through /api/embed, stores them
+    in the embeddings table and keeps them in a VectorStore for queries.
+    Triggers in qa_db drop a record's vector when it is edited or deleted;
+    wake() makes the thread embed new and changed records.
+    """
+
+    def __init__(self, db, pool, model=DEFAULT_MODEL, enabled=False, batch_size=DEFAULT_BATCH_SIZE,
+                 min_score=DEFAULT_MIN_SCORE, ivf_threshold=DEFAULT_IVF_THRESHOLD, listener=None):
+        self.db = db
+        self.pool = pool
+        self.model = model
+        self.enabled = enabled
+        self.available = enabled and load_numpy()
+        self.batch_size = batch_size
+        self.min_score = min_score
+        self.listener = listener
+        self.store = VectorStore(ivf_threshold) if self.available else None
+        self.pending = None  # 尚未计算向量的记录数
+        self.loaded = False
+        self.last_error = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._queries = ThreadPoolExecutor(max_workers=2, thread_name_prefix='semantic-query')
+        if enabled and not self.available:
+            logging.warning("Semantic search needs numpy (pip install numpy); it is disabled")
+
+    @classmethod
+    def from_config(cls, config, db, pool, listener=None):
+        if not config.has_section('Semantic'):
+            return cls(db, pool, listener=listener)
+        section = config['Semantic']
+        return cls(
+            db, pool,
+            model=section.get('Model', DEFAULT_MODEL),
+            enabled=section.getboolean('Enabled', False),
+            batch_size=int(section.get('BatchSize', DEFAULT_BATCH_SIZE)),
+            min_score=float(section.get('MinScore', DEFAULT_MIN_SCORE)),
+            ivf_threshold=int(section.get('IVFThreshold', DEFAULT_IVF_THRESHOLD)),
+            listener=listener,
+        )
+
+    def start(self):
+        if self.available and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='semantic-index', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        # 有记录新增或修改时调用；没有启用时什么都不做
+        self._wake.set()
+
+    def forget(self, record_id):
+        # 记录被删除 (或内容被修改): 先从内存中移除，修改后的内容由后台线程重新计算
+        if self.available:
+            self.store.remove(record_id)
+            self._wake.set()
+
+    def updated(self, record_id):
+        # 记录被修改: 内容没变时 (如只改了模型) 触发器保留了数据库中的向量，内存中的也要保留，
+        # 否则后台线程不会再补算这条记录
+        if self.available:
+            self.db.submit_read(qa_db.has_embedding, record_id, self.model,
+                                callback=lambda kept: kept or self.forget(record_id),
+                                on_error=lambda e: logging.error(f"Semantic index error: {e}"))
+
+    def status_text(self):
+        if not self.available:
+            return ""
+        if not self.loaded:
+            return "Semantic index: loading..."
+        text = f"Semantic index: {len(self.store)} answers"
+        if self.pending:
+            text += f", {self.pending} to embed"
+        if self.last_error is not None:
+            text += " (embedding unavailable)"
+        return text
+
+    def embed(self, texts):
+        return embed(self.pool, self.model, texts)
+
+    def search(self, text, k, min_score=None, exclude=()):
+        """(record id, similarity) pairs most similar to text; blocks on the embedding request."""
+        if not self.available:
+            return []
+        query = self.embed([text])[0]
+        return self.store.search(query, k, self.min_score if min_score is None else min_score, exclude)
+
+    def submit(self, fn, *args, callback=None, on_error=None):
+        """Run fn(*args) off the Tk thread (it may call search); results come back through db.dispatch."""
+        def run():
+            try:
+                result = fn(*args)
+            except Exception as e:
+                if on_error:
+                    self.db.dispatch(on_error, e)
+                else:
+                    logging.error(f"Semantic search error: {e}")
+                return
+            if callback:
+                self.db.dispatch(callback, result)
+
+        self._queries.submit(run)
+
+    def _notify(self):
+        if self.listener:
+            self.listener()
+
+    def _run(self):
+        try:
+            self._load()
+        except Exception as e:
+            logging.error(f"Failed to load embeddings: {e}")
+            return
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self._backfill()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+                logging.warning(f"Embedding with {self.model} failed: {e}")
+            self._notify()
+            self._wake.wait(RETRY_SECONDS if self.last_error is not None else None)
+
+    def _load(self):
+        # 分块读入已保存的向量，读线程在块之间仍可处理界面的查询
+        after_id = 0
+        while not self._stop.is_set():
+            rows = self.db.read(qa_db.fetch_embeddings, self.model, after_id, LOAD_CHUNK)
+            if not rows:
+                break
+            self.store.add([row[0] for row in rows], numpy.stack([unpack_vector(row[1]) for row in rows]))
+            after_id = rows[-1][0]
+        self.loaded = True
+        logging.info(f"Loaded {len(self.store)} embeddings for {self.model}")
+
+    def _backfill(self):
+        self.pending = self.db.read(qa_db.count_unembedded, self.model)
+        self._notify()
+        before_id = None
+        while not self._stop.is_set():
+            rows = self.db.read(qa_db.fetch_unembedded, self.model, before_id, self.batch_size, EMBED_CHARS)
+            if not rows:
+                break
+            vectors = self.embed([embed_text(*row[1:]) for row in rows])
+            stored = set(self.db.write(qa_db.store_embeddings, self.model, rows,
+                                       [pack_vector(v) for v in vectors], EMBED_CHARS))
+            keep = [i for i, row in enumerate(rows) if row[0] in stored]
+            self.store.add([rows[i][0] for i in keep], vectors[keep])
+            before_id = rows[-1][0]
+            self.pending = max(0, self.pending - len(rows))
+            self._notify()
+        self.pending = 0
+        if self.store.needs_ivf():
+            self.store.build_ivf()
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._queries.shutdown(wait=False, cancel_futures=True)
+        if self._thread is not None:
+            self._thread.join(timeout=2)